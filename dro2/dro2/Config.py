@@ -1,23 +1,202 @@
+import copy
+import difflib
 import json
+import os
 from collections import namedtuple
+from types import MappingProxyType
+
+# Environment variables DRO2_<KEY>=<value> override keys of every config,
+# nested keys are joined by '__', e.g. DRO2_PARAM_RANGES__MIN='[0, 0, 0]'
+ENV_PREFIX = 'DRO2_'
+
+# Key naming the config file(s) a config inherits from
+EXTENDS = 'extends'
+
+REQUIRED = object()
+
+class ConfigError(ValueError):
+    """A config that does not match SCHEMA."""
+    pass
+
+class Option(object):
+    """Schema of one key of config.json.
+
+    Args:
+        kind: Type of the value, bool, int, float, str, list or dict, or a
+              tuple of them. Integers are accepted for floats and integral
+              floats for integers.
+        default: Value if the key is missing, REQUIRED if it must be set
+        choices: Allowed values
+        nullable: Accept null
+        minimum: Smallest allowed number
+    """
+    def __init__(self, kind, default=REQUIRED, choices=None, nullable=False,
+                 minimum=None):
+        self.kind = kind if isinstance(kind, tuple) else (kind,)
+        self.default = default
+        self.choices = choices
+        self.nullable = nullable or default is None
+        self.minimum = minimum
+
+    def convert(self, key, value):
+        """Check value and cast it to the kind of the option."""
+        if value is None:
+            if self.nullable:
+                return None
+            raise ConfigError("{} must not be null".format(key))
+
+        for kind in self.kind:
+            converted = _cast(kind, value)
+            if converted is not None:
+                break
+        else:
+            raise ConfigError("{} must be {}, got {!r}".format(
+                key, ' or '.join(kind.__name__ for kind in self.kind), value))
+
+        if self.choices is not None and converted not in self.choices:
+            raise ConfigError("{} must be one of {}, got {!r}".format(
+                key, sorted(self.choices), value))
+        if self.minimum is not None and converted < self.minimum:
+            raise ConfigError("{} must be at least {}, got {!r}".format(
+                key, self.minimum, value))
+        return converted
+
+def _cast(kind, value):
+    """value as kind, None if it is not one."""
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+    elif kind is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+    elif kind is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif isinstance(value, kind):
+        return value
+    return None
+
+SCHEMA = {
+    'batch_norm': Option(bool),
+    'batch_size': Option(int, minimum=1),
+    'candidate_acquisition': Option(str, 'ucb',
+                                    choices={'ei', 'ucb', 'thompson'}),
+    'candidate_selection': Option(str, 'best', choices={'best', 'diverse'}),
+    'constraints': Option(bool),
+    'curriculum': Option(list, None),
+    'discount_factor': Option(float),
+    'evaluation_epochs': Option(int, minimum=0),
+    'evaluation_period': Option(int, minimum=1),
+    'fused_lstm': Option(bool, False),
+    'heartbeat_address': Option(str, None),
+    'heartbeat_timeout_ms': Option(int, 10000, minimum=1),
+    'hidden_size': Option(int, minimum=1),
+    'instrument_error': Option(float, nullable=True, minimum=0),
+    'inter_op_threads': Option(int, 0, minimum=0),
+    'intra_op_threads': Option(int, 0, minimum=0),
+    'ip_address': Option(str),
+    'learning_rate': Option(float, minimum=0),
+    'log_path': Option(str),
+    'log_period': Option(int, minimum=1),
+    'loss_type': Option(str, choices={'naive', 'oi'}),
+    'lr_decay': Option(float, minimum=0),
+    'lr_decay_steps': Option(int, 1000, minimum=1),
+    'lr_schedule': Option(str, 'constant',
+                          choices={'constant', 'exponential', 'step'}),
+    'max_retries': Option(int, 3, minimum=0),
+    'norm_cov': Option(float, minimum=0),
+    'num_candidates': Option(int, 1, minimum=1),
+    'num_epochs': Option(int, minimum=0),
+    'num_layers': Option(int, minimum=1),
+    'num_params': Option(int, minimum=1),
+    'num_reactors': Option(int, 1, minimum=1),
+    'num_steps': Option(int, minimum=1),
+    'num_workers': Option(int, 1, minimum=1),
+    'opt_direction': Option(str, choices={'max', 'min'}),
+    'optimizer': Option(str),
+    'param_choices': Option(dict, {}),
+    'param_init': Option(list),
+    'param_names': Option(list),
+    'param_ranges': Option(dict),
+    'param_scales': Option(list, []),
+    'policy': Option(str, choices={'srnn', 'rnn', 'crnn'}),
+    'port': Option(int, minimum=0),
+    'reaction_type': Option(str, choices={'quad', 'gmm', 'mixed'}),
+    'recv_timeout_ms': Option(int, None, minimum=1),
+    'reuse': Option(bool),
+    'save_path': Option(str),
+    'trainable_init': Option(bool),
+    'unroll_length': Option(int, minimum=1),
+    'wire_format': Option(str, 'json', choices={'json', 'binary'}),
+    'zmq': Option(bool),
+}
 
 class Config(object):
     """Provides additional parsing of config.json elements.
 
+    The file is read, merged with the files it extends and with the
+    overrides, and checked against SCHEMA once, when the Config is
+    created; the accessors only look up the validated values. A Config
+    can not be changed afterwards.
+
+    A config may name one or more base configs under "extends" (paths
+    relative to the config). The bases are merged in order and the keys of
+    the config itself override theirs, dicts are merged key by key.
+
     Attributes:
         config: Parsed config.json file 
+        values: Read-only mapping of every key of SCHEMA to its value
     """
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, overrides=None, environ=None):
         """Sets json file to be parsed. (Must be open)
 
         Args:
             config_file: Open config.json file to parse
+            overrides: List of "key=value" strings applied after the
+                       environment, the value is parsed as JSON if it can
+                       be, nested keys are joined by '.'
+            environ: Mapping of environment variables, os.environ by
+                     default, see ENV_PREFIX
+
+        Raises:
+            ConfigError: The config does not match the schema
         """
 
         self.file_name = config_file.name
-        self.config = json.load(config_file,
-                       object_hook=lambda d:namedtuple('x', d.keys())(*d.values()))
+        raw = json.load(config_file)
+        raw = resolve_extends(raw, os.path.dirname(os.path.abspath(self.file_name)),
+                              [os.path.abspath(self.file_name)])
+
+        for path, value in env_overrides(os.environ if environ is None else environ):
+            set_path(raw, path, value)
+        for override in overrides or []:
+            path, value = parse_override(override)
+            set_path(raw, path, value)
+
+        values = validate(raw)
+        self.values = freeze(values)
+        self.stages = freeze(curriculum_stages(values))
+        self.config = namedtuple('x', values.keys())(*self.values.values())
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("Config is read-only")
+        object.__setattr__(self, name, value)
+
+    def to_dict(self):
+        """The validated config as plain, mutable JSON values."""
+        return thaw(self.values)
+
+    def dump(self, path):
+        """Write the validated config, with its bases and overrides applied."""
+        with open(path, 'w') as fout:
+            json.dump(self.to_dict(), fout, indent=4, sort_keys=True)
 
     def batch_norm(self):
         """
@@ -27,7 +206,7 @@ class Config(object):
             Boolean value of batch_norm
         """
         
-        return bool(self.config.batch_norm)
+        return self.values['batch_norm']
 
     def batch_size(self):
         """
@@ -37,7 +216,29 @@ class Config(object):
             Integer value of batch_size
         """
         
-        return int(self.config.batch_size)
+        return self.values['batch_size']
+
+    def candidate_acquisition(self):
+        """
+        Wrapper for candidate_acquisition of config.json.
+
+        Returns:
+            String acquisition ('ei', 'ucb' or 'thompson') ranking the
+            candidate proposals of a step
+        """
+
+        return self.values['candidate_acquisition']
+
+    def candidate_selection(self):
+        """
+        Wrapper for candidate_selection of config.json.
+
+        Returns:
+            String 'best' (each reactor runs its best candidate) or
+            'diverse' (a diverse top-k over all reactors)
+        """
+
+        return self.values['candidate_selection']
 
     def constraints(self):
         """
@@ -47,7 +248,22 @@ class Config(object):
             Boolean value of constraints
         """
         
-        return bool(self.config.constraints)
+        return self.values['constraints']
+
+    def curriculum(self):
+        """
+        Wrapper for curriculum of config.json, used by the 'mixed'
+        reaction_type.
+
+        Returns:
+            Tuple of read-only stages sorted by their starting 'epoch', with
+            the weights of the reaction families ('families'), the minimum
+            number of active parameters ('min_params') and the instrument
+            error, a number or a (min, max) range ('instrument_error').
+            One stage mixing all families if curriculum is not set.
+        """
+
+        return self.stages
 
     def discount_factor(self):
         """
@@ -57,7 +273,7 @@ class Config(object):
             Floating point value of discount_factor
         """
         
-        return float(self.config.discount_factor)
+        return self.values['discount_factor']
 
     def evaluation_epochs(self):
         """
@@ -67,7 +283,7 @@ class Config(object):
             Integer value of evaluation_epochs
         """
         
-        return int(self.config.evaluation_epochs)
+        return self.values['evaluation_epochs']
 
     def evaluation_period(self):
         """
@@ -77,7 +293,40 @@ class Config(object):
             Integer value of evaluation_period
         """
         
-        return int(self.config.evaluation_period)
+        return self.values['evaluation_period']
+
+    def fused_lstm(self):
+        """
+        Wrapper for fused_lstm of config.json.
+
+        Returns:
+            Boolean, run the LSTM layers as single fused ops. Checkpoints
+            are interchangeable with the unfused layers.
+        """
+
+        return self.values['fused_lstm']
+
+    def heartbeat_address(self):
+        """
+        Wrapper for heartbeat_address of config.json.
+
+        Returns:
+            String address of the plugin's heartbeat publisher, or None to
+            disable the heartbeat channel
+        """
+
+        return self.values['heartbeat_address']
+
+    def heartbeat_timeout(self):
+        """
+        Wrapper for heartbeat_timeout_ms of config.json.
+
+        Returns:
+            Integer milliseconds of heartbeat silence before a request is
+            retried
+        """
+
+        return self.values['heartbeat_timeout_ms']
 
     def hidden_size(self):
         """
@@ -87,18 +336,40 @@ class Config(object):
             Integer value of hidden_size
         """
         
-        return int(self.config.hidden_size)
+        return self.values['hidden_size']
 
-    # DEBUG: figure out type of instrument_error
     def instrument_error(self):
         """
         Wrapper for instrument_error of config.json.
         
         Returns:
-            ____ value of instrument_error
+            Floating point standard deviation of the noise of simulated
+            reactions, or None for none
         """
         
-        return self.config.instrument_error
+        return self.values['instrument_error']
+
+    def inter_op_threads(self):
+        """
+        Wrapper for inter_op_threads of config.json.
+
+        Returns:
+            Integer number of threads running independent ops in parallel,
+            0 lets TensorFlow decide
+        """
+
+        return self.values['inter_op_threads']
+
+    def intra_op_threads(self):
+        """
+        Wrapper for intra_op_threads of config.json.
+
+        Returns:
+            Integer number of threads used inside a single op, 0 lets
+            TensorFlow decide
+        """
+
+        return self.values['intra_op_threads']
 
     def ip_address(self):
         """
@@ -108,7 +379,7 @@ class Config(object):
             String value of IP address (without the port)
         """
 
-        return self.config.ip_address
+        return self.values['ip_address']
     
     def learning_rate(self):
         """
@@ -118,7 +389,7 @@ class Config(object):
             Floating point value of learning_rate
         """
         
-        return float(self.config.learning_rate)
+        return self.values['learning_rate']
         
     def log_path(self):
         """
@@ -128,7 +399,7 @@ class Config(object):
             String value of log_path
         """
         
-        return self.config.log_path
+        return self.values['log_path']
 
     def log_period(self):
         """
@@ -138,7 +409,7 @@ class Config(object):
             Integer value of log_period
         """
         
-        return int(self.config.log_period)
+        return self.values['log_period']
 
     def loss_type(self):
         """
@@ -148,7 +419,7 @@ class Config(object):
             String value of loss_type
         """
         
-        return self.config.loss_type
+        return self.values['loss_type']
 
     def lr_decay(self):
         """
@@ -158,8 +429,40 @@ class Config(object):
             Floating point value of lr_decay
         """
         
-        return float(self.config.lr_decay)
+        return self.values['lr_decay']
+
+    def lr_decay_steps(self):
+        """
+        Wrapper for lr_decay_steps of config.json.
+
+        Returns:
+            Integer number of updates over which the learning rate decays by
+            lr_decay
+        """
+
+        return self.values['lr_decay_steps']
+
+    def lr_schedule(self):
+        """
+        Wrapper for lr_schedule of config.json. Older config files without
+        this key train with a constant learning rate.
+
+        Returns:
+            'constant', 'exponential' or 'step'
+        """
+
+        return self.values['lr_schedule']
     
+    def max_retries(self):
+        """
+        Wrapper for max_retries of config.json.
+
+        Returns:
+            Integer number of times a request to the plugin is resent
+        """
+
+        return self.values['max_retries']
+
     def norm_cov(self):
         """
         Wrapper for norm_cov of config.json.
@@ -168,7 +471,18 @@ class Config(object):
             Floating point value of norm_cov
         """
         
-        return float(self.config.norm_cov)
+        return self.values['norm_cov']
+
+    def num_candidates(self):
+        """
+        Wrapper for num_candidates of config.json.
+
+        Returns:
+            Integer number of proposals drawn per reactor and step, 1 runs
+            the single sample of the policy
+        """
+
+        return self.values['num_candidates']
 
     def num_epochs(self):
         """
@@ -178,7 +492,7 @@ class Config(object):
             Integer value of num_epochs
         """
         
-        return int(self.config.num_epochs)
+        return self.values['num_epochs']
 
     def num_layers(self):
         """
@@ -188,7 +502,7 @@ class Config(object):
             Integer value of num_layers
         """
         
-        return int(self.config.num_layers)
+        return self.values['num_layers']
 
     def num_params(self):
         """
@@ -198,7 +512,7 @@ class Config(object):
             Integer value of num_params
         """
         
-        return int(self.config.num_params)
+        return self.values['num_params']
 
     def num_steps(self):
         """
@@ -208,7 +522,28 @@ class Config(object):
             Integer value of num_steps
         """
         
-        return int(self.config.num_steps)
+        return self.values['num_steps']
+
+    def num_reactors(self):
+        """
+        Wrapper for num_reactors of config.json. Older config files without
+        this key drive a single reactor.
+        
+        Returns:
+            Integer number of optimization trajectories run in parallel
+        """
+        
+        return self.values['num_reactors']
+
+    def num_workers(self):
+        """
+        Wrapper for num_workers of config.json, used by parallel_train.py.
+
+        Returns:
+            Integer number of training processes, each with its own batch
+        """
+
+        return self.values['num_workers']
 
     def opt_direction(self):
         """
@@ -218,7 +553,7 @@ class Config(object):
             String value of opt_direction
         """
         
-        return self.config.opt_direction
+        return self.values['opt_direction']
 
     def optimizer(self):
         """
@@ -228,7 +563,7 @@ class Config(object):
             String value of optimizer
         """
         
-        return self.config.optimizer
+        return self.values['optimizer']
         
     def param_names(self):
         """
@@ -238,33 +573,31 @@ class Config(object):
             list of strings containing parameter names
         """
         
-        return list(self.config.param_names)
+        return list(self.values['param_names'])
     
     def param_ranges(self):
         """Parse parameter ranges from the param_range in config.json. 
+
+        The number of minima and maxima is checked against num_params when
+        the config is loaded.
         
         Returns:
             ranges: list of floating point tuples representing the ranges
-            None: Mismatch in number of param names and ranges
         """
 
-        param_ranges = self.config.param_ranges
-        ranges = []  # List of tuples for ranges
+        param_ranges = self.values['param_ranges']
+        return list(zip(param_ranges['min'], param_ranges['max']))
 
-        # Check for a mismatch between the number of parameter names
-        # and the number of ranges given. This also ensures that
-        # the number of range minima equal the number of range
-        # maxima.
-        
-        if(self.num_params() != len(param_ranges.min) or
-           self.num_params() != len(param_ranges.max)):
-            return None
+    def param_choices(self):
+        """
+        Wrapper for param_choices of config.json.
 
-        for i in range(self.num_params()):
-            tmp = (param_ranges.min[i], param_ranges.max[i])  # Create tuples
-            ranges.append(tmp)  # Append tuples
+        Returns:
+            dict mapping the names of the parameters with scale 'choice' to
+            the list of their values
+        """
 
-        return ranges
+        return thaw(self.values['param_choices'])
 
     def param_init(self):
         """
@@ -274,24 +607,30 @@ class Config(object):
             list of numbers representing initial parameter values
         """
 
-        x0 = self.config.param_init
-
-        # Return None if the parameter list is not empty or has an
-        # incorrect number of parameters
-        if (len(x0) != 0 and len(x0) != self.num_params()):
-            return None
-        
-        return list(self.config.param_init)
+        return list(self.values['param_init'])
     
+    def param_scales(self):
+        """
+        Wrapper for param_scales of config.json.
+
+        Returns:
+            list with the scale of every parameter between its normalized
+            and real values: 'linear', 'log', 'int' or 'choice' (one of
+            param_choices). All linear if param_scales is empty.
+        """
+
+        return list(self.values['param_scales']) or ['linear'] * self.num_params()
+
     def policy(self):
         """
         Wrapper for policy of config.json.
         
         Returns:
-            String value of policy
+            String value of policy: 'srnn', 'rnn' or 'crnn' (coordinatewise,
+            independent of num_params)
         """
         
-        return self.config.policy
+        return self.values['policy']
 
     def port(self):
         """
@@ -301,7 +640,7 @@ class Config(object):
             Integer value of port number
         """
         
-        return int(self.config.port)
+        return self.values['port']
     
     def reaction_type(self):
         """
@@ -311,7 +650,18 @@ class Config(object):
             String value of reaction_type
         """
         
-        return self.config.reaction_type
+        return self.values['reaction_type']
+
+    def recv_timeout(self):
+        """
+        Wrapper for recv_timeout_ms of config.json.
+
+        Returns:
+            Integer milliseconds to wait for a reply from the plugin, or None
+            to wait forever
+        """
+
+        return self.values['recv_timeout_ms']
 
     def reuse(self):
         """
@@ -321,7 +671,7 @@ class Config(object):
             Boolean value of reuse
         """
         
-        return bool(self.config.reuse)
+        return self.values['reuse']
 
     def save_path(self):
         """
@@ -331,7 +681,7 @@ class Config(object):
             String value of save_path
         """
         
-        return self.config.save_path
+        return self.values['save_path']
 
     def trainable_init(self):
         """
@@ -341,7 +691,7 @@ class Config(object):
             String value of trainable_init
         """
         
-        return bool(self.config.trainable_init)
+        return self.values['trainable_init']
 
     
     def unroll_length(self):
@@ -352,7 +702,18 @@ class Config(object):
             Integer value of unroll_length
         """
         
-        return int(self.config.unroll_length)
+        return self.values['unroll_length']
+
+    def wire_format(self):
+        """
+        Wrapper for wire_format of config.json.
+
+        Returns:
+            String name of the ZMQ message format, "json" (understood by the
+            LabVIEW plugin) or "binary"
+        """
+
+        return self.values['wire_format']
 
     def zmq(self):
         """
@@ -362,8 +723,239 @@ class Config(object):
             Boolean value of whether to use ZMQ or not.
         """
 
-        return bool(self.config.zmq)
+        return self.values['zmq']
     
+def resolve_extends(raw, directory, chain):
+    """Merge the configs raw extends into raw.
+
+    Args:
+        raw: dict of a config file
+        directory: Directory relative paths in raw are resolved against
+        chain: Absolute paths of the configs being resolved, to catch cycles
+    """
+
+    bases = raw.pop(EXTENDS, [])
+    if isinstance(bases, str):
+        bases = [bases]
+
+    merged = {}
+    for base in bases:
+        path = os.path.normpath(os.path.join(directory, base))
+        if path in chain:
+            raise ConfigError("Config {} extends itself through {}".format(
+                path, ' -> '.join(chain)))
+        if not os.path.isfile(path):
+            raise ConfigError("Base config {} of {} does not exist".format(
+                path, chain[-1]))
+        with open(path) as f:
+            base_raw = json.load(f)
+        merge(merged, resolve_extends(base_raw, os.path.dirname(path),
+                                      chain + [path]))
+    return merge(merged, raw)
+
+def merge(base, update):
+    """Recursively merge the dict update into base, in place."""
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge(base[key], value)
+        else:
+            base[key] = copy.deepcopy(value)
+    return base
+
+def parse_value(text):
+    """Parse an override value as JSON, or keep it as a string."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def parse_override(override):
+    """Split "a.b=value" into (['a', 'b'], value)."""
+    key, sep, text = override.partition('=')
+    if not sep or not key:
+        raise ConfigError("Override {!r} is not of the form key=value".format(
+            override))
+    return key.strip().split('.'), parse_value(text)
+
+def env_overrides(environ):
+    """(path, value) of the DRO2_ variables naming keys of SCHEMA."""
+    overrides = []
+    for name, text in sorted(environ.items()):
+        if not name.startswith(ENV_PREFIX):
+            continue
+        path = name[len(ENV_PREFIX):].lower().split('__')
+        if path[0] in SCHEMA:
+            overrides.append((path, parse_value(text)))
+    return overrides
+
+def set_path(raw, path, value):
+    for key in path[:-1]:
+        raw = raw.setdefault(key, {})
+        if not isinstance(raw, dict):
+            raise ConfigError("Can not override {}, {} is not a dict".format(
+                '.'.join(path), key))
+    raw[path[-1]] = value
+
+def validate(raw):
+    """Check a merged config against SCHEMA.
+
+    Returns:
+        dict with a value for every key of SCHEMA
+
+    Raises:
+        ConfigError: Listing every problem of the config
+    """
+
+    errors = []
+    for key in sorted(set(raw) - set(SCHEMA)):
+        close = difflib.get_close_matches(key, SCHEMA, n=1)
+        errors.append("Unknown key {}{}".format(
+            key, ", did you mean {}?".format(close[0]) if close else ""))
+
+    values = {}
+    for key, option in SCHEMA.items():
+        try:
+            if key in raw:
+                values[key] = option.convert(key, raw[key])
+            elif option.default is REQUIRED:
+                raise ConfigError("Missing required key {}".format(key))
+            else:
+                values[key] = option.default
+        except ConfigError as e:
+            errors.append(str(e))
+
+    if not errors:
+        errors = check_params(values) + check_curriculum(values['curriculum'])
+    if errors:
+        raise ConfigError("Invalid config:\n  " + "\n  ".join(errors))
+
+    values['param_ranges'] = {key: [float(v) for v in values['param_ranges'][key]]
+                              for key in ('min', 'max')}
+    values['param_init'] = [float(v) for v in values['param_init']]
+    return values
+
+def check_params(values):
+    """Check that the parameter keys agree with num_params."""
+    errors = []
+    num_params = values['num_params']
+    if len(values['param_names']) != num_params:
+        errors.append("param_names has {} names for {} num_params".format(
+            len(values['param_names']), num_params))
+
+    ranges = values['param_ranges']
+    if set(ranges) != {'min', 'max'}:
+        errors.append("param_ranges must have exactly the keys min and max")
+    elif not all(isinstance(ranges[key], list) and len(ranges[key]) == num_params
+                 and all(_cast(float, v) is not None for v in ranges[key])
+                 for key in ('min', 'max')):
+        errors.append("param_ranges min and max must be lists of {} "
+                      "numbers".format(num_params))
+    elif any(low >= high for low, high in zip(ranges['min'], ranges['max'])):
+        errors.append("param_ranges min must be below max")
+
+    scales = values['param_scales'] or ['linear'] * num_params
+    choices = values['param_choices']
+    if len(scales) != num_params:
+        errors.append("param_scales has {} scales for {} num_params".format(
+            len(scales), num_params))
+    elif any(scale not in ('linear', 'log', 'int', 'choice') for scale in scales):
+        errors.append("param_scales must be 'linear', 'log', 'int' or 'choice'")
+    elif not errors:
+        names = values['param_names']
+        for name, scale, low in zip(names, scales, ranges['min']):
+            if scale == 'log' and low <= 0:
+                errors.append("Log-scale parameter {} needs a positive "
+                              "minimum".format(name))
+            if (scale == 'choice') != (name in choices):
+                errors.append("Parameter {} needs param_choices if and only if "
+                              "its scale is choice".format(name))
+        for name, options in choices.items():
+            if (name not in names or not isinstance(options, list) or not options
+                    or any(_cast(float, v) is None for v in options)):
+                errors.append("param_choices of {} must be a non-empty list of "
+                              "numbers of a parameter in param_names".format(name))
+
+    x0 = values['param_init']
+    if len(x0) not in (0, num_params):
+        errors.append("param_init has {} values, expected 0 or {}".format(
+            len(x0), num_params))
+    elif any(_cast(float, v) is None for v in x0):
+        errors.append("param_init must hold numbers")
+    return errors
+
+def check_curriculum(stages):
+    """Check the stages of a curriculum, see Config.curriculum."""
+    errors = []
+    for i, stage in enumerate(stages or []):
+        if not isinstance(stage, dict):
+            errors.append("curriculum stage {} must be a dict".format(i))
+            continue
+        unknown = set(stage) - {'epoch', 'families', 'min_params',
+                                'instrument_error'}
+        if unknown:
+            errors.append("curriculum stage {} has unknown keys {}".format(
+                i, sorted(unknown)))
+        families = stage.get('families')
+        if families is not None and not isinstance(families, dict):
+            errors.append("families of curriculum stage {} must be a dict".format(i))
+    return errors
+
+def curriculum_stages(values):
+    """Stages of a validated config sorted by epoch, see Config.curriculum."""
+    stages = values['curriculum']
+    if not stages:
+        return [{'epoch': 0, 'families': None, 'min_params': None,
+                 'instrument_error': values['instrument_error']}]
+
+    stages = [dict(stage) for stage in stages]
+    for stage in stages:
+        stage.setdefault('epoch', 0)
+    return sorted(stages, key=lambda stage: stage['epoch'])
+
+def freeze(value):
+    """Read-only copy of JSON values: dicts become mappings, lists tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value):
+    """Plain JSON values of a frozen value."""
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+_cache = {}
+
+def load_config(path, overrides=None):
+    """Load the config at path, reusing it if it was loaded before.
+
+    Configs are read-only, so every caller in a process (e.g. the runs of
+    a sweep) shares one instance per file, overrides and environment.
+    Changing the file invalidates its entry.
+    """
+
+    environ = tuple((name, value) for name, value in sorted(os.environ.items())
+                    if name.startswith(ENV_PREFIX))
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns,
+           tuple(overrides or []), environ)
+    if key not in _cache:
+        with open(path) as config_file:
+            _cache[key] = Config(config_file, overrides)
+    return _cache[key]
+
+def add_override_argument(parser):
+    """Add the --set KEY=VALUE option of load_config to an ArgumentParser."""
+    parser.add_argument("--set", dest="overrides", action="append",
+                        default=[], metavar="KEY=VALUE",
+                        help="Override a key of the config file, e.g. "
+                        "--set num_steps=20 or --set param_ranges.min=[0,0,0]. "
+                        "Variables {}<KEY> of the environment override keys "
+                        "too.".format(ENV_PREFIX))
+
 # For testing purposes only
 
 if __name__ == "__main__":
@@ -372,6 +964,7 @@ if __name__ == "__main__":
 
     print("file_name: " + str(p.file_name))
     print("num_params: " + str(p.num_params()))
+    print("num_reactors: " + str(p.num_reactors()))
     print("param_names: " + str(p.param_names()))
     print("param_ranges: " + str(p.param_ranges()))
     print("param_init: " + str(p.param_init()))
@@ -403,3 +996,8 @@ if __name__ == "__main__":
     print("zmq: " + str(p.zmq()))
     print("ip_address: " + str(p.ip_address()))
     print("port: " + str(p.port()))
+    print("recv_timeout: " + str(p.recv_timeout()))
+    print("max_retries: " + str(p.max_retries()))
+    print("heartbeat_address: " + str(p.heartbeat_address()))
+    print("heartbeat_timeout: " + str(p.heartbeat_timeout()))
+    print("wire_format: " + str(p.wire_format()))
@@ -1,315 +1,143 @@
 import tensorflow as tf
 
 import base
-
-from tensorflow.contrib.layers.python.layers import utils
+import util
 
 class BatchNorm():
+    """Batch normalization with moving statistics indexed by time step.
+
+    Recurrent batch norm keeps separate statistics for the first time steps
+    of a sequence, the activations of an LSTM drift too much over a rollout
+    for one set of statistics. The moving mean and variance are
+    [max_unique_stats, size] variables; step t reads and updates row
+    min(t, max_unique_stats - 1), so all later steps share the last row.
+
+    In training the batch statistics normalize the inputs and the moving
+    statistics of the step are updated as a side effect of the output, so
+    the update also runs inside a while_loop. In inference
+    (is_training=False, test_local_stats=False) the frozen moving
+    statistics are used and nothing is updated.
+    """
     GAMMA = "gamma"
     BETA = "beta"
     POSSIBLE_INITIALIZER_KEYS = {GAMMA, BETA}
 
-    def __init__(self, reduction_indices=None, offset=True, scale=False,
-        decay_rate=0.999, eps=1e-3, initializers=None,
-        use_legacy_moving_second_moment=False,
-        name="batch_norm"):
-
-        self._reduction_indices = reduction_indices
+    def __init__(self, max_unique_stats=1, offset=True, scale=False,
+                 decay_rate=0.999, eps=1e-3, initializers=None,
+                 name="batch_norm"):
+        if max_unique_stats < 1:
+            raise ValueError("max_unique_stats must be >= 1")
+        self._max_unique_stats = max_unique_stats
         self._offset = offset
         self._scale = scale
         self._decay_rate = decay_rate
         self._eps = eps
-        self._use_legacy_moving_second_moment = use_legacy_moving_second_moment
+        self._name = name
         self._initializers = util.check_initializers(
             initializers, self.POSSIBLE_INITIALIZER_KEYS)
 
-    def _set_default_initializer(self, var_name):
-        if var_name not in self._initializers:
-            if var_name == self.GAMMA:
-                self._initializers[self.GAMMA] = tf.ones_initializer()
-            elif var_name == self.BETA:
-                self._initializers[self.BETA] = tf.zeros_initializer
-
-    def _build_statistics_variance(self, input_batch,
-        reduction_indices, use_batch_stats):
+    def _create_variables(self, size, dtype):
+        stats_shape = [self._max_unique_stats, size]
         self._moving_mean = tf.get_variable(
-            "moving_mean",
-            shape=self._mean_shape,
+            "moving_mean", shape=stats_shape, dtype=dtype,
             collections=[tf.GraphKeys.MOVING_AVERAGE_VARIABLES,
-                         tf.GraphKeys.VARIABLES],
-            initializer=tf.zeros_initializer,
-            trainable=False)
-
+                         tf.GraphKeys.GLOBAL_VARIABLES],
+            initializer=tf.zeros_initializer(), trainable=False)
         self._moving_variance = tf.get_variable(
-            "moving_variance",
-            shape=self._mean_shape,
-            collections=[tf.GraphKeys.MOVING_AVERAGE_VARIABLES,
-                         tf.GraphKeys.VARIABLES],
-            initializer=tf.ones_initializer(),
-            trainable=False)
-
-        def build_batch_stats():
-            """Builds the batch statistics calculation ops."""
-            shift = tf.add(self._moving_mean, 0)
-            counts, shifted_sum_x, shifted_sum_x2, _ = tf.nn.sufficient_statistics(
-                input_batch,
-                reduction_indices,
-                keep_dims=True,
-                shift=shift,
-                name="batch_norm_ss")
-
-            mean, variance = tf.nn.normalize_moments(counts,
-                                               shifted_sum_x,
-                                               shifted_sum_x2,
-                                               shift,
-                                               name="normalize_moments")
-
-            return mean, variance
-
-        def build_moving_stats():
-            return (
-                tf.identity(self._moving_mean),
-                tf.identity(self._moving_variance),)
-
-        mean, variance = utils.smart_cond(
-            use_batch_stats,
-            build_batch_stats,
-            build_moving_stats,
-        )
-
-        return mean, variance
-
-    def _build_statistics_second_moment(self, input_batch,
-        reduction_indices, use_batch_stats):
-        self._moving_mean = tf.get_variable(
-            "moving_mean",
-            shape=self._mean_shape,
-            collections=[tf.GraphKeys.MOVING_AVERAGE_VARIABLES,
-                         tf.GraphKeys.VARIABLES],
-            initializer=tf.zeros_initializer,
-            trainable=False)
-
-        self._moving_second_moment = tf.get_variable(
-            "moving_second_moment",
-            shape=self._mean_shape,
+            "moving_variance", shape=stats_shape, dtype=dtype,
             collections=[tf.GraphKeys.MOVING_AVERAGE_VARIABLES,
-                         tf.GraphKeys.VARIABLES],
-            initializer=tf.ones_initializer(),
-            trainable=False)
-
-        self._moving_variance = tf.sub(self._moving_second_moment,
-                                       tf.square(self._moving_mean),
-                                       name="moving_variance")
-
-        def build_batch_stats():
-            shift = tf.add(self._moving_mean, 0)
-            counts, shifted_sum_x, shifted_sum_x2, _ = tf.nn.sufficient_statistics(
-                input_batch,
-                reduction_indices,
-                keep_dims=True,
-                shift=shift,
-                name="batch_norm_ss")
-
-            mean, variance = tf.nn.normalize_moments(counts,
-                                               shifted_sum_x,
-                                               shifted_sum_x2,
-                                               shift,
-                                               name="normalize_moments")
-            second_moment = variance + tf.square(mean)
-
-            return mean, variance, second_moment
-
-        def build_moving_stats():
-            return (
-                tf.identity(self._moving_mean),
-                tf.identity(self._moving_variance),
-                tf.identity(self._moving_second_moment),
-            )
-
-        mean, variance, second_moment = utils.smart_cond(
-            use_batch_stats,
-            build_batch_stats,
-            build_moving_stats,
-        )
-
-        return mean, variance, second_moment
-
-    def _build_update_ops_variance(self, mean, variance, is_training):
-        def build_update_ops():
-            update_mean_op = moving_averages.assign_moving_average(
-              variable=self._moving_mean,
-              value=mean,
-              decay=self._decay_rate,
-              name="update_moving_mean").op
-
-            update_variance_op = moving_averages.assign_moving_average(
-              variable=self._moving_variance,
-              value=variance,
-              decay=self._decay_rate,
-              name="update_moving_variance").op
-
-            return update_mean_op, update_variance_op
-
-        def build_no_ops():
-            return (tf.no_op(), tf.no_op())
-
-            # Only make the ops if we know that `is_training=True`, or the
-            # value of `is_training` is unknown.
-        is_training_const = utils.constant_value(is_training)
-        if is_training_const is None or is_training_const:
-            update_mean_op, update_variance_op = utils.smart_cond(
-                is_training,
-                build_update_ops,
-                build_no_ops,
-            )
-
-          # Every new connection creates a new op which adds its contribution
-          # to the running average when ran.
-        tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, update_mean_op)
-        tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, update_variance_op)
-
-    def _build_update_ops_second_moment(self, mean, second_moment, is_training):
-        def build_update_ops():
-            update_mean_op = moving_averages.assign_moving_average(
-              variable=self._moving_mean,
-              value=mean,
-              decay=self._decay_rate,
-              name="update_moving_mean").op
-
-            update_second_moment_op = moving_averages.assign_moving_average(
-              variable=self._moving_second_moment,
-              value=second_moment,
-              decay=self._decay_rate,
-              name="update_moving_second_moment").op
+                         tf.GraphKeys.GLOBAL_VARIABLES],
+            initializer=tf.ones_initializer(), trainable=False)
 
-            return update_mean_op, update_second_moment_op
-
-        def build_no_ops():
-            return (tf.no_op(), tf.no_op())
-
-        is_training_const = utils.constant_value(is_training)
-        if is_training_const is None or is_training_const:
-            update_mean_op, update_second_moment_op = utils.smart_cond(
-                is_training,
-                build_update_ops,
-                build_no_ops,
-                )
-
-        tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, update_mean_op)
-        tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, update_second_moment_op)
-
-    def _build(self, input_batch, is_training=True, test_local_stats=True):
+        self._beta = None
+        if self._offset:
+            self._beta = tf.get_variable(
+                self.BETA, shape=[size], dtype=dtype,
+                initializer=self._initializers.get(self.BETA,
+                                                   tf.zeros_initializer()))
+        self._gamma = None
+        if self._scale:
+            self._gamma = tf.get_variable(
+                self.GAMMA, shape=[size], dtype=dtype,
+                initializer=self._initializers.get(self.GAMMA,
+                                                   tf.ones_initializer()))
+
+    def _update_moving_stats(self, index, mean, variance):
+        """Move row index of the moving statistics towards mean, variance."""
+        decay = self._decay_rate
+        updates = []
+        for moving, value in ((self._moving_mean, mean),
+                              (self._moving_variance, variance)):
+            old = tf.gather(moving, index)
+            updates.append(tf.scatter_update(
+                moving, index, decay * old + (1 - decay) * value))
+        return updates
+
+    def __call__(self, input_batch, index=None, is_training=True,
+                 test_local_stats=True):
+        """Normalize a [batch_size, size] batch.
+
+        Args:
+            input_batch: Inputs to normalize
+            index: int32 scalar time step, None for the first row of
+                   statistics
+            is_training: Python bool, update the moving statistics
+            test_local_stats: Python bool, normalize with the batch
+                              statistics even if not training
+        """
 
         input_shape = input_batch.get_shape()
-
-        if self._reduction_indices is not None:
-            if len(self._reduction_indices) > len(input_shape):
-                raise base.IncompatibleShapeError(
-                    "Too many reduction indices specified.")
-
-            if max(self._reduction_indices) >= len(input_shape):
-                raise base.IncompatibleShapeError(
-                    "Reduction index too large for input shape.")
-
-            if min(self._reduction_indices) < 0:
-                raise base.IncompatibleShapeError(
-                    "Reduction indeces must be non-negative.")
-
-            reduction_indices = self._reduction_indices
-        else:
-            reduction_indices = range(len(input_shape))[:-1]
-
+        if input_shape.ndims != 2:
+            raise base.IncompatibleShapeError(
+                "BatchNorm expects [batch_size, size] inputs, got {}".format(
+                    input_shape))
         if input_batch.dtype == tf.float16:
             raise base.NotSupportedError(
                 "BatchNorm does not support `tf.float16`, insufficient "
                 "precision for calculating sufficient statistics.")
 
-        self._mean_shape = input_batch.get_shape().as_list()
-        for index in reduction_indices:
-            self._mean_shape[index] = 1
-
-        use_batch_stats = is_training | test_local_stats
-
-        # Use the legacy moving second moment if the flag is set.
-        if self._use_legacy_moving_second_moment:
-            tf.logging.warning(
-                "nn.BatchNorm `use_legacy_second_moment=True` is deprecated.")
-
-            mean, variance, second_moment = self._build_statistics_second_moment(
-                    input_batch,
-                    reduction_indices,
-                    use_batch_stats)
-
-            self._build_update_ops_second_moment(mean, second_moment, is_training)
-        else:
-            mean, variance = self._build_statistics_variance(
-                input_batch,
-                reduction_indices,
-                use_batch_stats)
-
-            self._build_update_ops_variance(mean, variance, is_training)
-
-            # Set up optional scale and offset factors.
-        if self._offset:
-            self._set_default_initializer(self.BETA)
-            self._beta = tf.get_variable(
-                self.BETA,
-                shape=self._mean_shape,
-                initializer=self._initializers[self.BETA])
-        else:
-            self._beta = None
-
-        if self._scale:
-            self._set_default_initializer(self.GAMMA)
-            self._gamma = tf.get_variable(
-                self.GAMMA,
-                shape=self._mean_shape,
-                initializer=self._initializers[self.GAMMA])
-        else:
-            self._gamma = None
-
-        out = tf.nn.batch_normalization(
-            input_batch,
-            mean,
-            variance,
-            self._beta,
-            self._gamma,
-            self._eps,
-            name="batch_norm")
-
+        with tf.variable_scope(self._name):
+            self._create_variables(input_shape[1].value,
+                                   input_batch.dtype.base_dtype)
+
+            if index is None:
+                index = tf.constant(0, dtype=tf.int32)
+            index = tf.reshape(tf.minimum(index, self._max_unique_stats - 1), [1])
+
+            if is_training or test_local_stats:
+                mean, variance = tf.nn.moments(input_batch, axes=[0],
+                                               keep_dims=True)
+            else:
+                mean = tf.gather(self._moving_mean, index)
+                variance = tf.gather(self._moving_variance, index)
+
+            out = tf.nn.batch_normalization(input_batch, mean, variance,
+                                            self._beta, self._gamma,
+                                            self._eps, name="batch_norm")
+            if is_training:
+                with tf.control_dependencies(
+                        self._update_moving_stats(index, mean, variance)):
+                    out = tf.identity(out)
         return out
 
     @property
     def moving_mean(self):
-        self._ensure_is_connected()
         return self._moving_mean
 
-    @property
-    def moving_second_moment(self):
-        self._ensure_is_connected()
-        return self._moving_second_moment
-
     @property
     def moving_variance(self):
-        self._ensure_is_connected()
         return self._moving_variance
 
     @property
     def beta(self):
-        self._ensure_is_connected()
-
         if self._beta is None:
             raise base.Error(
                 "Batch normalization doesn't have an offset, so no beta")
-        else:
-            return self._beta
+        return self._beta
 
     @property
     def gamma(self):
-        self._ensure_is_connected()
-
         if self._gamma is None:
             raise base.Error(
                 "Batch normalization doesn't have a scale, so no gamma")
-        else:
-            return self._gamma
+        return self._gamma
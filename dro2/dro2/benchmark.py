@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""Compare DRO, GPOpt and random search on simulated reactions.
+
+Every optimizer runs the same seeded trajectories on each problem and the
+results are written to a JSON report:
+
+    python benchmark.py --optimizers random gp dro \
+        --config ../config/default-config.json --output report.json
+
+Regret is measured against the optimum of each problem instance, all
+problems are maximized in the normalized [0, 1]^ndim space. With
+--baseline, the report is compared against an earlier one and the exit
+status is 1 if quality or latency regressed by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.optimize import minimize
+
+from gmm import GMM
+from gp import GPOpt
+from objectives import QuadraticEval, ConstraintQuadraticEval
+
+PROBLEMS = ('quadratic', 'constraint_quadratic', 'gmm')
+OPTIMIZERS = ('random', 'gp', 'dro')
+
+# Modules whose cold import time is reported, in a fresh interpreter each
+STARTUP_MODULES = ('np_policy', 'gp', 'realreaction')
+
+# Random streams derived from the seed of a trajectory
+PROBLEM_STREAM = 0
+OPTIMIZER_STREAM = 1
+
+def stream_seed(seed, stream):
+    """Seed of one independent random stream of a trajectory seed.
+
+    The problem and the optimizer must not share a stream, otherwise the
+    optimizer replays the draws that placed the optimum.
+    """
+    return int(np.random.RandomState([seed, stream]).randint(2**31 - 1))
+
+def make_problem(name, ndim, seed, norm_cov=0.3):
+    """Create a seeded problem instance.
+
+    The instance is drawn from the problem stream of seed, see stream_seed.
+
+    Returns:
+        func: Objective taking one [ndim] point and returning a float
+        optimum: Best value of func on [0, 1]^ndim
+    """
+
+    seed = stream_seed(seed, PROBLEM_STREAM)
+    rng = np.random.RandomState(seed)
+    if name == 'quadratic':
+        # 1 - ||(x - a) W||^2 / normalizer, maximal at x = a
+        problem = QuadraticEval(num_dim=ndim, random=None, ptype='concave',
+                                rng=rng)
+        func = lambda x: problem(np.reshape(x, (1, ndim)))
+        return func, 1.0
+    if name == 'constraint_quadratic':
+        problem = ConstraintQuadraticEval(num_dim=ndim, random=None,
+                                          ptype='concave', ifprint=False,
+                                          rng=rng)
+        # The log barrier is infinite on the boundary, so conditions are
+        # kept inside the range StepOptimizer clips to with constraints
+        func = lambda x: problem(np.clip(np.reshape(x, (1, ndim)), 0.01, 0.99))
+        return func, func(problem.a)
+    if name == 'gmm':
+        problem = GMM(ndim=ndim, cov=norm_cov, rng=rng)
+        func = lambda x: problem(np.reshape(x, ndim))
+        return func, search_optimum(problem, ndim, seed)
+    raise ValueError("Unknown problem {}, expected one of {}".format(
+        name, PROBLEMS))
+
+def search_optimum(func, ndim, seed, npoints=4096, nrestarts=10):
+    """Numerically maximize a batched objective on [0, 1]^ndim."""
+
+    rng = np.random.RandomState(seed)
+    x = rng.rand(npoints, ndim)
+    y = func(x)
+    best = np.max(y)
+    for i in np.argsort(-y)[:nrestarts]:
+        res = minimize(lambda z: -func(z), x[i], method='L-BFGS-B',
+                       bounds=[(0, 1)] * ndim)
+        best = max(best, -res.fun)
+    return float(best)
+
+class TimedObjective:
+    """Record the values returned by an objective and the proposal times.
+
+    The time between an evaluation returning and the next evaluation being
+    requested is spent by the optimizer, so it is the proposal latency.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.y = []
+        self.proposal_times = []
+        self.last = time.perf_counter()
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=float)
+        values = []
+        for row in x.reshape(-1, x.shape[-1]):
+            self.proposal_times.append(time.perf_counter() - self.last)
+            values.append(self.func(row))
+            self.y.append(values[-1])
+            self.last = time.perf_counter()
+        return values[0] if len(values) == 1 else np.array(values)
+
+def run_random(func, ndim, nsteps, seed, **kwargs):
+    rng = np.random.RandomState(seed)
+    for i in range(nsteps + 1):
+        func(rng.rand(ndim))
+
+def run_gp(func, ndim, nsteps, seed, acquisition='ei', lengthscale=1.0,
+           noise=1.0, **kwargs):
+    opt = GPOpt(ndim, prange=[(0, 1)] * ndim, acquisition=acquisition,
+                seed=seed, lengthscale=lengthscale, noise=noise)
+    for i in range(nsteps + 1):
+        x = opt.next()
+        opt.update(x, func(x))
+
+def run_dro(func, ndim, nsteps, seed, cell=None, constraints=False, **kwargs):
+    from np_policy import NumpyStepOptimizer
+
+    np.random.seed(seed)
+    cell.rng = np.random.RandomState(seed)
+    optimizer = NumpyStepOptimizer(cell=cell, func=func, ndim=ndim,
+                                   nsteps=nsteps, logger=None,
+                                   constraints=constraints)
+    optimizer.run()
+
+RUNNERS = {'random': run_random, 'gp': run_gp, 'dro': run_dro}
+
+def run_trajectory(optimizer, problem, ndim, nsteps, seed, **kwargs):
+    """Run one optimizer on one problem instance.
+
+    Returns:
+        regret: [nsteps + 1] simple regret after every evaluation
+        proposal_times: seconds spent proposing each point
+    """
+
+    func, optimum = make_problem(problem, ndim, seed)
+    timed = TimedObjective(func)
+    RUNNERS[optimizer](timed, ndim, nsteps,
+                       stream_seed(seed, OPTIMIZER_STREAM), **kwargs)
+    best = np.maximum.accumulate(np.array(timed.y, dtype=float))
+    return optimum - best, np.array(timed.proposal_times)
+
+def peak_memory(optimizer, problem, ndim, nsteps, seed, **kwargs):
+    """Peak traced allocation of one trajectory in KiB.
+
+    Tracing slows everything down, so this runs separately from the
+    trajectories that are timed.
+    """
+
+    # Finding the optimum of a problem instance is not part of the run
+    func, _ = make_problem(problem, ndim, seed)
+    tracemalloc.start()
+    try:
+        RUNNERS[optimizer](TimedObjective(func), ndim, nsteps,
+                           stream_seed(seed, OPTIMIZER_STREAM), **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+def import_time(module):
+    """Seconds to import module in a fresh interpreter, None if it fails."""
+
+    code = ("import time; t = time.perf_counter(); import {}; "
+            "print(time.perf_counter() - t)").format(module)
+    proc = subprocess.run([sys.executable, '-c', code],
+                          cwd=os.path.dirname(os.path.abspath(__file__)),
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        return None
+    return float(proc.stdout.decode().strip().splitlines()[-1])
+
+def summarize(regrets, times, peak):
+    regrets = np.array(regrets)
+    times = np.concatenate(times) * 1000
+    return {
+        'ntrajectories': len(regrets),
+        'regret_mean': regrets.mean(axis=0).tolist(),
+        'regret_std': regrets.std(axis=0).tolist(),
+        'final_regret_mean': float(regrets[:, -1].mean()),
+        'final_regret_std': float(regrets[:, -1].std()),
+        'proposal_ms_mean': float(times.mean()),
+        'proposal_ms_p50': float(np.percentile(times, 50)),
+        'proposal_ms_p95': float(np.percentile(times, 95)),
+        'peak_memory_kib': peak,
+    }
+
+def compare_reports(report, baseline, tolerance):
+    """List regressions of report against baseline.
+
+    A regression is a final regret or a mean proposal time more than
+    tolerance (relative) above the baseline.
+    """
+
+    regressions = []
+    for problem, results in report['results'].items():
+        for optimizer, result in results.items():
+            base = baseline.get('results', {}).get(problem, {}).get(optimizer)
+            if base is None:
+                continue
+            for key in ('final_regret_mean', 'proposal_ms_mean'):
+                if result[key] > base[key] * (1 + tolerance) + 1e-12:
+                    regressions.append('{}/{} {}: {:.4g} -> {:.4g}'.format(
+                        problem, optimizer, key, base[key], result[key]))
+    return regressions
+
+def parse_args():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+
+    parser.add_argument("--problems", nargs='+', choices=PROBLEMS,
+                        default=list(PROBLEMS))
+    parser.add_argument("--optimizers", nargs='+', choices=OPTIMIZERS,
+                        default=['random', 'gp'])
+    parser.add_argument("--ndim", type=int, default=3)
+    parser.add_argument("--nsteps", type=int, default=50,
+                        help="Proposals per trajectory after the first point")
+    parser.add_argument("--ntrajectories", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--acquisition", default='ei',
+                        help="Acquisition function of the gp optimizer")
+    parser.add_argument("--gp_lengthscale", type=float, default=0.5)
+    parser.add_argument("--gp_noise", type=float, default=1e-2)
+    parser.add_argument("--config", default=None,
+                        help="Config file of the trained model, needed by dro")
+    parser.add_argument("--weights", default=None,
+                        help="Policy weights for dro (defaults to "
+                        "policy_weights.npz inside save_path)")
+    parser.add_argument("--output", default=None,
+                        help="Report file, printed to stdout if not given")
+    parser.add_argument("--baseline", default=None,
+                        help="Earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    return args
+
+def load_dro_cell(args):
+    from Config import load_config
+    from np_policy import create_cell, load_weights
+
+    if args.config is None:
+        raise ValueError("The dro optimizer needs --config")
+    config = load_config(args.config)
+    weights_path = args.weights
+    if weights_path is None:
+        weights_path = os.path.join(config.save_path(), 'policy_weights.npz')
+
+    start = time.perf_counter()
+    cell = create_cell(config, load_weights(weights_path))
+    return cell, config.constraints(), time.perf_counter() - start
+
+def main():
+
+    # Parse command line arguments
+    args = parse_args()
+
+    report = {
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'baseline')},
+        'startup_s': {module: import_time(module) for module in STARTUP_MODULES},
+        'results': {},
+    }
+
+    kwargs = {'acquisition': args.acquisition,
+              'lengthscale': args.gp_lengthscale, 'noise': args.gp_noise}
+    if 'dro' in args.optimizers:
+        kwargs['cell'], kwargs['constraints'], load_time = load_dro_cell(args)
+        report['startup_s']['dro_weights'] = load_time
+
+    seeds = [args.seed + i for i in range(args.ntrajectories)]
+    for problem in args.problems:
+        report['results'][problem] = {}
+        for optimizer in args.optimizers:
+            regrets, times = [], []
+            for seed in seeds:
+                regret, proposal_times = run_trajectory(
+                    optimizer, problem, args.ndim, args.nsteps, seed, **kwargs)
+                regrets.append(regret)
+                times.append(proposal_times)
+            peak = peak_memory(optimizer, problem, args.ndim, args.nsteps,
+                               seeds[0], **kwargs)
+            result = summarize(regrets, times, peak)
+            report['results'][problem][optimizer] = result
+            print('{:>22} {:>8}: final regret {:.4f} +- {:.4f}, '
+                  '{:.2f} ms per proposal, {:.0f} KiB peak'.format(
+                      problem, optimizer, result['final_regret_mean'],
+                      result['final_regret_std'], result['proposal_ms_mean'],
+                      peak), file=sys.stderr)
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare_reports(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+def test_independent_streams(nsteps=50):
+    """Random search must not replay the draws of the quadratic's optimum."""
+    for ndim in (2, 3, 6):
+        for seed in range(6):
+            rng = np.random.RandomState(stream_seed(seed, PROBLEM_STREAM))
+            a = QuadraticEval(num_dim=ndim, random=None, ptype='concave',
+                              rng=rng).a[0]
+            points = []
+            run_random(points.append, ndim, nsteps,
+                       stream_seed(seed, OPTIMIZER_STREAM))
+            distance = np.min(np.abs(np.array(points) - a))
+            assert distance > 1e-9, (
+                'Random search sampled the optimum of seed {}'.format(seed))
+
+if __name__ == '__main__':
+    main()
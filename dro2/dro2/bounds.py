@@ -0,0 +1,109 @@
+import functools
+import numpy as np
+
+# Scales of a parameter between its unit interval and its real range
+LINEAR = 'linear'
+LOG = 'log'
+INT = 'int'
+CHOICE = 'choice'
+SCALES = (LINEAR, LOG, INT, CHOICE)
+
+class Bounds:
+    """Conversion between the unit cube of the policy and real conditions.
+
+    Every parameter has a scale:
+
+        linear: real = min + u * (max - min)
+        log:    real = min * (max / min) ** u, for ranges spanning decades
+        int:    the integers min..max, each owning an equal part of [0, 1]
+        choice: one of a list of values, each owning an equal part of [0, 1]
+
+    Both directions work on arrays of any shape ending in ndim, so a batch
+    of proposals or a whole replayed history converts in one call. Linear
+    and log parameters are not clipped, like the affine conversion this
+    replaces. Discrete parameters are clipped to their values, and
+    to_unit maps a value to the centre of its part of [0, 1], so
+    to_real(to_unit(real)) == real exactly for valid conditions. For
+    continuous parameters to_unit(to_real(u)) == u up to rounding.
+
+    Args:
+        ranges: (min, max) of each parameter
+        scales: Scale of each parameter, all linear by default
+        choices: dict mapping the index of every choice parameter to the
+                 list of its values
+    """
+    def __init__(self, ranges, scales=None, choices=None):
+        ranges = np.array(ranges, dtype=float).reshape(-1, 2)
+        self.ndim = len(ranges)
+        self.low, self.high = ranges[:, 0], ranges[:, 1]
+        self.width = self.high - self.low
+        self.scales = list(scales) if scales is not None else [LINEAR] * self.ndim
+        self.choices = {int(i): np.array(values, dtype=float)
+                        for i, values in (choices or {}).items()}
+
+        if len(self.scales) != self.ndim:
+            raise ValueError("Expected {} scales, got {}".format(
+                self.ndim, len(self.scales)))
+        for i, scale in enumerate(self.scales):
+            if scale not in SCALES:
+                raise ValueError("Unknown scale {}, expected one of {}".format(
+                    scale, SCALES))
+            if (scale == CHOICE) != (i in self.choices):
+                raise ValueError("Parameter {} needs values if and only if its "
+                                 "scale is {}".format(i, CHOICE))
+        if any(self.low[i] <= 0 for i in self.indices(LOG)):
+            raise ValueError("Log-scale parameters need a positive minimum")
+
+        self.linear = self.indices(LINEAR)
+        self.log = self.indices(LOG)
+        self.int = self.indices(INT)
+        self.log_low = np.log(self.low[self.log])
+        self.log_width = np.log(self.high[self.log]) - self.log_low
+        # Number of integers of each int parameter
+        self.int_count = np.round(self.width[self.int]) + 1
+
+    def indices(self, scale):
+        return np.array([i for i, s in enumerate(self.scales) if s == scale],
+                        dtype=int)
+
+    def to_real(self, x):
+        """Real conditions of normalized points x, [..., ndim]."""
+        x = np.asarray(x, dtype=float)
+        real = np.empty(x.shape)
+        lin = self.linear
+        real[..., lin] = self.low[lin] + x[..., lin] * self.width[lin]
+        real[..., self.log] = np.exp(self.log_low + x[..., self.log] * self.log_width)
+        if len(self.int):
+            k = np.clip(np.floor(x[..., self.int] * self.int_count),
+                        0, self.int_count - 1)
+            real[..., self.int] = self.low[self.int] + k
+        for i, values in self.choices.items():
+            k = np.clip(np.floor(x[..., i] * len(values)), 0, len(values) - 1)
+            real[..., i] = values[k.astype(int)]
+        return real
+
+    def to_unit(self, real):
+        """Normalized points of real conditions, [..., ndim]."""
+        real = np.asarray(real, dtype=float)
+        x = np.empty(real.shape)
+        lin = self.linear
+        x[..., lin] = (real[..., lin] - self.low[lin]) / self.width[lin]
+        x[..., self.log] = (np.log(real[..., self.log]) - self.log_low) / self.log_width
+        if len(self.int):
+            k = np.clip(np.round(real[..., self.int] - self.low[self.int]),
+                        0, self.int_count - 1)
+            x[..., self.int] = (k + 0.5) / self.int_count
+        for i, values in self.choices.items():
+            # The closest value, so rounding errors of the caller do not matter
+            k = np.argmin(np.abs(real[..., i, np.newaxis] - values), axis=-1)
+            x[..., i] = (k + 0.5) / len(values)
+        return x
+
+@functools.lru_cache(maxsize=None)
+def config_bounds(config):
+    """Bounds of the parameters of a Config, built once per config."""
+    names = config.param_names()
+    choices = {names.index(name): values
+               for name, values in config.param_choices().items()}
+    return Bounds(config.param_ranges(), scales=config.param_scales(),
+                  choices=choices)
@@ -0,0 +1,181 @@
+import glob
+import hashlib
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+import tensorflow as tf
+
+def existing_checkpoints(save_dir):
+    """Metadata of the checkpoints written earlier into save_dir."""
+    metas = []
+    for meta_path in glob.glob(os.path.join(save_dir, 'model.ckpt-*.json')):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        prefix = os.path.join(save_dir, meta['checkpoint'])
+        if os.path.exists(prefix + '.index'):
+            metas.append(meta)
+    return metas
+
+def next_epoch(save_dir):
+    """First epoch after the checkpoints in save_dir, 0 if there are none.
+
+    A resumed run numbers its epochs from here, so it never writes to the
+    prefix of a checkpoint that is still kept.
+    """
+    if save_dir is None:
+        return 0
+    return max((meta['epoch'] for meta in existing_checkpoints(save_dir)),
+               default=-1) + 1
+
+class CheckpointManager:
+    """Keep the best checkpoints by evaluation cost without stalling training.
+
+    save() only copies the variable values out of the session, the file I/O
+    happens on a background thread that writes them through a saver in its
+    own graph. At most max_to_keep checkpoints are kept in a heap ordered by
+    cost; a checkpoint that falls out of it is deleted. Every checkpoint
+    prefix/model.ckpt-<epoch> gets a prefix.json with its epoch, cost and
+    the hash of the config it was trained with, and the checkpoint state
+    file of save_dir always points at the best checkpoint, so
+    tf.train.get_checkpoint_state returns it directly.
+    """
+    def __init__(self, var_list, save_dir, max_to_keep=3, config_file=None,
+                 logger=None):
+        """
+        Args:
+            var_list: Variables to checkpoint
+            save_dir: Directory the checkpoints are written to
+            max_to_keep: Number of best checkpoints kept
+            config_file: Path of the config file, hashed into the metadata
+            logger: Logger for save messages
+        """
+
+        self.var_list = var_list
+        self.save_dir = save_dir
+        self.max_to_keep = max_to_keep
+        self.logger = logger
+        self.config_hash = None
+        if config_file is not None:
+            with open(config_file, 'rb') as f:
+                self.config_hash = hashlib.sha256(f.read()).hexdigest()
+
+        # Max-heap on cost via negated costs: heap[0] is the worst kept
+        self.heap = []
+        for meta in existing_checkpoints(save_dir):
+            heapq.heappush(self.heap, (-meta['cost'], meta['epoch'],
+                                       self.prefix(meta['epoch'])))
+
+        self.graph = None
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def prefix(self, epoch):
+        return os.path.join(self.save_dir, 'model.ckpt-{}'.format(epoch))
+
+    def is_better(self, cost):
+        """Check if a checkpoint with this cost would be kept."""
+        return len(self.heap) < self.max_to_keep or cost < -self.heap[0][0]
+
+    def save(self, sess, epoch, cost):
+        """Snapshot the variables and queue them for writing if cost is good.
+
+        Returns:
+            True if the checkpoint is kept
+        """
+
+        self._check_error()
+        if not self.is_better(cost):
+            return False
+
+        values = sess.run(self.var_list)
+        path = self.prefix(epoch)
+        evicted = None
+        # Overwriting a kept checkpoint replaces its entry; leaving both
+        # would later evict, and delete, the files just written
+        if any(p == path for _, _, p in self.heap):
+            self.heap = [entry for entry in self.heap if entry[2] != path]
+            heapq.heapify(self.heap)
+        heapq.heappush(self.heap, (-cost, epoch, path))
+        if len(self.heap) > self.max_to_keep:
+            evicted = heapq.heappop(self.heap)[2]
+        meta = {'epoch': epoch, 'cost': float(cost),
+                'checkpoint': os.path.basename(path),
+                'config_hash': self.config_hash, 'time': time.time()}
+        # Worst first: the state file lists model_checkpoint_path, the best
+        # checkpoint, last
+        ranked = [os.path.basename(p) for _, _, p in sorted(self.heap)]
+        self.queue.put((values, path, meta, evicted, ranked))
+        return True
+
+    def best(self):
+        """Path prefix of the checkpoint with the lowest cost, or None."""
+        if len(self.heap) == 0:
+            return None
+        return max(self.heap)[2]
+
+    def wait(self):
+        """Block until every queued checkpoint is written."""
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _build_writer(self):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.writer_vars = [
+                tf.Variable(tf.zeros(var.get_shape(), var.dtype.base_dtype),
+                            name=var.op.name)
+                for var in self.var_list]
+            self.saver = tf.train.Saver(
+                {var.op.name: writer_var
+                 for var, writer_var in zip(self.var_list, self.writer_vars)},
+                max_to_keep=None)
+            self.sess = tf.Session()
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                self.error = e
+            self.queue.task_done()
+        if self.graph is not None:
+            self.sess.close()
+
+    def _write(self, values, path, meta, evicted, ranked):
+        if self.graph is None:
+            self._build_writer()
+        for var, value in zip(self.writer_vars, values):
+            var.load(value, self.sess)
+        self.saver.save(self.sess, path, write_meta_graph=False,
+                        write_state=False)
+        with open(path + '.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        if evicted is not None:
+            for evicted_file in glob.glob(evicted + '.*'):
+                os.remove(evicted_file)
+        # Paths relative to save_dir, like a saver with save_relative_paths
+        tf.train.update_checkpoint_state(
+            self.save_dir, model_checkpoint_path=ranked[-1],
+            all_model_checkpoint_paths=ranked)
+        if self.logger is not None:
+            self.logger.info('Saved {} (cost {:.3f})'.format(path, meta['cost']))
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
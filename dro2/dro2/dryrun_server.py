@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""Stand-in for the Rxn Rover plugin that answers with simulated yields.
+
+The server speaks the plugin's side of the REQ/REP protocol (see
+protocol.py), so realreaction.py and np_policy.py run end to end without
+LabVIEW:
+
+    python dryrun_server.py ../config/default-config.json --problem gmm \
+        --latency 5 20 --drop_rate 0.01 --noise 0.02 --max_reactions 5000
+
+and in another shell
+
+    python realreaction.py ../config/default-config.json
+
+Conditions arrive in real units, they are scaled back to the unit cube
+with the bounds of the config and scored by a seeded problem of benchmark.py.
+Replies can be delayed, dropped (the client then resends through its
+reconnect logic), preceded by an in-band "Marco" heartbeat and perturbed
+by Gaussian noise. After max_reactions reactions every further request is
+answered with "Exit". Round-trip latency (from a reply leaving the server
+until the next conditions of that client arrive, i.e. proposal plus
+transport time) and throughput are logged periodically and written to
+--report at the end.
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import time
+import numpy as np
+import zmq
+
+from benchmark import PROBLEMS, make_problem
+from bounds import config_bounds
+from Config import add_override_argument, load_config
+from logger import get_handlers
+from protocol import CONDITIONS, HEARTBEAT_ACK, get_codec
+
+class ServerStats:
+    """Counters and latencies of a dry run."""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.reactions = 0
+        self.requests = 0
+        self.dropped = 0
+        self.heartbeats = 0
+        self.round_trips = []
+        self.best_yield = -np.inf
+
+    def summary(self, optimum=None):
+        end = time.perf_counter() if self.end is None else self.end
+        elapsed = end - self.start
+        round_trips = np.array(self.round_trips) * 1000
+        summary = {
+            'elapsed_s': elapsed,
+            'requests': self.requests,
+            'reactions': self.reactions,
+            'dropped': self.dropped,
+            'heartbeats': self.heartbeats,
+            'reactions_per_min': 60 * self.reactions / max(elapsed, 1e-9),
+            'best_yield': float(self.best_yield) if self.reactions else None,
+        }
+        if optimum is not None and self.reactions:
+            summary['regret'] = float(optimum - self.best_yield)
+        for q in (50, 95, 99):
+            summary['round_trip_ms_p{}'.format(q)] = (
+                float(np.percentile(round_trips, q)) if len(round_trips) else None)
+        return summary
+
+class DryRunServer:
+    """ROUTER socket emulating the plugin's REP socket.
+
+    A ROUTER is wire compatible with the REQ clients of transport.py but,
+    unlike REP, may leave a request unanswered, which is how drops are
+    emulated. Delayed replies are queued by due time, so several clients
+    (e.g. parallel sweeps) are served concurrently.
+
+    Args:
+        endpoint: Address to bind, e.g. tcp://127.0.0.1:5555
+        func: Objective taking one normalized [ndim] point
+        bounds: bounds.Bounds of the parameters
+        codec: Codec of the wire format
+        direction: 'max' serves the yields of func, 'min' serves 1 - yield
+        latency: (min, max) milliseconds a reply is delayed by
+        drop_rate: Probability of never answering a request
+        noise: Standard deviation of the Gaussian noise on each yield
+        heartbeat_rate: Probability of answering conditions with "Marco"
+                        first, the yields follow the client's "Polo"
+        max_reactions: Reactions after which requests are answered with
+                       "Exit", None never exits
+        heartbeat_address: Address to bind a PUB socket publishing
+                           heartbeats on, None publishes none
+        heartbeat_period: Milliseconds between published heartbeats
+        idle_timeout: Seconds after max_reactions that a client may stay
+                      silent before it no longer holds the server open
+        seed: Seed of latency, drops, heartbeats and noise
+        logger: Logger for progress messages
+    """
+    def __init__(self, endpoint, func, bounds, codec, direction='max',
+                 latency=(0, 0), drop_rate=0.0, noise=0.0, heartbeat_rate=0.0,
+                 max_reactions=None, heartbeat_address=None,
+                 heartbeat_period=1000, idle_timeout=5.0, seed=None,
+                 logger=None):
+        self.func = func
+        self.bounds = bounds
+        self.codec = codec
+        self.direction = direction
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.noise = noise
+        self.heartbeat_rate = heartbeat_rate
+        self.max_reactions = max_reactions
+        self.heartbeat_period = heartbeat_period
+        self.idle_timeout = idle_timeout
+        self.rng = np.random.RandomState(seed)
+        self.logger = logger
+        self.stats = ServerStats()
+
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.bind(endpoint)
+        self.publisher = None
+        if heartbeat_address is not None:
+            self.publisher = self.context.socket(zmq.PUB)
+            self.publisher.bind(heartbeat_address)
+        self.next_heartbeat = time.perf_counter()
+
+        # (due time, order, client, frames, exit) of replies not sent yet
+        self.outbox = []
+        self.sent = 0
+        # Yields held back until the client answers a heartbeat
+        self.held = {}
+        # Time the last reply to each client left the server
+        self.replied_at = {}
+
+    def evaluate(self, conditions):
+        """Yields of a [rows, ndim] block of real conditions."""
+        x = self.bounds.to_unit(conditions)
+        y = np.array([self.func(row) for row in x], dtype=float)
+        self.stats.best_yield = max(self.stats.best_yield, np.max(y))
+        if self.noise > 0:
+            y = y + self.rng.normal(scale=self.noise, size=y.shape)
+        if self.direction == 'min':
+            y = 1 - y
+        return y
+
+    def delay(self):
+        low, high = self.latency
+        return self.rng.uniform(low, high) / 1000
+
+    def reply(self, client, frames, delay=0.0, exit=False):
+        heapq.heappush(self.outbox, (time.perf_counter() + delay, self.sent,
+                                     client, frames, exit))
+        self.sent += 1
+
+    def handle(self, client, frames):
+        now = time.perf_counter()
+        message = self.codec.decode(frames)
+        self.stats.requests += 1
+
+        if message.kind == HEARTBEAT_ACK:
+            if client in self.held:
+                self.reply(client, self.held.pop(client), self.delay())
+            return
+        if message.kind != CONDITIONS:
+            if self.logger is not None:
+                self.logger.warning('Ignoring message type {}'.format(message.kind))
+            return
+
+        if client in self.replied_at:
+            self.stats.round_trips.append(now - self.replied_at.pop(client))
+
+        if self.exhausted():
+            self.reply(client, self.codec.encode_exit(message.seq), exit=True)
+            return
+        if self.rng.rand() < self.drop_rate:
+            self.stats.dropped += 1
+            return
+
+        yields = self.codec.encode_yields(self.evaluate(message.values),
+                                          message.seq)
+        self.stats.reactions += len(message.values)
+        if self.rng.rand() < self.heartbeat_rate:
+            self.stats.heartbeats += 1
+            self.held[client] = yields
+            self.reply(client, self.codec.encode_heartbeat(message.seq))
+        else:
+            self.reply(client, yields, self.delay())
+
+    def flush(self):
+        """Send the replies that are due.
+
+        Returns:
+            Milliseconds until the next reply or heartbeat is due
+        """
+
+        now = time.perf_counter()
+        while self.outbox and self.outbox[0][0] <= now:
+            _, _, client, frames, exit = heapq.heappop(self.outbox)
+            self.socket.send_multipart([client, b''] + frames)
+            # A client told to exit sends nothing more
+            if not exit:
+                self.replied_at[client] = time.perf_counter()
+
+        waits = []
+        if self.outbox:
+            waits.append(self.outbox[0][0] - now)
+        if self.publisher is not None:
+            if now >= self.next_heartbeat:
+                self.publisher.send_multipart(self.codec.encode_heartbeat())
+                self.next_heartbeat = now + self.heartbeat_period / 1000
+            waits.append(self.next_heartbeat - now)
+        if len(waits) == 0:
+            return None
+        return max(0, int(np.ceil(min(waits) * 1000)))
+
+    def serve(self, duration=None, log_period=10.0):
+        """Answer requests until duration seconds have passed (or forever).
+
+        The loop also ends once every client has been told to exit.
+        """
+
+        end = None if duration is None else time.perf_counter() + duration
+        next_log = time.perf_counter() + log_period
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        while end is None or time.perf_counter() < end:
+            wait = self.flush()
+            if self.finished():
+                break
+            wait = log_period * 1000 if wait is None else min(wait, log_period * 1000)
+            if self.exhausted():
+                # Come back to drop clients that went idle
+                wait = min(wait, self.idle_timeout * 1000)
+            if end is not None:
+                wait = min(wait, max(0, (end - time.perf_counter()) * 1000))
+            if poller.poll(wait):
+                while self.socket.poll(0):
+                    frames = self.socket.recv_multipart()
+                    # [client identity, empty delimiter, message frames...]
+                    self.handle(frames[0], frames[2:])
+
+            if time.perf_counter() >= next_log:
+                next_log += log_period
+                if self.logger is not None:
+                    self.logger.info(json.dumps(self.stats.summary()))
+        self.flush()
+        self.stats.end = time.perf_counter()
+
+    def exhausted(self):
+        """Check if max_reactions were run."""
+        return (self.max_reactions is not None
+                and self.stats.reactions >= self.max_reactions)
+
+    def finished(self):
+        """Check if max_reactions were run and every client was told to exit.
+
+        A client that stops after its own nsteps is never told to exit, so
+        clients silent for idle_timeout seconds are forgotten.
+        """
+
+        if not self.exhausted() or self.outbox or self.held:
+            return False
+        now = time.perf_counter()
+        self.replied_at = {client: replied for client, replied
+                           in self.replied_at.items()
+                           if now - replied < self.idle_timeout}
+        return not self.replied_at
+
+    def close(self):
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.close()
+        if self.publisher is not None:
+            self.publisher.close()
+
+def parse_args():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("config_file")
+    add_override_argument(parser)
+    parser.add_argument("--problem", default="quadratic", choices=PROBLEMS,
+                        help="Simulated reaction the yields come from")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the problem instance and of the faults")
+    parser.add_argument("--bind", default=None,
+                        help="Address to bind (defaults to ip_address:port "
+                        "of the config)")
+    parser.add_argument("--latency", type=float, nargs=2, default=[0, 0],
+                        metavar=("MIN", "MAX"),
+                        help="Range of milliseconds each reply is delayed by")
+    parser.add_argument("--drop_rate", type=float, default=0.0,
+                        help="Probability of never answering a request")
+    parser.add_argument("--noise", type=float, default=0.0,
+                        help="Standard deviation of the noise on each yield")
+    parser.add_argument("--heartbeat_rate", type=float, default=0.0,
+                        help="Probability of answering with Marco first")
+    parser.add_argument("--max_reactions", type=int, default=None,
+                        help="Answer Exit after this many reactions")
+    parser.add_argument("--idle_timeout", type=float, default=5.0,
+                        help="Seconds a client may stay silent after "
+                        "max_reactions before the server stops waiting for it")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Seconds to serve for, forever by default")
+    parser.add_argument("--log_period", type=float, default=10.0,
+                        help="Seconds between progress reports")
+    parser.add_argument("--report", default=None,
+                        help="JSON file the final statistics are written to")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = parse_args()
+
+    logging.basicConfig(level=logging.INFO, handlers=get_handlers())
+    logger = logging.getLogger()
+
+    config = load_config(args.config_file, args.overrides)
+
+    func, optimum = make_problem(args.problem, config.num_params(), args.seed,
+                                 norm_cov=config.norm_cov())
+    endpoint = args.bind
+    if endpoint is None:
+        endpoint = config.ip_address() + ":" + str(config.port())
+
+    server = DryRunServer(endpoint, func, config_bounds(config),
+                          get_codec(config.wire_format()),
+                          direction=config.opt_direction(),
+                          latency=args.latency, drop_rate=args.drop_rate,
+                          noise=args.noise, heartbeat_rate=args.heartbeat_rate,
+                          max_reactions=args.max_reactions,
+                          heartbeat_address=config.heartbeat_address(),
+                          heartbeat_period=config.heartbeat_timeout() / 3,
+                          idle_timeout=args.idle_timeout,
+                          seed=args.seed, logger=logger)
+    logger.info('Serving {} yields on {}.'.format(args.problem, endpoint))
+    try:
+        server.serve(args.duration, args.log_period)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+    summary = server.stats.summary(optimum)
+    logger.info(json.dumps(summary))
+    if args.report is not None:
+        with open(args.report, 'w') as fout:
+            json.dump(summary, fout, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
+import argparse
 import util
 import logging
-import json
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL']='3'
 import tensorflow as tf
@@ -10,18 +10,29 @@ import matplotlib.pyplot as plt
 from model import Optimizer
 from rnn import MultiInputLSTM
 from logger import get_handlers
-from collections import namedtuple
+from Config import add_override_argument, load_config
 
 logging.basicConfig(level=logging.INFO, handlers=get_handlers(False))
 logger = logging.getLogger()
 
 
+def parse_args():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("config_file", nargs="?", default="./config.json")
+    add_override_argument(parser)
+
+    args = parser.parse_args()
+
+    return args
+
 def main():
 
-    config_file = open('./config.json')
-    config = json.load(config_file,
-                       object_hook=lambda d:namedtuple('x', d.keys())(*d.values()))
-    num_unrolls = config.num_steps // config.unroll_length
+    args = parse_args()
+    config = load_config(args.config_file, args.overrides)
+    num_unrolls = config.num_steps() // config.unroll_length()
     with tf.Session() as sess:
         model = util.load_model(sess, config, logger)
         all_y = []
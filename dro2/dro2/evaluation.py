@@ -0,0 +1,211 @@
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+import util
+from gmm import diag_gaussian_logpdf
+from reactions import MixedReactions
+
+EVAL_SEED = 1234
+BANK_FILE = 'eval_bank.npz'
+
+def make_problem_bank(config, num_batches, seed=EVAL_SEED):
+    """Draw num_batches batches of held-out problems.
+
+    The problems are drawn by the initializers of the training reactions in
+    a separate graph with a fixed seed, so they follow the training
+    distribution but are the same for every run.
+
+    Returns:
+        list of num_batches lists of arrays, the initial x followed by the
+        values of func.get_parameters()
+    """
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(seed)
+        func = util.create_reaction(config, None, eval_stage(config))
+        x = initial_x(config)
+        variables = [x] + func.get_parameters()
+        init = tf.variables_initializer(variables)
+        bank = []
+        with tf.Session() as sess:
+            for _ in range(num_batches):
+                sess.run(init)
+                bank.append(sess.run(variables))
+    return bank
+
+def load_problem_bank(config, num_batches, path=None):
+    """Load the problem bank from path, creating it on first use.
+
+    Keeping the bank on disk keeps evaluation comparable across resumed runs
+    even if the way problems are drawn changes.
+    """
+
+    if path is not None and os.path.exists(path):
+        with np.load(path) as data:
+            nvars = int(data['nvars'])
+            bank = [[data['b{}_{}'.format(i, j)] for j in range(nvars)]
+                    for i in range(int(data['nbatches']))]
+        if len(bank) == num_batches:
+            return bank
+
+    bank = make_problem_bank(config, num_batches)
+    if path is not None:
+        arrays = {'b{}_{}'.format(i, j): value
+                  for i, values in enumerate(bank)
+                  for j, value in enumerate(values)}
+        np.savez(path, nbatches=len(bank), nvars=len(bank[0]), **arrays)
+    return bank
+
+def eval_stage(config):
+    """Mixed reactions are evaluated on the last stage of the curriculum."""
+    return config.curriculum()[-1]
+
+def initial_x(config):
+    return tf.get_variable('x', shape=[config.batch_size(), config.num_params()],
+                           initializer=tf.truncated_normal_initializer(mean=0.5, stddev=0.2),
+                           trainable=False)
+
+def gmm_values(x, m, s, coef, mask=None):
+    """NumPy version of reactions.GMM for a batch of problems.
+
+    Args:
+        x: [batch_size, npoints, ndim] points
+        m: [batch_size, ncoef, ndim] component means
+        s: [batch_size, ncoef, ndim] component standard deviations
+        coef: [ncoef] component weights
+        mask: optional [batch_size, ndim] 0/1 mask of the active dimensions
+
+    Returns:
+        [batch_size, npoints] values
+    """
+
+    if mask is None:
+        mask = np.ones((x.shape[0], x.shape[-1]))
+    ndim = np.sum(mask, axis=1, keepdims=True)
+    p = np.exp(diag_gaussian_logpdf(x, m, s ** 2, mask))
+    mask = mask[:, np.newaxis, :]
+    fx = np.dot(p, coef)
+    cst = (2 * 3.14159) ** (- ndim / 2)
+    modes = coef / np.prod(s * mask + (1 - mask), axis=2)
+    tops = np.max(modes, axis=1, keepdims=True)
+    bots = np.min(modes, axis=1, keepdims=True)
+    return (fx / cst - bots) / (tops - bots)
+
+class Evaluator:
+    """Roll out the current policy on a fixed bank of held-out problems.
+
+    The rollout shares the policy variables with training but has no
+    gradient ops and no instrument error. Regret is the gap between the
+    best value found so far and the optimum of each problem: known in
+    closed form for the quadratic reactions and estimated by random search
+    for GMMs.
+    """
+    def __init__(self, config, cell, constraints=False, nsteps=None,
+                 log_file=None, seed=0):
+        """
+        Args:
+            config: Config of the training run
+            cell: Policy cell, its variables must exist already
+            constraints: Clip proposals to [0.01, 0.99] like training
+            nsteps: Steps per rollout, num_steps of the config by default
+            log_file: JSONL file the regret curves are appended to
+            seed: Seed of the candidates used to estimate GMM optima
+        """
+
+        self.config = config
+        self.direction = config.opt_direction()
+        self.nsteps = nsteps or config.num_steps()
+        self.log_file = log_file
+        self.rng = np.random.RandomState(seed)
+
+        bank_path = None
+        if config.save_path() is not None:
+            bank_path = os.path.join(config.save_path(), BANK_FILE)
+        self.bank = load_problem_bank(config, config.evaluation_epochs(),
+                                      bank_path)
+
+        with tf.variable_scope('eval'):
+            self.func = util.create_reaction(config, None, eval_stage(config))
+            x = initial_x(config)
+        self.variables = [x] + self.func.get_parameters()
+
+        batch_size = config.batch_size()
+        state = cell.get_initial_state(batch_size, tf.float32)
+        fx_array = tf.TensorArray(tf.float32, size=self.nsteps + 1)
+
+        def step(t, x, state, fx_array):
+            fx = self.func(x)
+            fx_array = fx_array.write(t, tf.reshape(fx, [batch_size]))
+            # Same policy variables as the training rollout, batch-norm
+            # layers use their frozen statistics
+            with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+                new_x, new_state = cell(x, fx, state, is_training=False)
+            if constraints:
+                new_x = tf.clip_by_value(new_x, 0.01, 0.99)
+            return t + 1, new_x, new_state, fx_array
+
+        with tf.name_scope('eval'):
+            _, x_final, _, fx_array = tf.while_loop(
+                cond=lambda t, *_: t < self.nsteps,
+                body=step, loop_vars=(0, x, state, fx_array),
+                parallel_iterations=1)
+            fx_array = fx_array.write(
+                self.nsteps, tf.reshape(self.func(x_final), [batch_size]))
+            # [batch_size, nsteps + 1]
+            self.fx = tf.transpose(fx_array.stack())
+
+    def optimum(self, values, fx):
+        """Optimum of every problem in one batch of the bank."""
+        best = np.max if self.direction == 'max' else np.min
+        # The concave quadratics peak at 1 and the convex ones bottom out
+        # at 0, both inside the unit cube
+        quad_optimum = np.full(fx.shape[0], 1.0 if self.direction == 'max' else 0.0)
+        reaction_type = self.config.reaction_type()
+        if reaction_type not in ('gmm', 'mixed'):
+            return quad_optimum
+
+        params = dict(zip(self.variables, values))
+        gmm = self.func.gmm if reaction_type == 'mixed' else self.func
+        m = np.stack([params[var] for var in gmm.m], axis=1)
+        s = np.stack([params[var] for var in gmm.cov], axis=1)
+        coef = params[gmm.coef][:, 0]
+        mask = params[self.func.mask] if reaction_type == 'mixed' else None
+        x = self.rng.rand(fx.shape[0], 1024, m.shape[2])
+        candidates = gmm_values(x, m, s, coef, mask)
+        gmm_optimum = best(np.concatenate([candidates, fx], axis=1), axis=1)
+        if reaction_type == 'gmm':
+            return gmm_optimum
+        is_gmm = params[self.func.family] == MixedReactions.FAMILIES.index('gmm')
+        return np.where(is_gmm, gmm_optimum, quad_optimum)
+
+    def run(self, sess, epoch=None):
+        """Evaluate the policy on every batch of the bank.
+
+        Returns:
+            dict with the mean regret over steps and problems ('cost'), the
+            mean regret after the last step ('final_regret') and the mean
+            regret after every step ('regret')
+        """
+
+        regrets = []
+        for values in self.bank:
+            for var, value in zip(self.variables, values):
+                var.load(value, sess)
+            fx = sess.run(self.fx)
+            optimum = self.optimum(values, fx)
+            if self.direction == 'max':
+                regret = optimum[:, np.newaxis] - np.maximum.accumulate(fx, axis=1)
+            else:
+                regret = np.minimum.accumulate(fx, axis=1) - optimum[:, np.newaxis]
+            regrets.append(regret)
+
+        curve = np.mean(np.concatenate(regrets), axis=0)
+        result = {'epoch': epoch, 'cost': float(np.mean(curve)),
+                  'final_regret': float(curve[-1]), 'regret': curve.tolist()}
+        if self.log_file is not None:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+        return result
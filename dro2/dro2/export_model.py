@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL']='3'
+import tensorflow as tf
+import numpy as np
+import logging
+
+import util
+from Config import add_override_argument, load_config
+from logger import get_handlers
+from np_policy import read_checkpoint_weights
+from realreaction import StepOptimizer
+from weight_store import write_weight_store
+
+# Default file names of the exports inside save_path
+EXPORT_FILES = {'frozen': 'frozen_graph.pb', 'npz': 'policy_weights.npz',
+                'mmap': 'policy_weights.bin'}
+
+def parse_args():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("config_file")
+    add_override_argument(parser)
+    parser.add_argument("--format", default="frozen", choices=EXPORT_FILES.keys(),
+                        help="frozen: constant-folded GraphDef for "
+                        "realreaction.py --frozen_graph, npz: policy weights "
+                        "for np_policy.py, mmap: memory-mapped weight store "
+                        "for realreaction.py --weights and np_policy.py")
+    parser.add_argument("--output", default=None,
+                        help="Path of the exported file (defaults to "
+                        "frozen_graph.pb, policy_weights.npz or "
+                        "policy_weights.bin inside save_path)")
+
+    args = parser.parse_args()
+
+    return args
+
+def create_step_optimizer(config, logger):
+    """StepOptimizer holding only the inference graph of the policy."""
+    cell = util.create_cell(config)
+
+    return StepOptimizer(cell=cell, func=None, ndim=config.num_params(),
+                         nsteps=config.num_steps(),
+                         ckpt_path=config.save_path(), logger=logger,
+                         constraints=config.constraints(),
+                         num_samples=config.num_candidates())
+
+def export_frozen_graph(config, output_path, logger):
+    """Freeze the inference subgraph of the checkpoint in save_path.
+
+    Args:
+        config: Parsed Config of the trained model
+        output_path: File the binary GraphDef is written to
+        logger: Logger for progress messages
+    """
+
+    optimizer = create_step_optimizer(config, logger)
+
+    with tf.Session() as sess:
+        optimizer.load(sess, config.save_path())
+        graph_def = optimizer.freeze(sess)
+
+    tf.train.write_graph(graph_def, os.path.dirname(os.path.abspath(output_path)),
+                         os.path.basename(output_path), as_text=False)
+    logger.info('Wrote frozen graph with {} nodes to {}.'.format(
+        len(graph_def.node), output_path))
+
+def export_weights(config, output_path, logger):
+    """Write the policy weights of the checkpoint in save_path to a .npz.
+
+    Args:
+        config: Parsed Config of the trained model
+        output_path: File the weights are written to
+        logger: Logger for progress messages
+    """
+
+    weights = read_checkpoint_weights(config.save_path())
+    with open(output_path, 'wb') as fout:
+        np.savez(fout, **weights)
+    logger.info('Wrote {} policy variables to {}.'.format(
+        len(weights), output_path))
+
+def export_weight_store(config, output_path, logger):
+    """Write the variables of the inference graph to a weight store.
+
+    Unlike the npz export this keeps every variable the policy reads,
+    including the moving statistics of batch norm, so both
+    realreaction.py --weights and np_policy.py can load it.
+
+    Args:
+        config: Parsed Config of the trained model
+        output_path: File the weight store is written to
+        logger: Logger for progress messages
+    """
+
+    optimizer = create_step_optimizer(config, logger)
+
+    with tf.Session() as sess:
+        optimizer.load(sess, config.save_path())
+        values = sess.run(optimizer.variables)
+
+    weights = {var.op.name: value
+               for var, value in zip(optimizer.variables, values)}
+    write_weight_store(weights, output_path)
+    logger.info('Wrote {} policy variables ({} bytes) to {}.'.format(
+        len(weights), os.path.getsize(output_path), output_path))
+
+def main():
+
+    args = parse_args()
+
+    logging.basicConfig(level=logging.INFO, handlers=get_handlers())
+    logger = logging.getLogger()
+
+    config = load_config(args.config_file, args.overrides)
+
+    output_path = args.output
+    if output_path is None:
+        output_path = os.path.join(config.save_path(), EXPORT_FILES[args.format])
+
+    if args.format == 'npz':
+        export_weights(config, output_path, logger)
+    elif args.format == 'mmap':
+        export_weight_store(config, output_path, logger)
+    else:
+        export_frozen_graph(config, output_path, logger)
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,78 @@
 import numpy as np
-from scipy.stats import multivariate_normal as normal
 import matplotlib.pyplot as plt
 from matplotlib import cm
 from itertools import product
 from mpl_toolkits.mplot3d import Axes3D
 
-import tensorflow as tf
-from reactions import GMM as tf_GMM
+def diag_gaussian_logpdf(x, mean, var, mask=None):
+    """Log-density of every point under every diagonal Gaussian.
+
+    Leading dimensions are broadcast, so a batch of problems with their
+    own components is evaluated in one call.
+
+    Args:
+        x: [..., N, ndim] points
+        mean: [..., n, ndim] component means
+        var: [..., n, ndim] component variances (diagonal of the covariance)
+        mask: optional [..., ndim] 0/1 mask, the density is then the
+              marginal over the active dimensions
+
+    Returns:
+        [..., N, n] array of log-densities
+    """
+
+    if mask is None:
+        mask = np.ones(np.shape(x)[-1])
+    mask = np.asarray(mask, dtype=float)[..., np.newaxis, :]
+    diff = x[..., :, np.newaxis, :] - mean[..., np.newaxis, :, :]
+    mahalanobis = np.sum(diff ** 2 / var[..., np.newaxis, :, :]
+                         * mask[..., np.newaxis, :], axis=-1)
+    log_norm = - 0.5 * (np.sum(mask, axis=-1) * np.log(2 * np.pi)
+                        + np.sum(np.log(var) * mask, axis=-1))
+    return log_norm[..., np.newaxis, :] - 0.5 * mahalanobis
 
 class GMM:
-    def __init__(self, n=6, ndim=3, cov=0.15, record=False):
+    def __init__(self, n=6, ndim=3, cov=0.15, record=False, rng=None):
         self.n = n
+        # A RandomState of its own, or the global one
+        self.rng = np.random if rng is None else rng
         self.ndim = ndim
         self.record = record
-        self.cov = cov
+        self.norm_cov = cov
         self.refresh()
 
     def refresh(self):
-        self.m = [np.random.rand(self.ndim) for _ in range(self.n)]
-        self.cov = [np.random.normal(self.cov, self.cov/5, size=self.ndim)
-                    for _ in range(self.n)]
-        self.param = np.random.normal(loc=0, scale=0.2, size=self.n)
+        self.m = self.rng.rand(self.n, self.ndim)
+        self.cov = self.rng.normal(self.norm_cov, self.norm_cov/5,
+                                    size=(self.n, self.ndim))
+        self.param = self.rng.normal(loc=0, scale=0.2, size=self.n)
         self.param /= np.sum(np.abs(self.param))
         if self.record:
             self.history = {'x':[], 'y':[]}
 
         self.cst = (2 * 3.14159) ** (- self.ndim / 2)
-        modes = np.array([1/np.prod(cov) for cov in self.cov])
+        modes = 1 / np.prod(self.cov, axis=1)
         modes = modes * self.param
         self.tops = np.max(modes)
         self.bots = np.min(modes)
 
     def __call__(self, x):
-        y = [normal.pdf(x, self.m[i], self.cov[i]) for i in range(self.n)]
+        """Evaluate the landscape at one point or at a [N, ndim] block.
 
-        # Reshaping and converting to scalar from array
-        
-        fx = (np.dot(self.param.reshape((1, -1)),
-                     np.array(y).reshape((-1, 1)))/self.n).item()
+        Returns:
+            A float for a single point, an [N] array for a block
+        """
+
+        x = np.asarray(x, dtype=float)
+        single = x.ndim < 2
+        points = x.reshape(-1, self.ndim)
+
+        y = np.exp(diag_gaussian_logpdf(points, self.m, self.cov))
+        fx = np.dot(y, self.param) / self.n
         result = (fx / self.cst - self.bots) / (self.tops - self.bots)
+        if single:
+            result = result.item()
+
         if self.record:
             self.history['x'].append(x)
             self.history['y'].append(result)
@@ -49,7 +83,7 @@ class GMM:
 def test_1d():
     gmm = GMM(ndim=1)
     x = np.arange(0, 1, 0.01)
-    y = [gmm(i) for i in x]
+    y = gmm(x.reshape((-1, 1)))
     plt.figure(1)
     plt.plot(x, y)
     plt.show()
@@ -58,7 +92,7 @@ def test_2d():
     gmm = GMM(ndim=2)
     xr = list(np.arange(0, 1, 0.02))
     X = np.array(list(product(xr, repeat=2)))
-    Y = [gmm(i) for i in X]
+    Y = gmm(X)
     fig = plt.figure(1)
     ax = fig.gca(projection='3d')
     ax.plot_trisurf(X[:, 0], X[:, 1], Y)
@@ -66,15 +100,17 @@ def test_2d():
     plt.show()
 
 def test_tf():
+    import tensorflow as tf
+    from reactions import GMM as tf_GMM
+
     xr = list(np.arange(0, 1, 0.02))
     X = np.array(list(product(xr, repeat=2)))
-    Y = []
     with tf.Session() as sess:
+        # One landscape evaluated at every grid point in a single run
         gmm = tf_GMM(batch_size=1, ncoef=6, num_dims=2, cov=0.5)
-        y = gmm(tf.placeholder(tf.float32, shape=[1, 2], name='x'))
+        y = gmm(tf.placeholder(tf.float32, shape=[None, 2], name='x'))
         sess.run(tf.global_variables_initializer())
-        for x in X:
-            Y.append(sess.run(y, feed_dict={'x:0':x.reshape((1, 2))}))
+        Y = sess.run(y, feed_dict={'x:0':X})
 
     cmap = cm.get_cmap('rainbow')
     fig = plt.figure(1)
@@ -1,10 +1,17 @@
-import GPy
+import copy
 import numpy as np
 import matplotlib.pyplot as plt
+import time
 from itertools import product
-from reactions import QuadraticEval
+from scipy.linalg import cho_solve, solve_triangular
+from scipy.optimize import minimize
+from scipy.stats import norm
+
+from bounds import Bounds
 
 def gp(prior_X, prior_Y, variance=0.1, lengthscale=0.1, X=None, nsamples=1):
+    import GPy
+
     nd = prior_X.shape[1]
     kernel = GPy.kern.RBF(input_dim=nd, variance=variance, lengthscale=lengthscale)
     m = GPy.models.GPRegression(prior_X, prior_Y, kernel)
@@ -41,42 +48,323 @@ def test_2d():
 
 
 class SquaredDistanceKernel():
-    def __init__(self, param=0.1):
+    """Squared exponential kernel, variance * exp(-|a - b|^2 / param / 2).
+
+    param is the squared lengthscale.
+    """
+    def __init__(self, param=0.1, variance=1.0):
         self.param = param
+        self.variance = variance
 
     def __call__(self, a, b):
         sq_dist = np.sum(a ** 2, 1).reshape(-1, 1) + np.sum(b ** 2, 1) - 2 * np.dot(a, b.T)
-        return np.exp(- sq_dist / self.param / 2)
+        return self.variance * np.exp(- np.maximum(sq_dist, 0) / self.param / 2)
+
+    def diag(self, a):
+        """Diagonal of self(a, a)."""
+        return np.full(a.shape[0], self.variance)
 
 class GaussianProcess(object):
-    def __init__(self, kernel=SquaredDistanceKernel(), noise=0.0):
+    """Exact zero-mean GP regression with incremental updates.
+
+    The Cholesky factor L of K + noise * I is kept between calls. Adding an
+    observation with update() extends L by one row, which costs O(n^2)
+    instead of the O(n^3) of refactoring, and predictions reuse L and
+    alpha = (K + noise * I)^-1 (y - mean).
+
+    With normalize_y the prior mean is the mean of the observations instead
+    of zero, so unexplored regions are not optimistic (or pessimistic)
+    just because the objective is far from zero.
+    """
+    def __init__(self, kernel=SquaredDistanceKernel(), noise=1e-6,
+                 normalize_y=False):
         self.kernel = kernel
         self.noise = noise
+        self.normalize_y = normalize_y
+        self.mean = 0.0
         self.X = None
         self.Y = None
+        self.L = None
+        self.alpha = None
 
     def prior(self, x, y):
-        self.X = x
-        self.Y = y
-
-    def predict(self, x):
-        k2 = self.kernel(x, x)
-        self.cov = None
-        if self.X and self.Y:
-            self.cov = self.kernel(X)
-        if self.cov is None:
-            mu = np.zeros(x.shape)
-            cov_posterior = k2 + (self.noise * np.eye(k2.shape[0]))
+        """Condition on the observations x, y from scratch."""
+        self.X = np.array(x, dtype=float).reshape(len(x), -1)
+        self.Y = np.array(y, dtype=float).reshape(-1)
+        K = self.kernel(self.X, self.X) + self.noise * np.eye(len(self.X))
+        self.L = np.linalg.cholesky(K)
+        self._solve()
 
-        else:
-            l = np.linalg.cholesky(self.cov + self.noise * np.eye(self.cov.shape[0]))
-            k = self.kernel(X, x)
-            ldk = np.linalg.solve(l, k)
+    def update(self, x, y):
+        """Add observations x, y with rank-one extensions of L."""
+        y = np.array(y, dtype=float).reshape(-1)
+        x = np.array(x, dtype=float).reshape(len(y), -1)
+        if self.X is None:
+            self.prior(x, y)
+            return
+
+        for xi, yi in zip(x, y):
+            xi = xi.reshape(1, -1)
+            k = self.kernel(self.X, xi)[:, 0]
+            l = solve_triangular(self.L, k, lower=True)
+            d = np.sqrt(max(self.kernel.diag(xi)[0] + self.noise - np.dot(l, l),
+                            1e-12))
+
+            n = len(self.X)
+            L = np.zeros((n + 1, n + 1))
+            L[:n, :n] = self.L
+            L[n, :n] = l
+            L[n, n] = d
+            self.L = L
+            self.X = np.vstack([self.X, xi])
+            self.Y = np.append(self.Y, yi)
+        self._solve()
+
+    def _solve(self):
+        if self.normalize_y:
+            self.mean = np.mean(self.Y)
+        self.alpha = cho_solve((self.L, True), self.Y - self.mean)
+
+    def predict(self, x, full_cov=True):
+        """Posterior mean and covariance (or variance) at the points x.
+
+        Args:
+            x: [m, ndim] points
+            full_cov: Return the [m, m] covariance instead of the [m]
+                      variances
+
+        Returns:
+            mu: [m] posterior mean
+            cov: [m, m] posterior covariance or [m] posterior variance
+        """
+
+        x = np.asarray(x, dtype=float)
+        if self.X is None:
+            mu = np.zeros(x.shape[0])
+            if full_cov:
+                return mu, self.kernel(x, x) + self.noise * np.eye(x.shape[0])
+            return mu, self.kernel.diag(x) + self.noise
+
+        k = self.kernel(self.X, x)
+        mu = self.mean + np.dot(k.T, self.alpha)
+        v = solve_triangular(self.L, k, lower=True)
+        if full_cov:
+            cov = self.kernel(x, x) + self.noise * np.eye(x.shape[0]) - np.dot(v.T, v)
+            return mu, cov
+        var = self.kernel.diag(x) + self.noise - np.sum(v ** 2, axis=0)
+        return mu, np.maximum(var, 0)
+
+    def sample(self, x, nsamples=1):
+        """Draw joint posterior samples at the points x.
+
+        Returns:
+            [m, nsamples] array
+        """
+
+        mu, cov = self.predict(x)
+        jitter = 1e-9 * np.mean(np.diag(cov)) + 1e-12
+        L = np.linalg.cholesky(cov + jitter * np.eye(len(mu)))
+        z = np.random.standard_normal((len(mu), nsamples))
+        return mu.reshape(-1, 1) + np.dot(L, z)
+
+class ExpectedImprovement:
+    """E[max(f(x) - best - xi, 0)] under the GP posterior."""
+    local = True
+
+    def __init__(self, xi=0.01):
+        self.xi = xi
+
+    def __call__(self, gp, x, best):
+        mu, var = gp.predict(x, full_cov=False)
+        sigma = np.sqrt(var)
+        improvement = mu - best - self.xi
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(sigma > 0, improvement / sigma, 0)
+        ei = improvement * norm.cdf(z) + sigma * norm.pdf(z)
+        return np.where(sigma > 0, ei, np.maximum(improvement, 0))
+
+class UpperConfidenceBound:
+    """mu(x) + beta * sigma(x)."""
+    local = True
+
+    def __init__(self, beta=2.0):
+        self.beta = beta
+
+    def __call__(self, gp, x, best):
+        mu, var = gp.predict(x, full_cov=False)
+        return mu + self.beta * np.sqrt(var)
+
+class ThompsonSampling:
+    """One joint posterior sample over the candidates.
+
+    A posterior sample is only defined on a fixed set of points, so it can
+    not be refined by a local optimizer and the best candidate is used.
+    """
+    local = False
+
+    def __call__(self, gp, x, best):
+        return gp.sample(x)[:, 0]
+
+ACQUISITIONS = {
+    'ei': ExpectedImprovement,
+    'ucb': UpperConfidenceBound,
+    'thompson': ThompsonSampling,
+}
 
-            mu = np.dot(ldk.T, np.linalg.solve(1, self.Y))
-            cov_posterior = k2 + self.noise * np.eye(k2.shape[0]) - np.dot(ldk.T, ldk)
+def sobol_points(n, ndim, rng):
+    """n points of a scrambled Sobol sequence in [0, 1]^ndim.
 
-        return mu, cov_posterior
+    Falls back to uniform random points for scipy < 1.7, which has no qmc.
+    """
+
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        return rng.rand(n, ndim)
+    sampler = qmc.Sobol(d=ndim, scramble=True, seed=rng.randint(2 ** 31))
+    # Sobol points are balanced for powers of two
+    m = int(np.ceil(np.log2(max(n, 2))))
+    return sampler.random_base2(m)[:n]
+
+class AcquisitionOptimizer:
+    """Maximize an acquisition function over the unit hypercube.
+
+    The acquisition is scored on a bounded set of Sobol candidates, so the
+    cost no longer grows as 10^ndim like the old grid. With method 'lbfgs'
+    the best num_restarts candidates are then refined with L-BFGS-B inside
+    [0, 1]^ndim. Restarts stop once max_time seconds have passed, which
+    bounds the latency of a proposal.
+    """
+    def __init__(self, ndim, method='lbfgs', num_candidates=1024,
+                 num_restarts=5, max_time=None, seed=None):
+        if method not in ('lbfgs', 'sobol'):
+            raise ValueError("Unknown acquisition optimizer {}, expected "
+                             "'lbfgs' or 'sobol'".format(method))
+        self.ndim = ndim
+        self.method = method
+        self.num_candidates = num_candidates
+        self.num_restarts = num_restarts
+        self.max_time = max_time
+        self.rng = np.random.RandomState(seed)
+
+    def __call__(self, acquisition, gp, best):
+        start = time.time()
+        x = sobol_points(self.num_candidates, self.ndim, self.rng)
+        if gp.X is not None:
+            # Observed points are good starts for exploitation
+            x = np.vstack([x, gp.X])
+        scores = acquisition(gp, x, best)
+        order = np.argsort(-scores)
+        best_x, best_score = x[order[0]], scores[order[0]]
+
+        if self.method == 'sobol' or not getattr(acquisition, 'local', False):
+            return best_x
+
+        neg_acq = lambda z: -acquisition(gp, z.reshape(1, -1), best)[0]
+        bounds = [(0, 1)] * self.ndim
+        for i in order[:self.num_restarts]:
+            if self.max_time is not None and time.time() - start > self.max_time:
+                break
+            res = minimize(neg_acq, x[i], method='L-BFGS-B', bounds=bounds)
+            if -res.fun > best_score:
+                best_x, best_score = np.clip(res.x, 0, 1), -res.fun
+        return best_x
+
+class CandidateSelector:
+    """Pick proposals of a policy with a GP surrogate of the history.
+
+    The policy draws num_candidates proposals per reactor in one forward
+    pass, and the GP, fitted on every reaction run so far, ranks them by
+    an acquisition function before anything is sent to the instrument.
+    With diverse=False every reactor runs its best candidate. With
+    diverse=True the candidates of all reactors form one pool, and each
+    reactor in turn takes the best remaining candidate. Before the next
+    pick the GP is conditioned on that choice, with its predicted mean
+    as the outcome ("kriging believer"). This lowers the variance around
+    points already picked, so parallel reactors spread out instead of all
+    running near the same point.
+
+    The objective values are standardized before fitting, so the kernel
+    settings are in normalized units whatever the scale of the yield.
+
+    Args:
+        acquisition: 'ei', 'ucb' or 'thompson'
+        diverse: Select a diverse top-k across reactors
+        direction: 'max' or 'min', the direction of the objective
+        lengthscale: Kernel lengthscale in normalized units
+        noise: Observation noise variance of the standardized objective
+    """
+    def __init__(self, acquisition='ucb', diverse=False, direction='max',
+                 lengthscale=0.3, noise=0.01):
+        if acquisition not in ACQUISITIONS:
+            raise ValueError("Unknown acquisition {}, expected one of {}".format(
+                acquisition, sorted(ACQUISITIONS)))
+        self.acquisition = ACQUISITIONS[acquisition]()
+        self.diverse = diverse
+        self.sign = 1.0 if direction == 'max' else -1.0
+        self.kernel = SquaredDistanceKernel(param=lengthscale ** 2)
+        self.noise = noise
+        self.X = []
+        self.Y = []
+        self.gp = None
+
+    def update(self, x, y):
+        """Add the [batch_size, ndim] conditions x and their values y."""
+        x = np.asarray(x, dtype=float).reshape(-1, np.shape(x)[-1])
+        y = self.sign * np.asarray(y, dtype=float).reshape(-1)
+        self.X.extend(x)
+        self.Y.extend(y)
+
+        # The history of a real run is small, refitting keeps the
+        # standardization exact
+        Y = np.array(self.Y)
+        scale = np.std(Y) if np.std(Y) > 0 else 1.0
+        self.gp = GaussianProcess(kernel=self.kernel, noise=self.noise)
+        self.gp.prior(np.array(self.X), (Y - np.mean(Y)) / scale)
+
+    def select(self, candidates):
+        """Choose one proposal per reactor.
+
+        Args:
+            candidates: [batch_size, num_candidates, ndim] proposals
+
+        Returns:
+            [batch_size, ndim] selected proposals
+        """
+
+        candidates = np.asarray(candidates)
+        batch_size, num_candidates, ndim = candidates.shape
+        if self.gp is None or num_candidates == 1:
+            return candidates[:, 0]
+
+        if not self.diverse:
+            scores = self.acquisition(self.gp, candidates.reshape(-1, ndim),
+                                      np.max(self.gp.Y))
+            best = np.argmax(scores.reshape(batch_size, num_candidates), axis=1)
+            return candidates[np.arange(batch_size), best]
+
+        pool = candidates.reshape(-1, ndim)
+        available = np.ones(len(pool), dtype=bool)
+        gp = copy.deepcopy(self.gp)
+        best_y = np.max(gp.Y)
+        selected = []
+        for _ in range(batch_size):
+            scores = np.where(available, self.acquisition(gp, pool, best_y),
+                              -np.inf)
+            i = np.argmax(scores)
+            selected.append(pool[i])
+            available[i] = False
+            mu, _ = gp.predict(pool[i:i + 1], full_cov=False)
+            gp.update(pool[i:i + 1], mu)
+        return np.array(selected)
+
+def create_selector(config):
+    """CandidateSelector of config, None if one proposal is drawn per step."""
+    if config.num_candidates() <= 1:
+        return None
+    return CandidateSelector(acquisition=config.candidate_acquisition(),
+                             diverse=config.candidate_selection() == 'diverse',
+                             direction=config.opt_direction())
 
 def t1d():
     gp = GaussianProcess()
@@ -91,46 +379,56 @@ def t2d():
     np.random.seed(1)
     xr = list(np.arange(0, 1, 0.02))
     x = np.array(list(product(xr, repeat=2)))
-    mu, cov = gp.predict(np.array([[0.48, 0.68], [0, 0]]))
-    import pdb; pdb.set_trace()
-    y = np.random.multivariate_normal(np.zeros(2), cov)
+    y = gp.sample(x)[:, 0]
     plot_2d(x[:, 0], x[:, 1], y)
 
 class GPOpt:
-    def __init__(self, ndim, prange=[]):
+    """Bayesian optimization baseline.
+
+    Args:
+        ndim: Number of parameters
+        prange: (min, max) of each parameter, or a bounds.Bounds
+        acquisition: 'ei', 'ucb' or 'thompson'
+        optimizer: 'lbfgs' or 'sobol', see AcquisitionOptimizer
+        num_candidates: Number of Sobol candidates per proposal
+        max_time: Seconds after which no more L-BFGS restarts are started
+        seed: Seed of the candidates and of the first proposal
+        lengthscale: Kernel lengthscale in normalized units
+        noise: Observation noise variance
+    """
+    def __init__(self, ndim, prange=[], acquisition='thompson',
+                 optimizer='lbfgs', num_candidates=1024, max_time=None,
+                 seed=None, lengthscale=1.0, noise=1.0):
+        if acquisition not in ACQUISITIONS:
+            raise ValueError("Unknown acquisition {}, expected one of {}".format(
+                acquisition, sorted(ACQUISITIONS)))
         self.ndim = ndim
         self.prange = prange
-        self.X = []
-        self.y = []
-        xr = list(np.arange(0, 1, 0.1))
-        self.x = np.array(list(product(xr, repeat=ndim)))
+        self.bounds = prange if isinstance(prange, Bounds) else Bounds(prange)
+        self.rng = np.random.RandomState(seed)
+        # The defaults are the GPy RBF(variance=1, lengthscale=1) regression
+        # with unit noise variance this used to refit on every step
+        kernel = SquaredDistanceKernel(param=lengthscale ** 2, variance=1.0)
+        self.gp = GaussianProcess(kernel=kernel, noise=noise, normalize_y=True)
+        self.acquisition = ACQUISITIONS[acquisition]()
+        self.optimizer = AcquisitionOptimizer(ndim, method=optimizer,
+                                              num_candidates=num_candidates,
+                                              max_time=max_time, seed=seed)
 
     def update(self, X, y):
-        normalized_X = [0] * self.ndim
-        for i in range(self.ndim):
-            a, b = self.prange[i]
-            normalized_X[i] = (X[i] - a) / (b - a)
-        self.X.append(normalized_X)
-        self.y.append(y)
+        self.gp.update(self.bounds.to_unit(np.reshape(X, (-1, self.ndim))),
+                       np.reshape(y, -1))
 
     def next(self):
-        if len(self.X) == 0:
-            x = np.random.rand(3)
+        if self.gp.X is None:
+            x = self.rng.rand(self.ndim)
         else:
-            kernel = GPy.kern.RBF(input_dim=self.ndim,
-                                  variance=1, lengthscale=1)
-            X = np.array(self.X)
-            y = np.array(self.y).reshape((-1, 1))
-            m = GPy.models.GPRegression(X, y, kernel)
-            y_pred = m.posterior_samples_f(self.x, size=1)
-            x = self.x[np.argmax(y_pred)]
-        real_x = [0] * self.ndim
-        for i in range(self.ndim):
-            a, b = self.prange[i]
-            real_x[i] = x[i] * (b - a) + a
-        return real_x
+            x = self.optimizer(self.acquisition, self.gp, np.max(self.gp.Y))
+        return self.bounds.to_real(x).tolist()
 
 def test_gpopt():
+    from objectives import QuadraticEval
+
     opt = GPOpt(3, prange=[(0, 2), (0, 2), (0, 2)])
     func = QuadraticEval(num_dim=3, random=None, ptype='concave')
 
@@ -145,6 +443,5 @@ def test_gpopt():
     plt.plot(y_array)
     plt.show()
 
-test_gpopt()
-
-
+if __name__ == '__main__':
+    test_gpopt()
@@ -1,3 +1,4 @@
+import argparse
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL']='3'
 import tensorflow as tf
@@ -5,12 +6,11 @@ import numpy as np
 import logging
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-import json
 
 import rnn
 from reactions import QuadraticEval, ConstraintQuadraticEval, RealReaction
 from logger import get_handlers
-from collections import namedtuple
+from Config import add_override_argument, load_config
 
 logging.basicConfig(level=logging.INFO, handlers=get_handlers())
 logger = logging.getLogger()
@@ -93,47 +93,58 @@ class StepOptimizer:
 
         return x_array, y_array
 
+def parse_args():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("config_file", nargs="?", default="./config.json")
+    add_override_argument(parser)
+
+    args = parser.parse_args()
+
+    return args
+
 def main():
-    config_file = open('./config.json')
-    config = json.load(config_file,
-                       object_hook=lambda d:namedtuple('x', d.keys())(*d.values()))
+    args = parse_args()
+    config = load_config(args.config_file, args.overrides)
 
-    if config.opt_direction is 'max':
+    if config.opt_direction() == 'max':
         problem_type = 'concave'
     else:
         problem_type = 'convex'
 
-    if config.constraints:
-        func = ConstraintQuadraticEval(num_dim=config.num_params,
-                                       random=config.instrument_error,
+    if config.constraints():
+        func = ConstraintQuadraticEval(num_dim=config.num_params(),
+                                       random=config.instrument_error(),
                                        ptype=problem_type)
     else:
-        func = QuadraticEval(num_dim=config.num_params,
-                             random=config.instrument_error,
+        func = QuadraticEval(num_dim=config.num_params(),
+                             random=config.instrument_error(),
                              ptype=problem_type)
 
-    if config.policy == 'srnn':
+    if config.policy() == 'srnn':
         cell = rnn.StochasticRNNCell(cell=rnn.LSTM,
                                      kwargs=
-                                     {'hidden_size':config.hidden_size,
-                                      'use_batch_norm_h':config.batch_norm,
-                                      'use_batch_norm_x':config.batch_norm,
-                                      'use_batch_norm_c':config.batch_norm,},
-                                     nlayers=config.num_layers,
-                                     reuse=config.reuse)
-    if config.policy == 'rnn':
+                                     {'hidden_size':config.hidden_size(),
+                                      'use_batch_norm_h':config.batch_norm(),
+                                      'use_batch_norm_x':config.batch_norm(),
+                                      'use_batch_norm_c':config.batch_norm(),},
+                                     nlayers=config.num_layers(),
+                                     reuse=config.reuse())
+    if config.policy() == 'rnn':
         cell = rnn.MultiInputRNNCell(cell=rnn.LSTM,
                                      kwargs=
-                                     {'hidden_size':config.hidden_size,
-                                      'use_batch_norm_h':config.batch_norm,
-                                      'use_batch_norm_x':config.batch_norm,
-                                      'use_batch_norm_c':config.batch_norm,},
-                                     nlayers=config.num_layers,
-                                     reuse=config.reuse)
-    optimizer = StepOptimizer(cell=cell, func=func, ndim=config.num_params,
-                              nsteps=config.num_steps,
-                              ckpt_path=config.save_path, logger=logger,
-                              constraints=config.constraints)
+                                     {'hidden_size':config.hidden_size(),
+                                      'use_batch_norm_h':config.batch_norm(),
+                                      'use_batch_norm_x':config.batch_norm(),
+                                      'use_batch_norm_c':config.batch_norm(),},
+                                     nlayers=config.num_layers(),
+                                     reuse=config.reuse())
+    optimizer = StepOptimizer(cell=cell, func=func, ndim=config.num_params(),
+                              nsteps=config.num_steps(),
+                              ckpt_path=config.save_path(), logger=logger,
+                              constraints=config.constraints())
     x_array, y_array = optimizer.run()
 
     # np.savetxt('./scratch/nn_y.csv', y_array, delimiter=',')
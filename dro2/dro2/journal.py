@@ -0,0 +1,251 @@
+import json
+import os
+import time
+import numpy as np
+
+from objectives import is_exit
+
+class Journal:
+    """Append-only record of a real-reaction run, safe against crashes.
+
+    Every record is one JSON line that is flushed and fsynced before the
+    run goes on, so a journal holds everything up to the last completed
+    call even if the process dies. Each step writes two records:
+
+        {"type": "proposal", "step": 3, "x": [[...]], "conditions": [[...]],
+         "state": [...], "proposal_ms": ..., "time": ...}
+        {"type": "result", "step": 3, "y": [[...]], "reaction_s": ..., "time": ...}
+
+    x are the normalized conditions, conditions the same in real units and
+    state the arrays of the policy state the proposal was sampled with.
+    The proposal is written before the reaction is run, so a crash during
+    a reaction leaves a proposal without a result, which a resumed run
+    asks for again instead of proposing new conditions.
+    """
+    def __init__(self, path, resume=False):
+        """
+        Args:
+            path: JSONL file of the journal
+            resume: Continue the run recorded in path. Without it path must
+                    not hold records yet.
+        """
+
+        self.path = path
+        self.records = []
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            if not resume:
+                raise FileExistsError(
+                    "Journal {} already exists, resume it or choose another "
+                    "file".format(path))
+            self.records = read_journal(path)
+        elif resume:
+            raise FileNotFoundError("No journal to resume at {}".format(path))
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a')
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # End the line cut short by a crash, or the next record
+                    # would be appended to it
+                    self.file.write('\n')
+
+    def write(self, record):
+        record['time'] = time.time()
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records.append(record)
+
+    def start(self, **settings):
+        """Record the settings of a new or resumed run."""
+        record = {'type': 'start', 'resumed': len(self.steps()) > 0}
+        record.update(settings)
+        self.write(record)
+
+    def proposal(self, step, x, conditions=None, state=None, proposal_time=None):
+        self.write({'type': 'proposal', 'step': step,
+                    'x': np.asarray(x).tolist(),
+                    'conditions': None if conditions is None
+                                  else np.asarray(conditions).tolist(),
+                    'state': None if state is None
+                             else [s.tolist() for s in flat_state(state)],
+                    'proposal_ms': None if proposal_time is None
+                                   else proposal_time * 1000})
+
+    def result(self, step, y, reaction_time):
+        self.write({'type': 'result', 'step': step,
+                    'y': np.asarray(y).tolist(), 'reaction_s': reaction_time})
+
+    def steps(self):
+        """The recorded steps in order.
+
+        Returns:
+            list of dicts with the step, x, y (None if the reaction had no
+            result yet) and state of every proposal
+        """
+
+        steps = {}
+        for record in self.records:
+            if record['type'] == 'proposal':
+                steps[record['step']] = {'step': record['step'],
+                                         'x': np.array(record['x']),
+                                         'y': None, 'state': record['state']}
+            elif record['type'] == 'result' and record['step'] in steps:
+                steps[record['step']]['y'] = np.array(record['y'])
+        return [steps[step] for step in sorted(steps)]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def open_journal(config, path=None, resume=None):
+    """Open the journal of a real-reaction run described by config.
+
+    Args:
+        path: Journal of a new run, a timestamped file in log_path by default
+        resume: Journal of an interrupted run to continue instead
+    """
+
+    if resume is not None:
+        journal = Journal(resume, resume=True)
+    else:
+        if path is None:
+            path = os.path.join(config.log_path(), 'journal-{}.jsonl'.format(
+                time.strftime('%Y%m%d-%H%M%S')))
+        journal = Journal(path)
+    journal.start(config_file=config.file_name, ndim=config.num_params(),
+                  nsteps=config.num_steps(), batch_size=config.num_reactors(),
+                  param_names=list(config.param_names()),
+                  param_ranges=[list(r) for r in config.param_ranges()])
+    return journal
+
+def read_journal(path):
+    """Read the records of a journal.
+
+    A line cut short by a crash while writing is skipped.
+    """
+
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def flat_state(state):
+    """Arrays of a policy state (nested lists or tuples) in order."""
+    if isinstance(state, (list, tuple)):
+        return [array for s in state for array in flat_state(s)]
+    return [np.asarray(state)]
+
+def run_steps(step, x0, state0, func, nsteps, journal=None, logger=None,
+              name='StepOptimizer'):
+    """Optimization loop of StepOptimizer and NumpyStepOptimizer.
+
+    With a journal every proposal and result is recorded as it happens.
+    If the journal already holds steps, the policy state is rebuilt by
+    feeding the recorded conditions and yields through step, and the run
+    continues after them without running any recorded reaction again.
+
+    Args:
+        step: Callable (x, y, state) -> (new_x, new_state)
+        x0: [batch_size, ndim] initial normalized conditions
+        state0: Initial policy state
+        func: Objective taking [batch_size, ndim] conditions
+        nsteps: Number of proposals after the initial conditions
+        name: Name of the optimizer in exit messages
+
+    Returns:
+        x_array: [nsteps + 1, batch_size, ndim] normalized conditions
+        y_array: [nsteps + 1, batch_size, 1] objective values
+    """
+
+    batch_size, ndim = np.shape(x0)
+    x_array = np.zeros((nsteps + 1, batch_size, ndim))
+    y_array = np.zeros((nsteps + 1, batch_size, 1))
+    convert = getattr(func, 'x_convert', None)
+
+    def evaluate(i, x, state, proposal_time=None):
+        if journal is not None:
+            journal.proposal(i, x, None if convert is None else convert(x),
+                             state, proposal_time)
+        start = time.perf_counter()
+        y = func(x)
+        if is_exit(y):
+            return y
+        y = np.array(y).reshape(batch_size, 1)
+        if journal is not None:
+            journal.result(i, y, time.perf_counter() - start)
+        return y
+
+    history = journal.steps() if journal is not None else []
+    state = state0
+    if len(history) > 0:
+        if len(history) > nsteps + 1:
+            raise ValueError("The journal holds {} steps, more than the {} of "
+                             "this run".format(len(history), nsteps + 1))
+        for entry in history[:-1]:
+            x_array[entry['step']] = entry['x']
+            y_array[entry['step']] = entry['y']
+            _, state = step(entry['x'], entry['y'], state)
+        last = history[-1]
+        check_state(state, last['state'], logger)
+        i, x, y = last['step'], last['x'], last['y']
+        if logger is not None:
+            logger.info('Resumed after {} journaled steps.'.format(i))
+        if y is None:
+            # The reaction of the last proposal has no result yet
+            y = evaluate(i, x, state)
+    else:
+        i, x = 0, x0
+        y = evaluate(i, x, state)
+
+    def log_exit():
+        if logger is not None:
+            logger.info('Exit received, stopping {} after {} steps.'.format(
+                name, i))
+
+    # If a stop command was received, stop optimizing
+    if is_exit(y):
+        log_exit()
+        return x_array, y_array
+
+    x_array[i] = x
+    y_array[i] = y
+    for i in range(i + 1, nsteps + 1):
+        start = time.perf_counter()
+        x, state = step(x, y, state)
+        y = evaluate(i, x, state, time.perf_counter() - start)
+
+        # If a stop command was received, stop optimizing
+        if is_exit(y):
+            log_exit()
+            break
+
+        x_array[i] = x
+        y_array[i] = y
+
+    return x_array, y_array
+
+def check_state(state, recorded, logger):
+    """Warn if a replayed policy state differs from the journaled one.
+
+    A difference means the policy changed since the journal was written,
+    the run still continues from the replayed state.
+    """
+
+    if recorded is None or logger is None:
+        return
+    replayed = flat_state(state)
+    if len(replayed) != len(recorded) or not all(
+            np.shape(a) == np.shape(b) and np.allclose(a, b, atol=1e-5)
+            for a, b in zip(replayed, recorded)):
+        logger.warning('Replayed policy state differs from the journal, '
+                       'the policy may have changed since it was written.')
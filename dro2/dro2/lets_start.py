@@ -8,8 +8,12 @@ import util
 import numpy as np
 import logging
 import json
+import time
 
-from Config import Config
+from Config import add_override_argument, load_config, thaw
+from checkpoint import CheckpointManager, next_epoch
+from evaluation import Evaluator
+from metrics import TrainingMetrics
 from model import Optimizer
 from rnn import MultiInputLSTM
 from logger import get_handlers
@@ -21,11 +25,93 @@ def parse_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("config_file")
+    add_override_argument(parser)
 
     args = parser.parse_args()
 
     return args
 
+def train(sess, model, config, logger, run_epoch, evaluator=None,
+          first_epoch=None):
+    """Run the training epochs, logging the cost and saving the best models.
+
+    Args:
+        run_epoch: Callable running one epoch and returning its cost and a
+                   dict of further statistics for the metrics file
+        evaluator: evaluation.Evaluator run every evaluation_period epochs.
+                   Models are selected on its cost if given, otherwise on
+                   the training cost.
+        first_epoch: Number of the first epoch, by default the one after
+                     the checkpoints in save_path, so a resumed run
+                     continues their numbering
+    """
+
+    checkpoints = None
+    if config.save_path() is not None:
+        checkpoints = CheckpointManager(model.saved_variables,
+                                        config.save_path(), max_to_keep=3,
+                                        config_file=util.saved_config_path(config),
+                                        logger=logger)
+    metrics_file = None
+    if config.log_path():
+        os.makedirs(config.log_path(), exist_ok=True)
+        metrics_file = os.path.join(config.log_path(), 'metrics.jsonl')
+    metrics = TrainingMetrics(metrics_file)
+    total_cost = 0
+    if first_epoch is None:
+        first_epoch = next_epoch(config.save_path())
+
+    for e in range(first_epoch, first_epoch + config.num_epochs()):
+        stage = util.apply_curriculum(sess, model, config, e,
+                                      resume=e == first_epoch)
+        if stage is not None:
+            logger.info('Epoch {}, curriculum stage {}'.format(
+                e, json.dumps(thaw(stage))))
+        start = time.perf_counter()
+        cost, stats = run_epoch()
+        metrics.record(cost, time.perf_counter() - start, **stats)
+        total_cost += cost
+        done = e - first_epoch + 1
+
+        if done % config.log_period() == 0:
+            summary = metrics.flush(e)
+            logger.info('Epoch {}, Mean Error: {:.3f}, Learning Rate: {:.2e}, '
+                        'Epochs/s: {:.1f}'.format(
+                            e, summary['loss'], summary['learning_rate'],
+                            summary['epochs_per_sec']))
+
+        if done % config.evaluation_period() == 0:
+            elm_e = total_cost / config.evaluation_period()
+            logger.info('Current {} epochs, Mean Error: {:.3f}'.format(config.evaluation_period(), elm_e))
+
+            eval_cost = elm_e
+            if evaluator is not None:
+                result = evaluator.run(sess, epoch=e)
+                eval_cost = result['cost']
+                logger.info('Evaluation, Mean Regret: {:.4f}, Final Regret: {:.4f}'.format(
+                    result['cost'], result['final_regret']))
+
+            if checkpoints is not None and checkpoints.save(sess, e, eval_cost):
+                logger.info('Save current model ...')
+
+            total_cost = 0
+
+    metrics.close()
+    if checkpoints is not None:
+        checkpoints.close()
+
+def make_evaluator(config, model):
+    """Evaluator on evaluation_epochs batches of held-out problems, or None."""
+
+    if config.evaluation_epochs() <= 0:
+        return None
+    log_file = None
+    if config.log_path():
+        os.makedirs(config.log_path(), exist_ok=True)
+        log_file = os.path.join(config.log_path(), 'evaluation.jsonl')
+    return Evaluator(config, model.cell, constraints=model.constraints,
+                     log_file=log_file)
+
 def main():
 
     args = parse_args()
@@ -33,48 +119,23 @@ def main():
     logging.basicConfig(level=logging.INFO, handlers=get_handlers())
     logger = logging.getLogger()
     
-    config_file = open(args.config_file)
-    config = Config(config_file)
-    config_file.close()
+    config = load_config(args.config_file, args.overrides)
     logger.info(str(config.config))
 
 
     num_unrolls = config.num_steps() // config.unroll_length()
-    with tf.Session() as sess:
-        # tf.get_default_graph().finalize()
+    with tf.Session(config=util.session_config(config)) as sess:
         model = util.create_model(sess, config, logger)
         if(model == None):
             return
-        
-        step, loss, reset, fx_array, x_array = model.step()
-
-        best_cost = [float('inf')] * 3
-        epoch_cost = 0
-        total_cost = 0
-
-        for e in range(config.num_epochs()):
-            cost, _ = util.run_epoch(sess, loss, [step], reset, num_unrolls)
-            epoch_cost += cost
-            total_cost += cost
-
-            if (e + 1) % config.log_period() == 0:
-                lm_e = epoch_cost / config.log_period()
-                logger.info('Epoch {}, Mean Error: {:.3f}'.format(e, lm_e))
-                epoch_cost = 0
-
-            if (e + 1) % config.evaluation_period() == 0:
-                elm_e = total_cost / config.evaluation_period()
-                logger.info('Current {} epochs, Mean Error: {:.3f}'.format(config.evaluation_period(), elm_e))
 
-                mbc = max(best_cost)
-                if config.save_path() is not None and total_cost < mbc:
-                    best_cost.remove(mbc)
-                    best_cost.append(total_cost)
-                    logger.info('Save current model ...')
-                    model.saver.save(sess, config.save_path(), global_step=e)
+        run_epoch = util.make_epoch_runner(sess, model, num_unrolls)
+        evaluator = make_evaluator(config, model)
+        # Nothing may add ops to the graph from here on
+        tf.get_default_graph().finalize()
+        sess.run(model.reset)
 
-                total_cost = 0
+        train(sess, model, config, logger, run_epoch, evaluator)
 
-                
 if __name__ == '__main__':
     main()
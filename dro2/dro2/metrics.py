@@ -0,0 +1,92 @@
+import json
+import time
+import numpy as np
+
+class TrainingMetrics:
+    """Collect per-epoch training statistics and write them as JSON lines.
+
+    record() is called after every epoch and flush() every log period. Each
+    flush writes one line summarizing the epochs since the last one:
+
+        {"epoch": 99, "loss": ..., "learning_rate": ..., "grad_norm": ...,
+         "epochs_per_sec": ..., "step_ms_p50": ..., "step_ms_p95": ...,
+         "step_ms_max": ..., "time": ...}
+
+    plot_output.py reads these files.
+    """
+    def __init__(self, path=None):
+        """
+        Args:
+            path: JSONL file to append to, None to only return summaries
+        """
+
+        self.path = path
+        self.file = open(path, 'a') if path is not None else None
+        self._clear()
+
+    def _clear(self):
+        self.losses = []
+        self.step_times = []
+        self.values = {}
+        self.start = time.perf_counter()
+
+    def record(self, loss, step_time, **values):
+        """Record one epoch.
+
+        Args:
+            loss: Cost of the epoch
+            step_time: Seconds the epoch took
+            values: Further scalars, averaged over the period
+        """
+
+        self.losses.append(float(loss))
+        self.step_times.append(step_time)
+        for key, value in values.items():
+            self.values.setdefault(key, []).append(float(value))
+
+    def flush(self, epoch):
+        """Summarize and write the epochs recorded since the last flush.
+
+        Returns:
+            The summary dict, None if nothing was recorded
+        """
+
+        if len(self.losses) == 0:
+            return None
+
+        step_ms = np.array(self.step_times) * 1000
+        elapsed = time.perf_counter() - self.start
+        summary = {'epoch': epoch, 'loss': float(np.mean(self.losses))}
+        summary.update({key: float(np.mean(values))
+                        for key, values in self.values.items()})
+        summary.update({
+            'epochs_per_sec': len(self.losses) / max(elapsed, 1e-9),
+            'step_ms_p50': float(np.percentile(step_ms, 50)),
+            'step_ms_p95': float(np.percentile(step_ms, 95)),
+            'step_ms_max': float(np.max(step_ms)),
+            'time': time.time(),
+        })
+
+        if self.file is not None:
+            self.file.write(json.dumps(summary) + '\n')
+            self.file.flush()
+        self._clear()
+        return summary
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def read_metrics(path):
+    """Read a metrics file into a dict of lists, one list per key."""
+    columns = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            for key, value in row.items():
+                columns.setdefault(key, []).append(value)
+    return columns
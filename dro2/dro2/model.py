@@ -7,8 +7,10 @@ from tensorflow.python.util import nest
 class Optimizer:
     def __init__(self, cell, logger, func, ndim, batch_size, unroll_len,
                  lr=0.01, loss_type='naive', optimizer='Adam', trainable_init=False,
-                 direction='max', constraints=False, discount_factor=1.0):
+                 direction='max', constraints=False, discount_factor=1.0,
+                 lr_schedule='constant', lr_decay=1.0, lr_decay_steps=1000):
         self.batch_size = batch_size
+        self.func = func
         self.constraints = constraints
         self.logger = logger
         self.cell = cell
@@ -17,13 +19,29 @@ class Optimizer:
         self.make_loss(func, ndim, batch_size, unroll_len)
         loss_func = self.get_loss_func(loss_type, direction)
         self.loss = loss_func(self.fx_array)
-        optimizer = getattr(tf.train, optimizer + 'Optimizer')(lr)
+        self.learning_rate = self.make_learning_rate(lr, lr_schedule, lr_decay,
+                                                     lr_decay_steps)
+        optimizer = getattr(tf.train, optimizer + 'Optimizer')(self.learning_rate)
         gvs = optimizer.compute_gradients(self.loss)
+        self.grad_norm = tf.global_norm([grad for grad, _ in gvs],
+                                        name='grad_norm')
         capped_gvs = [(tf.clip_by_value(grad, -0.1, 0.1), var) for grad, var in gvs]
-        self.opt = optimizer.apply_gradients(capped_gvs)
+        self.opt = optimizer.apply_gradients(capped_gvs,
+                                             global_step=self.global_step)
+        self.optimizer = optimizer
+        self.grads = [grad for grad, _ in capped_gvs]
+        self.grad_vars = [var for _, var in capped_gvs]
+
+        # Update and reset for the next epoch in one op, so the last unroll
+        # of an epoch needs no separate session call for the reset
+        with tf.control_dependencies([self.opt, self.loss]):
+            self.reset_next = tf.group(
+                *[tf.assign(var, var.initial_value)
+                  for var in self.reset_variables], name='reset_next')
 
         # self.opt = optimizer.minimize(self.loss)
-        self.saver = tf.train.Saver(tf.global_variables(), max_to_keep=3)
+        self.saved_variables = tf.global_variables()
+        self.saver = tf.train.Saver(self.saved_variables, max_to_keep=3)
         logger.info('model variable:')
         logger.info(str([var.name for var in tf.global_variables()]))
         logger.info('trainable variables:')
@@ -32,6 +50,26 @@ class Optimizer:
         self.x_array = self.x_array.stack()
 
 
+    def make_learning_rate(self, lr, schedule, decay, decay_steps):
+        """Learning rate decayed by a factor of decay every decay_steps updates.
+
+        'exponential' decays smoothly, 'step' in stairs and 'constant' not
+        at all. Only decaying schedules add a global step variable, so
+        checkpoints of constant-rate models keep their variables.
+        """
+
+        if schedule not in ('constant', 'exponential', 'step'):
+            raise ValueError("Unknown lr_schedule {}, expected 'constant', "
+                             "'exponential' or 'step'".format(schedule))
+        if schedule == 'constant':
+            self.global_step = None
+            return tf.constant(lr, dtype=tf.float32, name='learning_rate')
+
+        self.global_step = tf.train.get_or_create_global_step()
+        return tf.train.exponential_decay(lr, self.global_step, decay_steps,
+                                          decay, staircase=schedule == 'step',
+                                          name='learning_rate')
+
     def make_discount(self, gamma, unroll_len):
         df = [(gamma ** (unroll_len - i)) for i in range(unroll_len + 1)]
         return tf.constant(df, shape=[unroll_len + 1, 1], dtype=tf.float32)
@@ -80,6 +118,7 @@ class Optimizer:
         with tf.name_scope('reset'):
 
             variables = [x,] + constants
+            self.reset_variables = variables
             # Empty array as part of the reset process.
             self.reset = [tf.variables_initializer(variables),
                 self.fx_array.close(), self.x_array.close()]
@@ -92,22 +131,38 @@ class Optimizer:
                 loss = tf.reduce_sum(
                     tf.matmul(tf.reshape(fx.stack(), [self.batch_size, -1]),
                               self.df, name='loss'))
-            elif loss_type == 'oi' and direction == 'max':
-                loss = tf.reduce_sum(
-                    [fx.read(i) - tf.reduce_max(
-                            fx.gather(list(range(i))), axis=0)
-                        for i in range(1, self.unroll_len + 1)],
-                    name='loss')
-            elif loss_type == 'oi' and direction == 'min':
-                loss = tf.reduce_sum(
-                    [fx.read(i) - tf.reduce_min(
-                            fx.gather(list(range(i))), axis=0)
-                        for i in range(1, self.unroll_len + 1)],
-                    name='loss')
+            elif loss_type == 'oi':
+                # Observed improvement: fx[i] minus the best of fx[:i].
+                # The running best is one scan over the stacked values
+                # instead of unroll_len gathers and reductions.
+                best = tf.maximum if direction == 'max' else tf.minimum
+                fx_stack = fx.stack()
+                best_fx = tf.scan(best, fx_stack)
+                loss = tf.reduce_sum(fx_stack[1:] - best_fx[:-1], name='loss')
             if direction == 'max':
                 loss = - loss
             return loss / self.batch_size
         return loss_func
 
+    def build_apply_gradients(self):
+        """Ops to apply gradients computed elsewhere, e.g. by other workers.
+
+        The gradients are fed through self.grad_placeholders, in the order
+        of self.grads. The update shares the slots of the optimizer with
+        self.opt.
+
+        Returns:
+            The apply op
+        """
+
+        self.grad_placeholders = [
+            tf.placeholder(grad.dtype, shape=grad.get_shape(),
+                           name='grad_{}'.format(i))
+            for i, grad in enumerate(self.grads)]
+        self.apply_grads = self.optimizer.apply_gradients(
+            list(zip(self.grad_placeholders, self.grad_vars)),
+            global_step=self.global_step)
+        return self.apply_grads
+
     def step(self):
         return self.opt, self.loss, self.reset, self.fx_array, self.x_array
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import logging
+import re
+import numpy as np
+
+from Config import add_override_argument, load_config
+from journal import open_journal, run_steps
+from logger import get_handlers
+from objectives import create_objective, normalized_param_init
+from weight_store import is_weight_store, load_weight_store
+
+# Variable name suffixes of the policy weights in a training checkpoint
+W_GATES = 'w_gates'
+B_GATES = 'b_gates'
+PROJ_WEIGHT = 'proj/proj_weight'
+PROJ_BIAS = 'proj/proj_bias'
+POLICY_SUFFIXES = (W_GATES, B_GATES, PROJ_WEIGHT, PROJ_BIAS)
+# Variables of the LSTM layers of a policy trained with batch_norm, named
+# like rnn.LSTM (W_GATES + "_H" etc.), which can not be imported without
+# TensorFlow
+BATCH_NORM_SUFFIXES = (W_GATES + '_H', W_GATES + '_X', 'gamma_h', 'gamma_x',
+                       'gamma_c', 'beta_c', 'moving_mean', 'moving_variance')
+
+def is_policy_variable(name):
+    """Check if a checkpoint variable is needed to evaluate the policy.
+
+    Optimizer slots (e.g. '.../w_gates/Adam') and the training problem
+    variables are excluded.
+    """
+
+    return any(name.endswith('/' + suffix) for suffix in POLICY_SUFFIXES)
+
+def check_no_batch_norm(names):
+    """Raise ValueError if variable names belong to a batch-norm policy."""
+    if any(name.endswith('/' + suffix)
+           for name in names for suffix in BATCH_NORM_SUFFIXES):
+        raise ValueError("The NumPy backend does not support policies "
+                         "trained with batch_norm")
+
+def read_checkpoint_weights(ckpt_path):
+    """Read the policy weights from the latest checkpoint in ckpt_path.
+
+    Requires TensorFlow, which is imported here so the rest of the module
+    stays usable without it.
+
+    Returns:
+        dict mapping variable names to numpy arrays
+    """
+
+    import tensorflow as tf
+
+    ckpt = tf.train.get_checkpoint_state(ckpt_path)
+    if not (ckpt and ckpt.model_checkpoint_path):
+        raise FileNotFoundError('No checkpoint available')
+
+    names = [name for name, _ in
+             tf.train.list_variables(ckpt.model_checkpoint_path)]
+    check_no_batch_norm(names)
+    reader = tf.train.load_checkpoint(ckpt.model_checkpoint_path)
+    return {name: reader.get_tensor(name)
+            for name in names if is_policy_variable(name)}
+
+def load_weights(path):
+    """Load policy weights from a .npz file, a weight store or a checkpoint
+    directory.
+
+    The arrays of a weight store are read-only views into the mapped file.
+
+    Returns:
+        dict mapping variable names to numpy arrays
+    """
+
+    if os.path.isdir(path):
+        return read_checkpoint_weights(path)
+    if is_weight_store(path):
+        return load_weight_store(path)
+
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+def layer_index(name):
+    """Sort key putting 'lstm' before 'lstm_0', 'lstm_1', ..., 'lstm_10'."""
+    match = re.search(r'_(\d+)/' + W_GATES + '$', name)
+    if match is None:
+        return -1
+    return int(match.group(1))
+
+def draw_noise(rng, shape, dtype, noise=None, num_samples=None):
+    """Standard normal draws of one sample or num_samples samples of shape.
+
+    Given noise is returned as it is.
+    """
+
+    if noise is None:
+        if num_samples is not None:
+            shape = (num_samples,) + shape
+        noise = rng.standard_normal(shape).astype(dtype)
+    return noise
+
+def batch_first(samples, num_samples=None):
+    """Move the sample axis of [num_samples, batch_size, x_dim] draws second."""
+    if num_samples is None:
+        return samples
+    return np.transpose(samples, [1, 0, 2])
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+class NumpyLSTM:
+    """One layer of rnn.LSTM without peepholes or batch norm."""
+    def __init__(self, w_gates, b_gates, forget_bias=1.0):
+        self.w_gates = w_gates
+        self.b_gates = b_gates
+        self.forget_bias = forget_bias
+        self.hidden_size = b_gates.shape[0] // 4
+
+    def __call__(self, inputs, prev_state):
+        prev_hidden, prev_cell = prev_state
+        inputs_and_hidden = np.concatenate([inputs, prev_hidden], axis=1)
+        gates = np.dot(inputs_and_hidden, self.w_gates) + self.b_gates
+
+        # i = input_gate, j = new_input, f = forget_gate, o = output_gate
+        i, j, f, o = np.split(gates, 4, axis=1)
+
+        forget_mask = sigmoid(f + self.forget_bias)
+        new_cell = forget_mask * prev_cell + sigmoid(i) * np.tanh(j)
+        new_hidden = np.tanh(new_cell) * sigmoid(o)
+        return new_hidden, (new_hidden, new_cell)
+
+def lstm_layers(weights, nlayers):
+    """NumpyLSTM layers from a dict of checkpoint variables."""
+    w_names = sorted([name for name in weights if name.endswith(W_GATES)],
+                     key=layer_index)
+    if len(w_names) == 0:
+        raise KeyError('No {} variables in weights'.format(W_GATES))
+    # A single set of weights is shared by all layers when reuse is on
+    if len(w_names) == 1:
+        w_names = w_names * nlayers
+    if len(w_names) != nlayers:
+        raise ValueError('Found {} LSTM layers, expected {}'.format(
+            len(w_names), nlayers))
+
+    return [NumpyLSTM(weights[name], weights[name[:-len(W_GATES)] + B_GATES])
+            for name in w_names]
+
+def projection_weights(weights):
+    """Weight and bias of the projection from a dict of checkpoint variables."""
+    proj_weight = [weights[name] for name in weights
+                   if name.endswith(PROJ_WEIGHT)]
+    proj_bias = [weights[name] for name in weights
+                 if name.endswith(PROJ_BIAS)]
+    if len(proj_weight) != 1 or len(proj_bias) != 1:
+        raise KeyError('Expected exactly one projection layer in weights')
+    return proj_weight[0], proj_bias[0]
+
+class NumpyStochasticRNNCell:
+    """NumPy counterpart of rnn.StochasticRNNCell.
+
+    Inference only needs one forward step of the LSTM stack and one sample
+    of the projected MultivariateNormalTriL per reaction, so TensorFlow is
+    not needed to run a trained policy. Given the same weights, inputs and
+    standard normal draws this computes the same proposal as the TensorFlow
+    cell. TensorFlow and NumPy use different random streams, so the draws
+    can be passed in explicitly to reproduce a TensorFlow run.
+    """
+    def __init__(self, layers, proj_weight, proj_bias, seed=None):
+        self.layers = layers
+        self.proj_weight = proj_weight
+        self.proj_bias = proj_bias
+        self.dtype = proj_weight.dtype
+        self.rng = np.random.RandomState(seed)
+
+    @classmethod
+    def from_weights(cls, weights, nlayers, seed=None):
+        """Build the cell from a dict of checkpoint variables.
+
+        Args:
+            weights: dict mapping variable names to arrays
+            nlayers: Number of LSTM layers, needed when the layers share
+                     weights (reuse in the config)
+            seed: Seed of the sampling random stream
+        """
+
+        proj_weight, proj_bias = projection_weights(weights)
+        return cls(lstm_layers(weights, nlayers), proj_weight, proj_bias,
+                   seed=seed)
+
+    def distribution(self, x, y, state):
+        """Compute the proposal distribution for the next step.
+
+        Returns:
+            mean: [batch_size, x_dim] mean of the proposal
+            scale_tril: [batch_size, x_dim, x_dim] lower triangular scale
+            new_state: list of (hidden, cell) tuples, one per layer
+        """
+
+        x = np.asarray(x, dtype=self.dtype)
+        x_dim = x.shape[1]
+        y = np.tile(np.reshape(np.asarray(y, dtype=self.dtype), [-1, 1]),
+                    [1, x_dim])
+        output = np.concatenate([x, y], axis=1)
+
+        new_state = []
+        for layer, layer_state in zip(self.layers, state):
+            output, layer_state = layer(output, layer_state)
+            new_state.append(layer_state)
+
+        out = np.dot(output, self.proj_weight) + self.proj_bias
+        mean, var = out[:, :x_dim], out[:, x_dim:]
+        # MultivariateNormalTriL ignores the upper triangle of its scale
+        scale_tril = np.tril(np.reshape(var, [-1, x_dim, x_dim]))
+        return mean, scale_tril, new_state
+
+    def __call__(self, x, y, state, noise=None, num_samples=None):
+        """Sample the next proposal.
+
+        Args:
+            x: [batch_size, x_dim] current normalized conditions
+            y: [batch_size, 1] objective values of x
+            state: list of (hidden, cell) tuples, one per layer
+            noise: optional [batch_size, x_dim] standard normal draws,
+                   [num_samples, batch_size, x_dim] with num_samples
+            num_samples: Draw this many candidates per row, new_x is then
+                         a [batch_size, num_samples, x_dim] block
+
+        Returns:
+            new_x, new_state
+        """
+
+        mean, scale_tril, new_state = self.distribution(x, y, state)
+        noise = draw_noise(self.rng, mean.shape, self.dtype, noise, num_samples)
+        new_x = mean + np.einsum('bij,...bj->...bi', scale_tril, noise)
+        return batch_first(new_x, num_samples), new_state
+
+    def get_initial_state(self, batch_size, ndim=None):
+        return [(np.zeros((batch_size, layer.hidden_size), dtype=self.dtype),
+                 np.zeros((batch_size, layer.hidden_size), dtype=self.dtype))
+                for layer in self.layers]
+
+class NumpyCoordinatewiseRNNCell:
+    """NumPy counterpart of rnn.CoordinatewiseRNNCell.
+
+    The weights do not depend on the number of parameters, so the same
+    cell serves reactions of any dimension.
+    """
+    def __init__(self, layers, proj_weight, proj_bias, seed=None):
+        self.layers = layers
+        self.proj_weight = proj_weight
+        self.proj_bias = proj_bias
+        self.dtype = proj_weight.dtype
+        self.rng = np.random.RandomState(seed)
+
+    @classmethod
+    def from_weights(cls, weights, nlayers, seed=None):
+        """Build the cell from a dict of checkpoint variables."""
+        proj_weight, proj_bias = projection_weights(weights)
+        return cls(lstm_layers(weights, nlayers), proj_weight, proj_bias,
+                   seed=seed)
+
+    def distribution(self, x, y, state):
+        """Compute the proposal distribution for the next step.
+
+        Returns:
+            mean: [batch_size, x_dim] mean of the proposal
+            scale: [batch_size, x_dim] standard deviation of the proposal
+            new_state: list of (hidden, cell) tuples of
+                       [batch_size, x_dim, hidden_size] blocks, one per layer
+        """
+
+        x = np.asarray(x, dtype=self.dtype)
+        batch_size, x_dim = x.shape
+        y = np.tile(np.reshape(np.asarray(y, dtype=self.dtype), [-1, 1]),
+                    [1, x_dim])
+        output = np.reshape(np.stack([x, y], axis=2), [-1, 2])
+
+        new_state = []
+        for layer, (hidden, cell) in zip(self.layers, state):
+            output, (hidden, cell) = layer(
+                output, (np.reshape(hidden, [-1, layer.hidden_size]),
+                         np.reshape(cell, [-1, layer.hidden_size])))
+            new_state.append(
+                (np.reshape(hidden, [batch_size, x_dim, layer.hidden_size]),
+                 np.reshape(cell, [batch_size, x_dim, layer.hidden_size])))
+
+        output = np.reshape(output, [batch_size, x_dim, -1])
+        pooled = np.broadcast_to(np.mean(output, axis=1, keepdims=True),
+                                 output.shape)
+        features = np.concatenate([output, pooled], axis=2)
+        out = np.dot(features, self.proj_weight) + self.proj_bias
+        # softplus
+        scale = np.logaddexp(0, out[:, :, 1])
+        return out[:, :, 0], scale, new_state
+
+    def __call__(self, x, y, state, noise=None, num_samples=None):
+        """Sample the next proposal, see NumpyStochasticRNNCell.__call__."""
+        mean, scale, new_state = self.distribution(x, y, state)
+        noise = draw_noise(self.rng, mean.shape, self.dtype, noise, num_samples)
+        return batch_first(mean + scale * noise, num_samples), new_state
+
+    def get_initial_state(self, batch_size, ndim):
+        return [(np.zeros((batch_size, ndim, layer.hidden_size), dtype=self.dtype),
+                 np.zeros((batch_size, ndim, layer.hidden_size), dtype=self.dtype))
+                for layer in self.layers]
+
+NUMPY_CELLS = {'srnn': NumpyStochasticRNNCell,
+               'crnn': NumpyCoordinatewiseRNNCell}
+
+def create_cell(config, weights, seed=None):
+    """NumPy policy cell for the policy of config."""
+    if config.batch_norm():
+        raise ValueError("The NumPy backend does not support policies "
+                         "trained with batch_norm")
+    check_no_batch_norm(weights)
+    if config.policy() not in NUMPY_CELLS:
+        raise ValueError("No NumPy version of policy {}, expected one of "
+                         "{}".format(config.policy(), sorted(NUMPY_CELLS)))
+    return NUMPY_CELLS[config.policy()].from_weights(
+        weights, nlayers=config.num_layers(), seed=seed)
+
+class NumpyStepOptimizer:
+    """Drop-in replacement of realreaction.StepOptimizer without TensorFlow."""
+    def __init__(self, cell, func, ndim, nsteps, logger, constraints, x0=[],
+                 batch_size=1, num_samples=1, selector=None):
+        self.logger = logger
+        self.cell = cell
+        self.func = func
+        self.ndim = ndim
+        self.nsteps = nsteps
+        self.constraints = constraints
+        self.x0 = x0
+        self.batch_size = batch_size
+        self.num_samples = num_samples
+        self.selector = selector
+
+    def step(self, x, y, state):
+        if self.selector is None or self.num_samples <= 1:
+            new_x, new_state = self.cell(x, y, state)
+            if self.constraints:
+                new_x = np.clip(new_x, 0.01, 0.99)
+            return new_x, new_state
+
+        self.selector.update(x, y)
+        candidates, new_state = self.cell(x, y, state,
+                                          num_samples=self.num_samples)
+        if self.constraints:
+            candidates = np.clip(candidates, 0.01, 0.99)
+        return self.selector.select(candidates), new_state
+
+    def initial_x(self):
+        if (len(self.x0) == 0):
+            x = np.random.normal(loc=0.5, scale=0.2,
+                                 size=(self.batch_size, self.ndim))
+            x = np.maximum(np.minimum(x, 0.9), 0.1)
+        else:
+            x = np.tile(np.array(self.x0).reshape((1, self.ndim)),
+                        (self.batch_size, 1))
+        return x
+
+    def run(self, journal=None):
+        """Run nsteps optimization steps, see realreaction.StepOptimizer.run."""
+        return run_steps(self.step, self.initial_x(),
+                         self.cell.get_initial_state(self.batch_size, self.ndim),
+                         self.func, self.nsteps, journal=journal,
+                         logger=self.logger, name='NumpyStepOptimizer')
+
+def parse_args():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("config_file")
+    add_override_argument(parser)
+    parser.add_argument("--weights", default=None,
+                        help="Weights written by export_model.py --format npz "
+                        "or mmap, or a checkpoint directory (defaults to "
+                        "policy_weights.npz inside save_path)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the proposal sampling")
+
+    parser.add_argument("--journal", default=None,
+                        help="Journal file of the run (defaults to a new "
+                        "journal-<time>.jsonl inside log_path)")
+    parser.add_argument("--resume", default=None,
+                        help="Journal of an interrupted run to continue")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    # Parse command line arguments
+    args = parse_args()
+
+    logging.basicConfig(level=logging.ERROR, handlers=get_handlers())
+    logger = logging.getLogger()
+
+    # Open and parse the config file
+    config = load_config(args.config_file, args.overrides)
+    logger.info(str(config.config))
+
+    selector = None
+    if config.num_candidates() > 1:
+        # The GP surrogate needs scipy, which plain inference does without
+        from gp import create_selector
+        selector = create_selector(config)
+
+    weights_path = args.weights
+    if weights_path is None:
+        weights_path = os.path.join(config.save_path(), 'policy_weights.npz')
+    cell = create_cell(config, load_weights(weights_path), seed=args.seed)
+
+    x0 = normalized_param_init(config)
+    func = create_objective(config, logger)
+
+    optimizer = NumpyStepOptimizer(cell=cell, func=func,
+                                   ndim=config.num_params(),
+                                   nsteps=config.num_steps(), logger=logger,
+                                   constraints=config.constraints(), x0=x0,
+                                   batch_size=config.num_reactors(),
+                                   num_samples=config.num_candidates(),
+                                   selector=selector)
+
+    journal = open_journal(config, args.journal, args.resume)
+    try:
+        x_array, y_array = optimizer.run(journal)
+    finally:
+        journal.close()
+
+if __name__ == '__main__':
+    main()
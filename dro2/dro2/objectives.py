@@ -0,0 +1,297 @@
+import numpy as np
+import json
+
+from bounds import Bounds, config_bounds
+from transport import ZMQTransport
+from protocol import EXIT, YIELDS, ProtocolError, get_codec
+
+class QuadraticEval:
+    def __init__(self, num_dim=3, random=0.5, ptype='convex',
+                 dtype=np.float32, ifprint=False, record=False, rng=None):
+        self.ndim = num_dim
+        self.dtype = dtype
+        # A RandomState of its own, or the global one
+        self.rng = np.random if rng is None else rng
+        if random is not None:
+            self.e = self.rng.normal(scale=random)
+        else:
+            self.e = 0.0
+        self.record = record
+        self.refresh()
+        self.normalizer = np.maximum(
+            self._func(np.zeros([1, self.ndim], dtype=self.dtype)),
+            self._func(np.ones([1, self.ndim], dtype=self.dtype)))
+        self.ptype = ptype
+        self.ifprint = ifprint
+
+    def refresh(self):
+        self.w = self.rng.normal(size=(self.ndim, self.ndim))
+        self.a = self.rng.uniform(low=0.01, high=0.99, size=(1, self.ndim))
+        self.y = np.dot(self.a, self.w)
+        if self.record:
+            self.history = {'x':[], 'y':[]}
+
+    def _func(self, x):
+        product = np.squeeze(np.dot(x, self.w))
+        norm = np.sum((product - self.y) ** 2)
+        return norm
+
+    def __call__(self, x):
+        if self.ifprint:
+            print('Input:')
+            print(x)
+        res = (self._func(x) / self.normalizer + self.e).item()
+        if self.ptype == 'concave':
+            res = 1 - res
+        if self.ifprint:
+            print('Output:')
+            print(res)
+        if self.record:
+            self.history['x'].append(x)
+            self.history['y'].append(res)
+        return res 
+
+class ConstraintQuadraticEval:
+    def __init__(self, num_dim=3, random=0.5, ptype='convex',
+                 dtype=np.float32, ifprint=True, rng=None):
+        self.ndim = num_dim
+        self.dtype = dtype
+        self.rng = np.random if rng is None else rng
+        if random is not None:
+            self.e = self.rng.normal(scale=random)
+        else:
+            self.e = 0.0
+        self.refresh()
+        self.normalizer = np.maximum(
+            self._func(np.zeros([1, self.ndim], dtype=self.dtype)),
+            self._func(np.ones([1, self.ndim], dtype=self.dtype)))
+        self.ptype = ptype
+        self.ifprint = ifprint
+
+    def refresh(self):
+        self.w = self.rng.normal(size=(self.ndim, self.ndim))
+        self.a = np.maximum(np.minimum(self.rng.normal(size=[self.ndim]), 0.8), 0.2)
+        self.y = np.dot(self.a, self.w)
+
+    def _func(self, x):
+        product = np.squeeze(np.dot(x, self.w))
+        norm = np.sum((product - self.y) ** 2)
+        return norm
+
+    def _barrier(self, x):
+        return - np.sum(np.log(x) + np.log(1-x), 1) / 1e10
+
+    def __call__(self, x):
+        if self.ifprint:
+            print('Input:')
+            print(x)
+        res = (self._func(x) / self.normalizer + self.e + self._barrier(x)).item()
+        if self.ptype == 'concave':
+            res = 1 - res
+        if self.ifprint:
+            print('Output:')
+            print(res)
+        return res
+
+class RealReaction:
+    def __init__(self, num_dim, param_range, param_names=['x1', 'x2', 'x3'],
+                 direction='max', logger=None, bounds=None):
+        self.ndim = num_dim
+        self.param_range = param_range
+        self.param_names = param_names
+        self.direction = direction
+        self.bounds = bounds if bounds is not None else Bounds(param_range)
+
+    def x_convert(self, x):
+        return self.bounds.to_real(x)
+
+    def y_convert(self, y):
+        if self.direction == 'max':
+            return 1 - y
+        return y
+
+    def __call__(self, x):
+        # Several reactors: ask for the conditions of each row in turn
+        if np.ndim(x) == 2 and np.shape(x)[0] > 1:
+            return np.array([self(row) for row in x])
+
+        print('Set Reaction Condition:')
+        real_x = self.x_convert(np.squeeze(x))
+        for i in range(self.ndim):
+            print('{0}: {1:.3f}'.format(self.param_names[i], real_x[i]))
+        result = float(input('Input the reaction yield:'))
+        return self.y_convert(result)
+
+class RealReactionZMQ:
+    def __init__(self, num_dim, param_range, param_names=['x1', 'x2', 'x3'],
+                 direction='max', logger=None, socket=None, transport=None,
+                 bounds=None):
+        self.ndim = num_dim
+        self.param_range = param_range
+        self.param_names = param_names
+        self.direction = direction
+        self.logger = logger
+        self.bounds = bounds if bounds is not None else Bounds(param_range)
+
+        # A bare socket is wrapped so replies are still polled for, but it
+        # cannot be reconnected without knowing its endpoint
+        if transport is None and socket is not None:
+            transport = ZMQTransport(socket=socket, logger=logger)
+        self.transport = transport
+        self.batch = False
+        self.seq = 0
+
+    def x_convert(self, x):
+        return self.bounds.to_real(x)
+
+    def y_convert(self, y):
+        if self.direction == 'max':
+            return 1 - y
+        return y
+
+    def submit(self, x):
+        """Send the normalized conditions x to the plugin without waiting.
+
+        The message is encoded by the transport's codec (see protocol.py);
+        a [N, ndim] block with N > 1 (one row per reactor) goes out as a
+        single message.
+        """
+
+        self.batch = np.ndim(x) == 2 and np.shape(x)[0] > 1
+
+        print('Set Reaction Condition:')
+        real_x = np.reshape(self.x_convert(x if self.batch else np.squeeze(x)),
+                            (-1, self.ndim))
+
+        # Print ranges to the terminal
+        for row in real_x:
+            for i in range(self.ndim):
+                print('{0}: {1:.3f}'.format(self.param_names[i], row[i]))
+
+        self.seq += 1
+        self.transport.submit(
+            self.transport.codec.encode_conditions(self.param_names, real_x,
+                                                   self.seq),
+            self.seq)
+
+    def result(self, timeout=None):
+        """Collect the reply to the last submitted conditions.
+
+        For a block of conditions the reply holds the yield of each row, in
+        the same order.
+
+        Args:
+            timeout: Milliseconds to wait, None waits until the reply arrives
+
+        Returns:
+            The converted yield (an array with one entry per row for a
+            block), -1 if the plugin asked to exit, or None if the reply
+            has not arrived within timeout
+        """
+
+        reply = self.transport.poll(timeout)
+        if reply is None:
+            return None
+
+        # Exit if the exit command was sent
+        if (reply.kind == EXIT):
+            print("***** Exit Received in RealReaction(), returning -1 *****") # DEBUG
+            return -1
+
+        if (reply.kind != YIELDS):
+            raise ProtocolError("Expected yields, received message type {}".format(
+                reply.kind))
+
+        result = np.ravel(reply.values)
+        print("Received {}!".format(result))
+        if self.batch:
+            return self.y_convert(result)
+        return self.y_convert(float(result[0]))
+
+    def __call__(self, x):
+        """Run the reaction(s) at the normalized conditions x.
+
+        Returns:
+            The converted yield (an array with one entry per row for a
+            block), or -1 if the plugin asked to exit
+        """
+
+        # No socket binding - ask for each row in the terminal
+        if self.transport is None:
+            if np.ndim(x) == 2 and np.shape(x)[0] > 1:
+                return np.array([self(row) for row in x])
+
+            print('Set Reaction Condition:')
+            real_x = self.x_convert(np.squeeze(x))
+            for i in range(self.ndim):
+                print('{0}: {1:.3f}'.format(self.param_names[i], real_x[i]))
+            result = input('Input the reaction yield:')
+            return self.y_convert(float(result))
+
+        # Socket binding - send params and wait for result
+        self.submit(x)
+        print("Waiting to receive reply...")
+        return self.result()
+
+# This is setting up a Reply-Request model client
+# so it will start by sending a request and waiting
+# for a reply
+def init_transport(config, logger=None):
+    """Connect to the plugin with the transport settings of a config."""
+    binding = config.ip_address() + ":" + str(config.port())
+    print("Connecting to {} ...".format(binding))
+
+    transport = ZMQTransport(endpoint=binding,
+                             recv_timeout=config.recv_timeout(),
+                             max_retries=config.max_retries(),
+                             heartbeat_address=config.heartbeat_address(),
+                             heartbeat_timeout=config.heartbeat_timeout(),
+                             codec=get_codec(config.wire_format()),
+                             logger=logger)
+
+    print("Connection complete!")
+
+    return transport
+
+def is_exit(y):
+    """Check if an objective value is the exit signal from the plugin."""
+    return np.ndim(y) == 0 and y == -1
+
+def create_objective(config, logger=None):
+    """Create the real-reaction objective described by a config.
+
+    Args:
+        config: Parsed Config
+        logger: Logger for transport warnings
+
+    Returns:
+        RealReactionZMQ if zmq is enabled in the config, else RealReaction
+    """
+
+    # Use the ZMQ method if indicated in the config file
+    if (config.zmq()):
+        return RealReactionZMQ(num_dim=config.num_params(),
+                               param_range=config.param_ranges(),
+                               param_names=config.param_names(),
+                               direction=config.opt_direction(),
+                               logger=logger,
+                               transport=init_transport(config, logger),
+                               bounds=config_bounds(config))
+
+    return RealReaction(num_dim=config.num_params(),
+                        param_range=config.param_ranges(),
+                        param_names=config.param_names(),
+                        direction=config.opt_direction(),
+                        logger=None, bounds=config_bounds(config))
+
+def normalized_param_init(config):
+    """Scale the initial parameter values of a config to the unit cube.
+
+    Returns:
+        list of normalized initial values, empty if no initial guess is given
+    """
+
+    x0 = config.param_init()
+    if (len(x0) != 0):
+        x0 = config_bounds(config).to_unit(x0).tolist()
+    return x0
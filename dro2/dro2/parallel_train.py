@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Data-parallel training on the CPU cores of one machine.
+
+Every worker process builds the full model, generates its own batch of
+synthetic reactions and computes the gradients of the loss. The gradients
+are averaged over all workers (an allreduce through the chief, worker 0)
+and every worker applies the same averaged gradient, so the copies of the
+policy stay identical while each update sees num_workers batches.
+
+    python parallel_train.py ../config/default-config.json --workers 4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import numpy as np
+
+from Config import add_override_argument, load_config
+from logger import get_handlers
+
+class PipeAllReduce:
+    """Average values across workers connected by pipes to the chief.
+
+    The chief (rank 0) holds one pipe to every other worker, the other
+    workers hold their pipe to the chief.
+    """
+    def __init__(self, rank, conns):
+        self.rank = rank
+        self.conns = conns
+
+    def __call__(self, loss, grads):
+        """Average the loss and the gradients of all workers.
+
+        Returns:
+            mean loss (own loss on workers other than the chief), mean grads
+        """
+
+        if self.rank != 0:
+            self.conns[0].send((loss, grads))
+            return loss, self.conns[0].recv()
+
+        losses = [loss]
+        total = [np.array(grad, dtype=np.float64) for grad in grads]
+        for conn in self.conns:
+            other_loss, other_grads = conn.recv()
+            losses.append(other_loss)
+            for t, grad in zip(total, other_grads):
+                t += grad
+        mean = [(t / len(losses)).astype(grad.dtype)
+                for t, grad in zip(total, grads)]
+        for conn in self.conns:
+            conn.send(mean)
+        return float(np.mean(losses)), mean
+
+    def broadcast(self, values=None):
+        """Send the chief's values to every worker and return them."""
+        if self.rank != 0:
+            return self.conns[0].recv()
+        for conn in self.conns:
+            conn.send(values)
+        return values
+
+def make_parallel_epoch_runner(sess, model, num_unrolls, allreduce):
+    """Like util.make_epoch_runner, with gradients averaged across workers."""
+
+    if num_unrolls < 1:
+        raise ValueError("num_steps must be at least unroll_length")
+    compute = sess.make_callable(
+        [model.loss, model.learning_rate, model.grad_norm] + model.grads)
+    apply = sess.make_callable(model.apply_grads,
+                               feed_list=model.grad_placeholders)
+    reset = sess.make_callable(model.reset)
+
+    def run():
+        reset()
+        for _ in range(num_unrolls):
+            results = compute()
+            cost, grads = allreduce(results[0], results[3:])
+            apply(*grads)
+        return cost, {'learning_rate': results[1], 'grad_norm': results[2]}
+    return run
+
+def default_threads(num_workers):
+    """Split the cores evenly so the workers do not oversubscribe them."""
+    return max(1, multiprocessing.cpu_count() // num_workers)
+
+def worker(rank, num_workers, config_file, overrides, conns, seed):
+    os.environ['TF_CPP_MIN_LOG_LEVEL']='3'
+    import tensorflow as tf
+    import util
+    import lets_start
+    from checkpoint import next_epoch
+
+    level = logging.INFO if rank == 0 else logging.WARNING
+    logging.basicConfig(level=level, handlers=get_handlers(log_file=rank == 0))
+    logger = logging.getLogger()
+
+    config = load_config(config_file, overrides)
+    allreduce = PipeAllReduce(rank, conns)
+
+    # Different seeds give every worker its own reactions
+    logger.info('Base seed {}'.format(seed))
+    tf.set_random_seed(seed + rank)
+
+    session_config = util.session_config(config)
+    if config.intra_op_threads() == 0:
+        session_config.intra_op_parallelism_threads = default_threads(num_workers)
+    if config.inter_op_threads() == 0:
+        session_config.inter_op_parallelism_threads = default_threads(num_workers)
+
+    num_unrolls = config.num_steps() // config.unroll_length()
+    with tf.Session(config=session_config) as sess:
+        model = util.create_model(sess, config, logger, chief=rank == 0)
+        model.build_apply_gradients()
+        run_epoch = make_parallel_epoch_runner(sess, model, num_unrolls,
+                                               allreduce)
+
+        # Start every worker from the chief's (possibly restored) variables
+        reset_names = set(var.name for var in model.reset_variables)
+        shared = [var for var in tf.global_variables()
+                  if var.name not in reset_names]
+        # and the same epoch numbers, which pick the curriculum stage
+        values, first_epoch = allreduce.broadcast(
+            (sess.run(shared), next_epoch(config.save_path()))
+            if rank == 0 else None)
+        if rank != 0:
+            for var, value in zip(shared, values):
+                var.load(value, sess)
+
+        # Only the chief evaluates, after the broadcast so the workers share
+        # the same list of variables
+        evaluator = None
+        if rank == 0:
+            evaluator = lets_start.make_evaluator(config, model)
+
+        # Nothing may add ops to the graph from here on
+        tf.get_default_graph().finalize()
+
+        if rank == 0:
+            lets_start.train(sess, model, config, logger, run_epoch, evaluator,
+                             first_epoch=first_epoch)
+        else:
+            for e in range(first_epoch, first_epoch + config.num_epochs()):
+                util.apply_curriculum(sess, model, config, e,
+                                      resume=e == first_epoch)
+                run_epoch()
+
+def parse_args():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("config_file")
+    add_override_argument(parser)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (defaults to "
+                        "num_workers of the config file)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Base seed of the problem streams, worker i "
+                        "uses seed + i (random and logged by default)")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = parse_args()
+
+    config = load_config(args.config_file, args.overrides)
+    num_workers = args.workers or config.num_workers()
+    seed = args.seed
+    if seed is None:
+        seed = int(np.random.randint(2**31 - num_workers))
+
+    # TensorFlow is not fork-safe, every worker starts a fresh interpreter
+    ctx = multiprocessing.get_context('spawn')
+    pipes = [ctx.Pipe() for _ in range(num_workers - 1)]
+    conns = [[chief_end for chief_end, _ in pipes]]
+    conns += [[worker_end] for _, worker_end in pipes]
+
+    processes = [ctx.Process(target=worker,
+                             args=(rank, num_workers, args.config_file,
+                                   args.overrides,
+                                   conns[rank], seed))
+                 for rank in range(num_workers)]
+    for p in processes:
+        p.start()
+
+    # A worker that dies would block the others forever in the allreduce
+    try:
+        while any(p.is_alive() for p in processes):
+            for p in processes:
+                p.join(timeout=1)
+                if p.exitcode not in (None, 0):
+                    raise RuntimeError("Worker {} exited with code {}".format(
+                        processes.index(p), p.exitcode))
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,44 @@
-import numpy as np
+import argparse
 import matplotlib.pyplot as plt
 
-def main():
+from metrics import read_metrics
 
-    # First row is epochs, second is mean error
-    data = [[],[]]
+def parse_args():
+    """Parse command line arguments"""
 
-    # Read all lines of the file
-    with open("OUTPUT.txt", 'r') as fin:
-        lines = fin.readlines()
+    parser = argparse.ArgumentParser()
 
-    # Process each line
-    for line in lines:
+    parser.add_argument("metrics_file", nargs='?',
+                        default="../output/log/default/metrics.jsonl",
+                        help="metrics.jsonl written to log_path by lets_start.py")
 
-        # Extract epoch and mean error
-        # Otherwise, ignore the line
-        if ("Epoch" in line):
-            parts = line.strip().split(' ')
+    args = parser.parse_args()
 
-            epoch = int(parts[4].strip(','))
-            mean_error = float(parts[7])
+    return args
 
-            data[0].append(epoch)
-            data[1].append(mean_error)
+def main():
 
-    print(data) # DEBUG: check that the file was parsed correctly
+    args = parse_args()
+    data = read_metrics(args.metrics_file)
+    epochs = data['epoch']
 
     # Determine some limits on the y axis, ignoring outliers in a naive way
-    ymax = max(data[1])
-    if (ymax > 10):
-        ymax = 10
-        
-    ymin = min(data[1])
-    if (ymin < -10):
-        ymin = 10
-    
+    ymax = min(max(data['loss']), 10)
+    ymin = max(min(data['loss']), -10)
+
     # Plot the data
-    plt.plot(data[0], data[1])
-    plt.title("Training Process")
-    plt.xlabel("Epoch")
-    plt.ylabel("Mean Error")
-    plt.ylim(ymin, ymax)
+    fig, axes = plt.subplots(3, 1, sharex=True)
+    axes[0].plot(epochs, data['loss'])
+    axes[0].set_title("Training Process")
+    axes[0].set_ylabel("Mean Error")
+    axes[0].set_ylim(ymin, ymax)
+
+    axes[1].plot(epochs, data['learning_rate'])
+    axes[1].set_ylabel("Learning Rate")
+
+    axes[2].plot(epochs, data['epochs_per_sec'])
+    axes[2].set_ylabel("Epochs / s")
+    axes[2].set_xlabel("Epoch")
     plt.show()
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+import json
+import struct
+import numpy as np
+
+# Message types
+CONDITIONS = 1  # optimizer -> plugin: one row of real conditions per reactor
+YIELDS = 2      # plugin -> optimizer: one yield per row of CONDITIONS
+EXIT = 3        # plugin -> optimizer: stop optimizing
+HEARTBEAT = 4   # plugin -> optimizer: are you alive? ("Marco")
+HEARTBEAT_ACK = 5  # optimizer -> plugin: answer to HEARTBEAT ("Polo")
+
+class ProtocolError(Exception):
+    pass
+
+class Message:
+    """Decoded message of either codec.
+
+    Attributes:
+        kind: One of the message types above
+        seq: Sequence id (always 0 for JSON messages, which carry none)
+        values: [rows, cols] float64 array for CONDITIONS and YIELDS
+        names: Parameter names sent with CONDITIONS
+    """
+    def __init__(self, kind, seq=0, values=None, names=None):
+        self.kind = kind
+        self.seq = seq
+        self.values = values
+        self.names = names
+
+class JSONCodec:
+    """The original text protocol understood by the LabVIEW plugin.
+
+    Conditions are sent as [param_names, values] (or
+    [param_names, [values_0, ...]] for several reactors), yields come back
+    as a bare float (or a JSON list), and "Exit", "Marco" and "Polo" are
+    plain strings.
+    """
+    name = 'json'
+    has_seq = False
+
+    def encode_conditions(self, names, values, seq=0):
+        values = np.asarray(values, dtype=float)
+        if values.shape[0] == 1:
+            values = values[0]
+        return [json.dumps([list(names), values.tolist()]).encode('utf-8')]
+
+    def encode_yields(self, values, seq=0):
+        values = np.ravel(np.asarray(values, dtype=float))
+        if values.size == 1:
+            return [repr(float(values[0])).encode('utf-8')]
+        return [json.dumps(values.tolist()).encode('utf-8')]
+
+    def encode_exit(self, seq=0):
+        return [b"Exit"]
+
+    def encode_heartbeat(self, seq=0):
+        return [b"Marco"]
+
+    def encode_heartbeat_ack(self, seq=0):
+        return [json.dumps("Polo").encode('utf-8')]
+
+    def decode(self, frames):
+        text = frames[0].decode('utf-8').strip()
+        if text in ("Exit", '"Exit"'):
+            return Message(EXIT)
+        if text in ("Marco", '"Marco"'):
+            return Message(HEARTBEAT)
+        if text in ("Polo", '"Polo"'):
+            return Message(HEARTBEAT_ACK)
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            raise ProtocolError("Cannot decode {!r}".format(frames[0]))
+
+        # [param_names, values] or [param_names, [values_0, ...]]
+        if (isinstance(data, list) and len(data) == 2
+                and isinstance(data[0], list)
+                and all(isinstance(name, str) for name in data[0])):
+            values = np.array(data[1], dtype=float)
+            return Message(CONDITIONS, values=values.reshape(-1, len(data[0])),
+                           names=data[0])
+
+        # A bare yield or a list of yields
+        return Message(YIELDS, values=np.array(data, dtype=float).reshape(-1, 1))
+
+class BinaryCodec:
+    """Compact framed protocol for peers that support it.
+
+    Every message starts with a fixed header frame
+    (magic, schema version, message type, sequence id, rows, cols), followed
+    for CONDITIONS and YIELDS by a frame with rows x cols little-endian
+    float64 values. CONDITIONS carry a third frame with the JSON parameter
+    names. Replies repeat the sequence id of their request, so they can be
+    matched to it when several proposals are in flight.
+    """
+    name = 'binary'
+    has_seq = True
+    MAGIC = b'DRO2'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBBIII')
+
+    def __init__(self):
+        self._names = None
+        self._names_frame = None
+
+    def _header(self, kind, seq, rows=0, cols=0):
+        return self.HEADER.pack(self.MAGIC, self.VERSION, kind, seq, rows, cols)
+
+    def _values(self, kind, values, seq):
+        values = np.ascontiguousarray(np.atleast_2d(values), dtype='<f8')
+        return [self._header(kind, seq, *values.shape), values.tobytes()]
+
+    def encode_conditions(self, names, values, seq=0):
+        # Parameter names never change during a run, so encode them once
+        if names != self._names:
+            self._names = list(names)
+            self._names_frame = json.dumps(self._names).encode('utf-8')
+        return self._values(CONDITIONS, values, seq) + [self._names_frame]
+
+    def encode_yields(self, values, seq=0):
+        return self._values(YIELDS, np.reshape(values, (-1, 1)), seq)
+
+    def encode_exit(self, seq=0):
+        return [self._header(EXIT, seq)]
+
+    def encode_heartbeat(self, seq=0):
+        return [self._header(HEARTBEAT, seq)]
+
+    def encode_heartbeat_ack(self, seq=0):
+        return [self._header(HEARTBEAT_ACK, seq)]
+
+    def decode(self, frames):
+        if len(frames[0]) != self.HEADER.size:
+            raise ProtocolError("Bad header length {}".format(len(frames[0])))
+        magic, version, kind, seq, rows, cols = self.HEADER.unpack(frames[0])
+        if magic != self.MAGIC:
+            raise ProtocolError("Bad magic {!r}".format(magic))
+        if version != self.VERSION:
+            raise ProtocolError("Unsupported schema version {}".format(version))
+
+        if kind not in (CONDITIONS, YIELDS):
+            return Message(kind, seq=seq)
+
+        values = np.frombuffer(frames[1], dtype='<f8')
+        if values.size != rows * cols:
+            raise ProtocolError("Expected {}x{} values, got {}".format(
+                rows, cols, values.size))
+        names = None
+        if kind == CONDITIONS and len(frames) > 2:
+            names = json.loads(frames[2].decode('utf-8'))
+        return Message(kind, seq=seq, values=values.reshape(rows, cols),
+                       names=names)
+
+CODECS = {JSONCodec.name: JSONCodec, BinaryCodec.name: BinaryCodec}
+
+def get_codec(name):
+    """Create the codec for a wire_format name ('json' or 'binary')."""
+    if name not in CODECS:
+        raise ValueError("Unknown wire format {}, expected one of {}".format(
+            name, sorted(CODECS)))
+    return CODECS[name]()
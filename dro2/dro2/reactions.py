@@ -1,11 +1,29 @@
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL']='3'
 import tensorflow as tf
-import tensorflow_probability as tfp
 import numpy as np
 import json
 import sys
 
+# The NumPy evaluation and real-reaction objectives do not depend on
+# TensorFlow and live in objectives.py; they are re-exported here for
+# existing imports.
+from objectives import (QuadraticEval, ConstraintQuadraticEval, RealReaction,
+                        RealReactionZMQ)
+
+def masked_quadratic(problem, x, mask):
+    """Hold the inactive parameters of a quadratic problem at the optimum.
+
+    Returns:
+        x with the inactive entries replaced by problem.a, and the
+        normalizer of the problem restricted to the active parameters
+    """
+
+    fill = problem.a * (1 - mask)
+    normalizer = tf.maximum(problem._func(fill),
+                            problem._func(mask + fill))
+    return x * mask + fill, normalizer
+
 class ConstraintQuadratic:
     """Quadratic problem: f(x) = ||Wx - y||."""
     def __init__(self, batch_size=128, num_dims=3, ptype='convex',
@@ -42,12 +60,18 @@ class ConstraintQuadratic:
     def _barrier(self, var):
         return -tf.reduce_sum(tf.log(var) + tf.log(1 - var), 1) / 1e10
 
-    def __call__(self, x):
+    def __call__(self, x, mask=None):
         '''
         x = tf.get_variable('x', shape=[batch_size, num_dims],
             dtype=dtype, initializer=tf.random_normal_initializer(stddev=stdev))
+
+        mask: optional [batch_size, num_dims] 0/1 mask of the active
+        parameters, the others are held at their optimum
         '''
-        res = (self._func(x) / self.normalizer + self.e + self._barrier(x))
+        normalizer = self.normalizer
+        if mask is not None:
+            x, normalizer = masked_quadratic(self, x, mask)
+        res = (self._func(x) / normalizer + self.e + self._barrier(x))
         if self.ptype == 'concave':
             res = 1 - res
         return res
@@ -89,19 +113,56 @@ class GMM:
                                for cov in self.cov], axis=1) * tf.transpose(self.coef)
             self.tops = tf.reduce_max(modes, axis=1, keep_dims=True)
             self.bots = tf.reduce_min(modes, axis=1, keep_dims=True)
+
+            # All components as [batch_size, ncoef, num_dims] blocks, so one
+            # broadcasted kernel evaluates them together. The per-variable
+            # layout above is kept for existing checkpoints.
+            self.m_all = tf.stack(self.m, axis=1)
+            self.scale_all = tf.stack(self.cov, axis=1)
+            self.log_norm = - (tf.reduce_sum(tf.log(tf.abs(self.scale_all)), axis=2)
+                               + 0.5 * num_dims * np.log(2 * np.pi))
             
     def get_parameters(self):
         return self.m + self.cov + [self.coef]
 
-    def __call__(self, x):
-        dist = [tfp.distributions.MultivariateNormalDiag(
-                    self.m[i], self.cov[i], name='MultVarNorm_{}'.format(i))
-                for i in range(self.ncoef)]
-        p = tf.concat([tf.reshape(dist[i].prob(x), [-1, 1])
-                       for i in range(self.ncoef)], axis=1)
+    def log_prob(self, x, mask=None):
+        """Log-density of x under every component.
+
+        Same as MultivariateNormalDiag(m[i], cov[i]).log_prob(x) for each i,
+        i.e. cov holds the standard deviations.
+
+        Args:
+            x: [batch_size, num_dims] points
+            mask: optional [batch_size, num_dims] 0/1 mask, the density is
+                  then the marginal over the active dimensions
+
+        Returns:
+            [batch_size, ncoef] log-densities
+        """
+
+        z = (tf.expand_dims(x, 1) - self.m_all) / self.scale_all
+        if mask is None:
+            return self.log_norm - 0.5 * tf.reduce_sum(tf.square(z), axis=2)
+
+        mask = tf.expand_dims(mask, 1)
+        log_norm = - (tf.reduce_sum(tf.log(tf.abs(self.scale_all)) * mask, axis=2)
+                      + 0.5 * tf.reduce_sum(mask, axis=2) * np.log(2 * np.pi))
+        return log_norm - 0.5 * tf.reduce_sum(tf.square(z) * mask, axis=2)
+
+    def __call__(self, x, mask=None):
+        p = tf.exp(self.log_prob(x, mask))
 
         fx = tf.matmul(p, self.coef)
-        result = (fx / self.cst - self.bots) / (self.tops - self.bots)
+        cst, tops, bots = self.cst, self.tops, self.bots
+        if mask is not None:
+            # Normalize over the active dimensions only
+            active = tf.reduce_sum(mask, axis=1, keep_dims=True)
+            cst = (2 * 3.14159) ** (- active / 2)
+            scale = self.scale_all * tf.expand_dims(mask, 1) + (1 - tf.expand_dims(mask, 1))
+            modes = tf.transpose(self.coef) / tf.reduce_prod(scale, axis=2)
+            tops = tf.reduce_max(modes, axis=1, keep_dims=True)
+            bots = tf.reduce_min(modes, axis=1, keep_dims=True)
+        result = (fx / cst - bots) / (tops - bots)
         # import pdb; pdb.set_trace()
         if self.random:
             result = result + tf.random_normal(shape=[self.batch_size, 1], 
@@ -145,191 +206,157 @@ class Quadratic:
         norm = tf.reduce_sum((product - self.y) ** 2, 1)
         return norm
 
-    def __call__(self, x):
+    def __call__(self, x, mask=None):
         '''
         x = tf.get_variable('x', shape=[batch_size, num_dims],
             dtype=dtype, initializer=tf.random_normal_initializer(stddev=stdev))
+
+        mask: optional [batch_size, num_dims] 0/1 mask of the active
+        parameters, the others are held at their optimum
         '''
-        res = (self._func(x) / self.normalizer + self.e)
+        normalizer = self.normalizer
+        if mask is not None:
+            x, normalizer = masked_quadratic(self, x, mask)
+        res = (self._func(x) / normalizer + self.e)
         if self.ptype == 'concave':
             res = 1 - res
 
         return res
 
+class MixedReactions:
+    """Batch mixing the Quadratic, ConstraintQuadratic and GMM families.
+
+    Every row of the batch draws its family, the subset of its num_dims
+    parameters that matter (the others have no effect on the yield) and the
+    standard deviation of its instrument error. All of them are variables
+    with random initializers, so the reset of the model draws new problems
+    in the same op as the reactions themselves. The distributions are set
+    by the control variables, set_stage() changes them for a curriculum.
+    """
+    FAMILIES = ('quad', 'constraint_quad', 'gmm')
+
+    def __init__(self, batch_size=128, num_dims=3, ptype='convex', cov=0.1,
+                 stage=None, random=True, dtype=tf.float32):
+        """
+        Args:
+            stage: Curriculum stage, a dict with the family weights
+                   ('families'), the minimum number of active parameters
+                   ('min_params') and the range of the instrument error
+                   ('instrument_error'), see Config.curriculum
+            random: Add the instrument error of the stage
+        """
 
-class QuadraticEval:
-    def __init__(self, num_dim=3, random=0.5, ptype='convex',
-                 dtype=np.float32, ifprint=False, record=False):
-        self.ndim = num_dim
-        self.dtype = dtype
-        if random is not None:
-            self.e = np.random.normal(scale=random)
-        else:
-            self.e = 0.0
-        self.record = record
-        self.refresh()
-        self.normalizer = np.maximum(
-            self._func(np.zeros([1, self.ndim], dtype=self.dtype)),
-            self._func(np.ones([1, self.ndim], dtype=self.dtype)))
-        self.ptype = ptype
-        self.ifprint = ifprint
-
-    def refresh(self):
-        self.w = np.random.normal(size=(self.ndim, self.ndim))
-        self.a = np.random.uniform(low=0.01, high=0.99, size=(1, self.ndim))
-        self.y = np.dot(self.a, self.w)
-        if self.record:
-            self.history = {'x':[], 'y':[]}
-
-    def _func(self, x):
-        product = np.squeeze(np.dot(x, self.w))
-        norm = np.sum((product - self.y) ** 2)
-        return norm
-
-    def __call__(self, x):
-        if self.ifprint:
-            print('Input:')
-            print(x)
-        res = (self._func(x) / self.normalizer + self.e).item()
-        if self.ptype == 'concave':
-            res = 1 - res
-        if self.ifprint:
-            print('Output:')
-            print(res)
-        if self.record:
-            self.history['x'].append(x)
-            self.history['y'].append(res)
-        return res 
-
-class ConstraintQuadraticEval:
-    def __init__(self, num_dim=3, random=0.5, ptype='convex',
-                 dtype=np.float32):
-        self.ndim = num_dim
-        self.dtype = dtype
-        if random is not None:
-            self.e = np.random.normal(scale=random)
-        else:
-            self.e = 0.0
-        self.refresh()
-        self.normalizer = np.maximum(
-            self._func(np.zeros([1, self.ndim], dtype=self.dtype)),
-            self._func(np.ones([1, self.ndim], dtype=self.dtype)))
-        self.ptype = ptype
-
-    def refresh(self):
-        self.w = np.random.normal(size=(self.ndim, self.ndim))
-        self.a = np.maximum(np.minimum(np.random.normal(size=[self.ndim]), 0.8), 0.2)
-        self.y = np.dot(self.a, self.w)
+        self.batch_size = batch_size
+        self.num_dims = num_dims
+        self.random = random
+        stage = stage_values(stage, num_dims)
+        with tf.variable_scope('mixed'):
+            with tf.variable_scope('quad'):
+                self.quad = Quadratic(batch_size, num_dims, ptype=ptype,
+                                      random=None, dtype=dtype)
+            with tf.variable_scope('constraint_quad'):
+                self.constraint_quad = ConstraintQuadratic(
+                    batch_size, num_dims, ptype=ptype, random=None,
+                    dtype=dtype)
+            self.gmm = GMM(batch_size, num_dims=num_dims, random=None,
+                           cov=cov, dtype=dtype)
+
+            # Curriculum controls, not part of the reset
+            self.family_probs = tf.get_variable(
+                'family_probs', initializer=tf.constant(stage['family_probs']),
+                trainable=False)
+            self.min_params = tf.get_variable(
+                'min_params', initializer=tf.constant(stage['min_params']),
+                trainable=False)
+            self.noise_range = tf.get_variable(
+                'noise_range', initializer=tf.constant(stage['noise_range']),
+                trainable=False)
 
-    def _func(self, x):
-        product = np.squeeze(np.dot(x, self.w))
-        norm = np.sum((product - self.y) ** 2)
-        return norm
+            # The controls are read through initialized_value, so resets
+            # draw from the current stage
+            logits = tf.log(tf.expand_dims(self.family_probs.initialized_value(), 0))
+            family = tf.reshape(tf.multinomial(logits, batch_size), [batch_size])
+            self.family = tf.get_variable(
+                'family', initializer=tf.cast(family, tf.int32),
+                trainable=False)
 
-    def _barrier(self, x):
-        return - np.sum(np.log(x) + np.log(1-x), 1) / 1e10
+            # Random subsets: the active parameters of a row are the
+            # nactive with the smallest scores
+            nactive = tf.random_uniform(
+                [batch_size], minval=self.min_params.initialized_value(),
+                maxval=num_dims + 1, dtype=tf.int32)
+            scores = tf.random_uniform([batch_size, num_dims], dtype=dtype)
+            ranked = -tf.nn.top_k(-scores, k=num_dims).values
+            threshold = tf.reduce_sum(
+                ranked * tf.one_hot(nactive - 1, num_dims, dtype=dtype),
+                axis=1, keep_dims=True)
+            self.mask = tf.get_variable(
+                'mask', initializer=tf.cast(scores <= threshold, dtype),
+                trainable=False)
 
-    def __call__(self, x):
-        print('Input:')
-        print(x)
-        res = (self._func(x) / self.normalizer + self.e + self._barrier(x)).item()
-        if self.ptype == 'concave':
-            res = 1 - resn
-        print('Output:')
-        print(res)
-        return res 
-
-class RealReaction:
-    def __init__(self, num_dim, param_range, param_names=['x1', 'x2', 'x3'],
-                 direction='max', logger=None):
-        self.ndim = num_dim
-        self.param_range = param_range
-        self.param_names = param_names
-        self.direction = direction
-
-    def x_convert(self, x):
-        real_x = np.zeros([self.ndim])
-        for i in range(self.ndim):
-            a, b = self.param_range[i]
-            real_x[i] = x[i] * (b - a) + a
-        return real_x
-
-    def y_convert(self, y):
-        if self.direction == 'max':
-            return 1 - y
-        return y
+            noise_range = self.noise_range.initialized_value()
+            self.noise = tf.get_variable(
+                'noise', initializer=tf.random_uniform(
+                    [batch_size], minval=noise_range[0],
+                    maxval=noise_range[1], dtype=dtype),
+                trainable=False)
 
-    def __call__(self, x):
-        print('Set Reaction Condition:')
-        real_x = self.x_convert(np.squeeze(x))
-        for i in range(self.ndim):
-            print('{0}: {1:.3f}'.format(self.param_names[i], real_x[i]))
-        result = float(input('Input the reaction yield:'))
-        return self.y_convert(result)
-
-class RealReactionZMQ:
-    def __init__(self, num_dim, param_range, param_names=['x1', 'x2', 'x3'],
-                 direction='max', logger=None, socket=None):
-        self.ndim = num_dim
-        self.param_range = param_range
-        self.param_names = param_names
-        self.direction = direction
-        self.socket = socket
-
-    def x_convert(self, x):
-        real_x = np.zeros([self.ndim])
-        for i in range(self.ndim):
-            a, b = self.param_range[i]
-            real_x[i] = x[i] * (b - a) + a
-        return real_x
-
-    def y_convert(self, y):
-        if self.direction == 'max':
-            return 1 - y
-        return y
+    def get_parameters(self):
+        return ([self.family, self.mask, self.noise]
+                + self.quad.get_parameters()
+                + self.constraint_quad.get_parameters()
+                + self.gmm.get_parameters())
+
+    def set_stage(self, sess, stage):
+        """Draw the problems of the following resets from stage."""
+        stage = stage_values(stage, self.num_dims)
+        # load() feeds the initializers, so it works on finalized graphs
+        self.family_probs.load(stage['family_probs'], sess)
+        self.min_params.load(stage['min_params'], sess)
+        self.noise_range.load(stage['noise_range'], sess)
 
     def __call__(self, x):
-        print('Set Reaction Condition:')
-        real_x = self.x_convert(np.squeeze(x))
-
-        # Print ranges to the terminal
-        for i in range(self.ndim):
-            print('{0}: {1:.3f}'.format(self.param_names[i], real_x[i]))
-        
-        # Socket binding - send params and wait for result
-        if (self.socket != None):
-            # Create list of param names and values
-            params = []
-            params.append((self.param_names))
-            params.append(real_x.tolist())
-            self.socket.send(json.dumps(params).encode('utf-8'))
-
-            print("Waiting to receive reply...")
-            reply = ""
-            
-            # Wait until a command is sent
-            while (reply == ""):
-                reply = self.socket.recv()
-                print("Received {}!".format(reply))
-            
-                # Exit if the exit command was sent
-                if (reply == b"Exit"):
-                    print("***** Exit Received in RealReaction(), returning -1 *****") # DEBUG
-                    return -1
-                
-                # Heartbeat response
-                elif (reply == "Marco"):
-                    self.socket.send(json.dumps("Polo").encode('utf-8'))
-                    reply = ""
-            
-                # Set the result to the reply
-                else:
-                    result = reply
-        
-        # No socket binding - print to terminal
-        else:
-            result = input('Input the reaction yield:')
-            
-        return self.y_convert(float(result))
+        values = [
+            self.quad(x, self.mask),
+            # The barrier of the constraint problems is undefined outside
+            # (0, 1), which would leak NaN gradients through tf.where
+            self.constraint_quad(tf.clip_by_value(x, 0.01, 0.99), self.mask),
+            tf.reshape(self.gmm(x, self.mask), [self.batch_size]),
+        ]
+        res = values[0]
+        for i in range(1, len(values)):
+            res = tf.where(tf.equal(self.family, i), values[i], res)
+        if self.random:
+            res = res + self.noise * tf.random_normal(
+                [self.batch_size], dtype=res.dtype, name='e')
+        return res
 
-    
+def stage_values(stage, num_dims):
+    """Control values of MixedReactions for a curriculum stage."""
+    stage = stage or {}
+    families = stage.get('families') or {
+        family: 1.0 for family in MixedReactions.FAMILIES}
+    unknown = set(families) - set(MixedReactions.FAMILIES)
+    if unknown:
+        raise ValueError("Unknown reaction families {}, expected some of "
+                         "{}".format(sorted(unknown), MixedReactions.FAMILIES))
+    probs = np.array([families.get(family, 0.0)
+                      for family in MixedReactions.FAMILIES], dtype=np.float32)
+    if probs.min() < 0 or probs.sum() <= 0:
+        raise ValueError("Family weights must be non-negative and not all "
+                         "zero, got {}".format(families))
+
+    min_params = stage.get('min_params')
+    min_params = num_dims if min_params is None else int(min_params)
+    if not 1 <= min_params <= num_dims:
+        raise ValueError("min_params must be between 1 and {}, got {}".format(
+            num_dims, min_params))
+
+    noise = stage.get('instrument_error')
+    if noise is None:
+        noise = [0.0, 0.0]
+    elif np.isscalar(noise):
+        noise = [noise, noise]
+    return {'family_probs': probs / probs.sum(),
+            'min_params': np.int32(min_params),
+            'noise_range': np.array(noise, dtype=np.float32)}
@@ -1,21 +1,42 @@
 #!/usr/bin/env python3
 
 import argparse
+import os
 import tensorflow as tf
 import numpy as np
 import logging
 import matplotlib.pyplot as plt
 import json
-import zmq # For message queues
 
-import rnn
-from reactions import QuadraticEval, ConstraintQuadraticEval, RealReaction, RealReactionZMQ
+import util
+from reactions import QuadraticEval, ConstraintQuadraticEval
+from objectives import create_objective, normalized_param_init
+from gp import create_selector
+from journal import open_journal, run_steps
+from weight_store import is_weight_store, restore_from_store
 from logger import get_handlers
 from collections import namedtuple
-from Config import Config
+from Config import add_override_argument, load_config
+from tensorflow.tools.graph_transforms import TransformGraph
+
+# Suffixes of the placeholders of the entries of a layer's state, the third
+# one is the time step of batch-norm layers
+STATE_SUFFIXES = ('c', 'h', 't')
 
 class StepOptimizer:
-    def __init__(self, cell, func, ndim, nsteps, ckpt_path, logger, constraints, x0=[]):
+    """Runs a trained policy against an objective, one step at a time.
+
+    With batch_size > 1 every row of x is an independent optimization
+    trajectory (e.g. one reactor of a parallel setup) with its own LSTM
+    state; all rows advance together in one sess.run and func is called
+    with the whole [batch_size, ndim] block.
+
+    With num_samples > 1 the policy draws num_samples candidates per row in
+    the same sess.run, and selector (a gp.CandidateSelector fitted to the
+    history of the run) chooses the proposals that are run.
+    """
+    def __init__(self, cell, func, ndim, nsteps, ckpt_path, logger, constraints,
+                 x0=[], batch_size=1, num_samples=1, selector=None):
         self.logger = logger
         self.cell = cell
         self.func = func
@@ -23,43 +44,126 @@ class StepOptimizer:
         self.nsteps = nsteps
         self.ckpt_path = ckpt_path
         self.constraints = constraints
+        self.batch_size = batch_size
+        self.num_samples = num_samples
+        self.selector = selector
+        self.candidates = None
         self.init_state = self.cell.get_initial_state(1, tf.float32)
         self.results = self.build_graph()
 
-        self.saver = tf.train.Saver(tf.global_variables())
+        # Only the policy exists in this graph, so these are exactly the
+        # variables of a weight store
+        self.variables = tf.global_variables()
+        self.saver = tf.train.Saver(self.variables)
         self.x0 = x0
 
     def get_state_shapes(self):
-        return [(s[0].get_shape().as_list(), s[1].get_shape().as_list())
+        # The time step of batch-norm layers is a scalar for all rows
+        return [tuple([self.batch_size] + t.get_shape().as_list()[1:]
+                      if t.get_shape().ndims else []
+                      for t in s)
                 for s in self.init_state]
 
     def step(self, sess, x, y, state):
         feed_dict = {'input_x:0':x, 'input_y:0':y}
         for i in range(len(self.init_state)):
-            feed_dict['state_l{0}_c:0'.format(i)] = state[i][0]
-            feed_dict['state_l{0}_h:0'.format(i)] = state[i][1]
-        new_x, new_state = sess.run(self.results, feed_dict=feed_dict)
-        return new_x, new_state
+            for j in range(len(self.init_state[i])):
+                feed_dict['state_l{0}_{1}:0'.format(i, STATE_SUFFIXES[j])] = state[i][j]
+        if self.selector is None:
+            new_x, new_state = sess.run(self.results, feed_dict=feed_dict)
+            return new_x, new_state
+
+        # Every reaction run so far, including those replayed from a
+        # journal, passes through here once
+        self.selector.update(x, y)
+        candidates, new_state = sess.run((self.candidates, self.results[1]),
+                                         feed_dict=feed_dict)
+        return self.selector.select(candidates), new_state
 
     def build_graph(self):
-        x = tf.placeholder(tf.float32, shape=[1, self.ndim], name='input_x')
-        y = tf.placeholder(tf.float32, shape=[1, 1], name='input_y')
+        # The batch dimension is left open so the same graph (and any frozen
+        # export of it) serves any number of parallel trajectories
+        x = tf.placeholder(tf.float32, shape=[None, self.ndim], name='input_x')
+        y = tf.placeholder(tf.float32, shape=[None, 1], name='input_y')
         state = []
         for i in range(len(self.init_state)):
-            state.append((tf.placeholder(
-                              tf.float32, shape=self.init_state[i][0].get_shape(),
-                              name='state_l{0}_c'.format(i)),
-                          tf.placeholder(
-                              tf.float32, shape=self.init_state[i][1].get_shape(),
-                              name='state_l{0}_h'.format(i))))
+            state.append(tuple(
+                tf.placeholder(
+                    t.dtype,
+                    shape=[None] + t.get_shape().as_list()[1:] if t.get_shape().ndims else [],
+                    name='state_l{0}_{1}'.format(i, STATE_SUFFIXES[j]))
+                for j, t in enumerate(self.init_state[i])))
 
         with tf.name_scope('opt_cell'):
-            new_x, new_state = self.cell(x, y, state)
-            if self.constraints:
-                new_x = tf.clip_by_value(new_x, 0.01, 0.99)
+            # Batch-norm layers use their frozen statistics
+            if self.num_samples > 1:
+                candidates, new_state = self.cell(x, y, state, is_training=False,
+                                                  num_samples=self.num_samples)
+                if self.constraints:
+                    candidates = tf.clip_by_value(candidates, 0.01, 0.99)
+                new_x = candidates[:, 0]
+            else:
+                new_x, new_state = self.cell(x, y, state, is_training=False)
+                if self.constraints:
+                    new_x = tf.clip_by_value(new_x, 0.01, 0.99)
+
+        # Name the outputs so the graph can be frozen and reloaded by name
+        new_x = tf.identity(new_x, name='output_x')
+        if self.num_samples > 1:
+            self.candidates = tf.identity(candidates, name='output_candidates')
+        new_state = [tuple(tf.identity(t, name='output_l{0}_{1}'.format(i, STATE_SUFFIXES[j]))
+                           for j, t in enumerate(new_state[i]))
+                     for i in range(len(self.init_state))]
         return new_x, new_state
 
+    def output_node_names(self):
+        """Names of the graph nodes needed to compute one optimizer step."""
+        names = ['output_x']
+        if self.candidates is not None:
+            names.append('output_candidates')
+        for i in range(len(self.init_state)):
+            for j in range(len(self.init_state[i])):
+                names.append('output_l{0}_{1}'.format(i, STATE_SUFFIXES[j]))
+        return names
+
+    def input_node_names(self):
+        """Names of the placeholders fed at every optimizer step."""
+        names = ['input_x', 'input_y']
+        for i in range(len(self.init_state)):
+            for j in range(len(self.init_state[i])):
+                names.append('state_l{0}_{1}'.format(i, STATE_SUFFIXES[j]))
+        return names
+
+    def freeze(self, sess):
+        """Convert the restored opt_cell subgraph into a frozen GraphDef.
+
+        Variables are replaced by constants, everything not needed to compute
+        a step (training ops, saver ops, ...) is stripped, and constant
+        subexpressions are folded.
+
+        Args:
+            sess: Session holding the restored checkpoint
+
+        Returns:
+            tf.GraphDef containing only the inference subgraph
+        """
+        output_names = self.output_node_names()
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            sess, sess.graph.as_graph_def(), output_names)
+        return TransformGraph(graph_def, self.input_node_names(), output_names,
+                              ['strip_unused_nodes',
+                               'remove_nodes(op=Identity, op=CheckNumerics)',
+                               'fold_constants(ignore_errors=true)',
+                               'sort_by_execution_order'])
+
     def load(self, sess, ckpt_path):
+        """Restore the policy from a checkpoint directory or a weight store."""
+        if is_weight_store(ckpt_path):
+            self.logger.info('Reading model parameters from weight store {}.'.format(
+                ckpt_path))
+            restore_from_store(sess, ckpt_path, self.variables)
+            return
+
         ckpt = tf.train.get_checkpoint_state(ckpt_path)
         if ckpt and ckpt.model_checkpoint_path:
             self.logger.info('Reading model parameters from {}.'.format(
@@ -68,59 +172,101 @@ class StepOptimizer:
         else:
             raise FileNotFoundError('No checkpoint available')
 
-    def get_init(self):
+    def initial_x(self):
         if (len(self.x0) == 0):
-            x = np.random.normal(loc=0.5, scale=0.2, size=(1, self.ndim))
+            x = np.random.normal(loc=0.5, scale=0.2,
+                                 size=(self.batch_size, self.ndim))
             x = np.maximum(np.minimum(x, 0.9), 0.1)
         else:
-            x = np.array(self.x0).reshape((1, self.ndim))
-        y = np.array(self.func(x)).reshape(1, 1)
-        init_state = [(np.zeros(s[0]), np.zeros(s[1]))
-                      for s in self.get_state_shapes()]
-        return x, y, init_state
+            # Every trajectory starts from the given initial guess
+            x = np.tile(np.array(self.x0).reshape((1, self.ndim)),
+                        (self.batch_size, 1))
+        return x
 
-    def run(self):
+    def initial_state(self):
+        return [tuple(np.zeros(shape, dtype=t.dtype.as_numpy_dtype)
+                      for shape, t in zip(shapes, s))
+                for shapes, s in zip(self.get_state_shapes(), self.init_state)]
+
+    def run(self, journal=None):
+        """Run nsteps optimization steps.
+
+        Args:
+            journal: journal.Journal recording the run, a journal holding
+                     steps already is resumed after them
+
+        Returns:
+            x_array: [nsteps + 1, batch_size, ndim] normalized conditions
+            y_array: [nsteps + 1, batch_size, 1] objective values
+        """
         with tf.Session() as sess:
             self.load(sess, self.ckpt_path)
-            x, y, state = self.get_init()
-            x_array = np.zeros((self.nsteps + 1, self.ndim))
-            y_array = np.zeros((self.nsteps + 1, 1))
-            
-            # If a stop command was received, stop optimizing
-            if (y == -1):
-                print("Exit Received, breaking out of optimization loop in StepOptimizer.run()") # DEBUG
-                return x_array, y_array
-            
-            x_array[0, :] = x
-            y_array[0] = y
-            for i in range(self.nsteps):
-                x, state = self.step(sess, x, y, state)
-                y = self.func(x)
-                
-                # If a stop command was received, stop optimizing
-                if (y == -1):
-                    print("Exit Received, breaking out of optimization loop in StepOptimizer.run()") # DEBUG
-                    break
-                
-                y = np.array(y).reshape(1, 1)
-                x_array[i+1, :] = x
-                y_array[i+1] = y
-
-        return x_array, y_array
-
-# This is setting up a Reply-Request model client
-# so it will start by sending a request and waiting
-# for a reply
-def init_socket(binding):
-    print("Binding socket at {} ...".format(binding))
-
-    context = zmq.Context()
-    socket = context.socket(zmq.REQ)
-    socket.connect(binding)
-    
-    print("Binding complete!")
+            return run_steps(
+                lambda x, y, state: self.step(sess, x, y, state),
+                self.initial_x(), self.initial_state(), self.func, self.nsteps,
+                journal=journal, logger=self.logger, name='StepOptimizer')
 
-    return socket
+class FrozenStepOptimizer(StepOptimizer):
+    """StepOptimizer running a graph exported by export_model.py.
+
+    Only the frozen opt_cell subgraph is loaded, so no checkpoint has to be
+    restored and no training variables are allocated.
+    """
+    def __init__(self, graph_path, func, ndim, nsteps, logger, x0=[],
+                 batch_size=1, selector=None):
+        self.logger = logger
+        self.func = func
+        self.ndim = ndim
+        self.nsteps = nsteps
+        self.ckpt_path = graph_path
+        self.x0 = x0
+        self.batch_size = batch_size
+        self.selector = selector
+        self.graph_def = load_frozen_graph(graph_path)
+        self.results = self.build_graph()
+        if self.selector is not None and self.candidates is None:
+            raise ValueError("The frozen graph {} draws one proposal per step, "
+                             "export it with num_candidates > 1 to select "
+                             "among candidates".format(graph_path))
+
+    def build_graph(self):
+        tf.import_graph_def(self.graph_def, name='')
+        graph = tf.get_default_graph()
+        nlayers = len([node for node in self.graph_def.node
+                       if node.op == 'Placeholder'
+                       and node.name.startswith('state_l')
+                       and node.name.endswith('_c')])
+
+        names = set(node.name for node in self.graph_def.node)
+        # Batch-norm layers also carry their time step
+        suffixes = [STATE_SUFFIXES[:3 if 'state_l{0}_t'.format(i) in names else 2]
+                    for i in range(nlayers)]
+        self.init_state = [
+            tuple(graph.get_tensor_by_name('state_l{0}_{1}:0'.format(i, suffix))
+                  for suffix in suffixes[i])
+            for i in range(nlayers)]
+        new_x = graph.get_tensor_by_name('output_x:0')
+        self.candidates = None
+        if 'output_candidates' in names:
+            self.candidates = graph.get_tensor_by_name('output_candidates:0')
+        new_state = [
+            tuple(graph.get_tensor_by_name('output_l{0}_{1}:0'.format(i, suffix))
+                  for suffix in suffixes[i])
+            for i in range(nlayers)]
+        return new_x, new_state
+
+    def load(self, sess, ckpt_path):
+        self.logger.info('Using frozen graph {}.'.format(ckpt_path))
+
+def load_frozen_graph(graph_path):
+    """Read a binary GraphDef written by export_model.py"""
+    if not os.path.exists(graph_path):
+        raise FileNotFoundError('No frozen graph at {}'.format(graph_path))
+
+    graph_def = tf.GraphDef()
+    with open(graph_path, 'rb') as fin:
+        graph_def.ParseFromString(fin.read())
+    return graph_def
 
 def parse_args():
     """Parse command line arguments"""
@@ -128,6 +274,19 @@ def parse_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("config_file")
+    add_override_argument(parser)
+    parser.add_argument("--frozen_graph", default=None,
+                        help="Frozen graph written by export_model.py to use "
+                        "instead of restoring the training checkpoint")
+    parser.add_argument("--weights", default=None,
+                        help="Weight store written by export_model.py "
+                        "--format mmap to use instead of the training checkpoint")
+
+    parser.add_argument("--journal", default=None,
+                        help="Journal file of the run (defaults to a new "
+                        "journal-<time>.jsonl inside log_path)")
+    parser.add_argument("--resume", default=None,
+                        help="Journal of an interrupted run to continue")
 
     args = parser.parse_args()
 
@@ -144,54 +303,40 @@ def main():
 
     
     # Open and parse the config file
-    config_file = open(args.config_file)
-    config = Config(config_file)
-    config_file.close()
+    config = load_config(args.config_file, args.overrides)
     logger.info(str(config.config))
     
-    param_names = config.param_names()
-    param_range = config.param_ranges()
-    logger.info(str(param_range))
+    logger.info(str(config.param_ranges()))
     
     # Scale initialized parameter values
-    x0 = config.param_init()
-    if (len(x0) != 0):
-        for i in range(config.num_params()):
-            a, b = config.param_ranges()[i]
-            x0[i] = (x0[i] - a) / (b - a)
-
-    # Use the ZMQ method if indicated in the config file
-    if (config.zmq()):
-        # Bind to local socket
-        binding = config.ip_address() + ":" + str(config.port())
-        socket = init_socket(binding)
-
-        func = RealReactionZMQ(num_dim=config.num_params(),
-                               param_range=param_range,
-                               param_names=param_names,
-                               direction=config.opt_direction(),
-                               logger=None,
-                               socket=socket)
-    else:
-        func = RealReaction(num_dim=config.num_params(),
-                               param_range=param_range,
-                               param_names=param_names,
-                               direction=config.opt_direction(),
-                               logger=None)
+    x0 = normalized_param_init(config)
 
+    func = create_objective(config, logger)
 
-    cell = rnn.StochasticRNNCell(cell=rnn.LSTM,
-                                 kwargs={'hidden_size':config.hidden_size()},
-                                 nlayers=config.num_layers(),
-                                 reuse=config.reuse())
-    
-    optimizer = StepOptimizer(cell=cell, func=func, ndim=config.num_params(),
-                              nsteps=config.num_steps(),
-                              ckpt_path=config.save_path(), logger=logger,
-                              constraints=config.constraints(),
-                              x0=x0)
+    if (args.frozen_graph is not None):
+        optimizer = FrozenStepOptimizer(graph_path=args.frozen_graph,
+                                        func=func, ndim=config.num_params(),
+                                        nsteps=config.num_steps(),
+                                        logger=logger, x0=x0,
+                                        batch_size=config.num_reactors(),
+                                        selector=create_selector(config))
+    else:
+        cell = util.create_cell(config)
+
+        ckpt_path = config.save_path() if args.weights is None else args.weights
+        optimizer = StepOptimizer(cell=cell, func=func, ndim=config.num_params(),
+                                  nsteps=config.num_steps(),
+                                  ckpt_path=ckpt_path, logger=logger,
+                                  constraints=config.constraints(),
+                                  x0=x0, batch_size=config.num_reactors(),
+                                  num_samples=config.num_candidates(),
+                                  selector=create_selector(config))
     
-    x_array, y_array = optimizer.run()
+    journal = open_journal(config, args.journal, args.resume)
+    try:
+        x_array, y_array = optimizer.run(journal)
+    finally:
+        journal.close()
     
     # plt.figure(1)
     # plt.plot(y_array)
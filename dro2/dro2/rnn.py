@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 import batch_norm
@@ -8,7 +9,9 @@ from tensorflow.contrib.rnn import RNNCell
 from tensorflow.python.ops import array_ops
 from tensorflow.contrib.rnn import LSTMCell, LSTMStateTuple
 from tensorflow.contrib.rnn import MultiRNNCell
+from tensorflow.contrib.rnn.ops import gen_lstm_ops
 from tensorflow.python.ops.math_ops import tanh
+from tensorflow.python.util import nest
 
 
 class MultiInputLSTM(LSTMCell):
@@ -47,29 +50,56 @@ class MultiInputLSTM(LSTMCell):
                 [super(MultiInputLSTM, self).zero_state(batch_size, dtype)] * self.nlayers)
 
 
+def build_layers(first, cell, kwargs, nlayers, reuse):
+    """LSTM layers of a policy cell, all of them are first with reuse."""
+    if nlayers == 1 or reuse:
+        return [first] * nlayers
+    return [cell(**kwargs, name='lstm_{}'.format(i)) for i in range(nlayers)]
+
+def stack_layers(layers, is_training=True):
+    """Stack the layers into one cell.
+
+    With is_training=False the batch-norm layers normalize with their
+    frozen moving statistics and do not update them.
+    """
+
+    if not is_training:
+        layers = [layer.with_batch_norm_control(is_training=False,
+                                                test_local_stats=False)
+                  for layer in layers]
+    if len(layers) == 1:
+        return layers[0]
+    return MultiRNNCell(layers)
+
+
 class MultiInputRNNCell(RNNCell):
     def __init__(self, cell, kwargs, nlayers=1, reuse=False):
         self.cell = cell(**kwargs, name="lstm")
         self.nlayers = nlayers
-        self.rnncell = self.cell
-        if nlayers > 1:
-            if reuse:
-                self.rnncell = MultiRNNCell([self.cell] * nlayers)
-            else:
-                self.rnncell = MultiRNNCell([cell(**kwargs, name='lstm_{}'.format(i))
-                                             for i in range(nlayers)])
-
-    def __call__(self, x, y, state, scope=None):
+        self.layers = build_layers(self.cell, cell, kwargs, nlayers, reuse)
+        self.rnncell = stack_layers(self.layers)
+        self.frozen_rnncell = stack_layers(self.layers, is_training=False)
+
+    def __call__(self, x, y, state, scope=None, is_training=True,
+                 num_samples=None):
+        """One step of the policy.
+
+        The proposal is deterministic, with num_samples it is repeated to
+        the [batch_size, num_samples, x_dim] block of the stochastic cells.
+        """
+        rnncell = self.rnncell if is_training else self.frozen_rnncell
         with tf.variable_scope(scope or 'multi_input_rnn'):
             x_dim = int(x.get_shape()[1])
             y = tf.tile(tf.reshape(y, [-1, 1]), [1, x_dim])
             inputs = tf.concat([x, y], axis=1, name='inputs')
-            output, nstate = self.rnncell(inputs, state)
+            output, nstate = rnncell(inputs, state)
             with tf.variable_scope('proj'):
                 w = tf.get_variable('proj_weight',
                     [self.cell.output_size.as_list()[0], x_dim])
                 b = tf.get_variable('proj_bias', [x_dim])
                 x = tf.matmul(output, w) + b
+            if num_samples is not None:
+                x = tf.tile(tf.expand_dims(x, 1), [1, num_samples, 1])
             return x, nstate
 
     def get_initial_state(self, batch_size, dtype=tf.float32):
@@ -83,36 +113,45 @@ class MultiInputRNNCell(RNNCell):
             return tuple([state] * self.nlayers)
 
 
+def sample_candidates(dist, num_samples=None):
+    """One sample of dist, or num_samples samples with the batch first."""
+    if num_samples is None:
+        return dist.sample()
+    return tf.transpose(dist.sample(num_samples), [1, 0, 2])
+
 class StochasticRNNCell(RNNCell):
     def __init__(self, cell, kwargs, nlayers=1, reuse=False):
         self.cell = cell(**kwargs, name="lstm")
         self.nlayers = nlayers
-        self.rnncell = self.cell
-        if nlayers > 1:
-            if reuse:
-                self.rnncell = MultiRNNCell([self.cell] * nlayers)
-            else:
-                self.rnncell = MultiRNNCell([cell(**kwargs, name='lstm_{}'.format(i))
-                                             for i in range(nlayers)])
-
-    def __call__(self, x, y, state, scope=None):
+        self.layers = build_layers(self.cell, cell, kwargs, nlayers, reuse)
+        self.rnncell = stack_layers(self.layers)
+        self.frozen_rnncell = stack_layers(self.layers, is_training=False)
+
+    def __call__(self, x, y, state, scope=None, is_training=True,
+                 num_samples=None):
+        """One step of the policy.
+
+        With num_samples the proposal distribution is sampled num_samples
+        times and x is a [batch_size, num_samples, x_dim] block of
+        candidates instead of one [batch_size, x_dim] proposal.
+        """
         hidden_size = self.cell.output_size.as_list()[0]
-        batch_size = x.get_shape().as_list()[0]
+        rnncell = self.rnncell if is_training else self.frozen_rnncell
         with tf.variable_scope(scope or 'multi_input_rnn'):
             x_dim = int(x.get_shape()[1])
             y = tf.tile(tf.reshape(y, [-1, 1]), [1, x_dim])
             inputs = tf.concat([x, y], axis=1, name='inputs')
-            output, nstate = self.rnncell(inputs, state)
+            output, nstate = rnncell(inputs, state)
             tot_dim = x_dim * (x_dim + 1)
             with tf.variable_scope('proj'):
                 w = tf.get_variable('proj_weight', [hidden_size, tot_dim])
                 b = tf.get_variable('proj_bias', [tot_dim])
                 out = tf.matmul(output, w) + b
                 mean, var = tf.split(out, [x_dim, x_dim ** 2], axis=1)
-                var = tf.reshape(var, [batch_size, x_dim, x_dim])
+                var = tf.reshape(var, [-1, x_dim, x_dim])
                 dist = tfp.distributions.MultivariateNormalTriL(
                     mean, var, name='x_dist')
-                x = dist.sample()
+                x = sample_candidates(dist, num_samples)
 
             return x, nstate
 
@@ -127,6 +166,72 @@ class StochasticRNNCell(RNNCell):
             return tuple([state] * self.nlayers)
 
 
+class CoordinatewiseRNNCell(RNNCell):
+    """Stochastic policy sharing one LSTM across all parameters.
+
+    Every parameter is a row of its own for the LSTM, with its current value
+    and the objective value as inputs. The projection sees the output of
+    its parameter and the mean output over all parameters, so the policy is
+    equivariant to permutations of the parameters and none of its variables
+    depends on their number: a model trained with one num_params runs with
+    any other. The proposal is a diagonal normal with a mean and a scale
+    per parameter.
+
+    The state is kept as [batch_size, ndim, hidden_size] blocks so that it
+    has the batch in its first dimension like the other cells.
+    """
+    def __init__(self, cell, kwargs, ndim, nlayers=1, reuse=False):
+        self.cell = cell(**kwargs, name="lstm")
+        self.ndim = ndim
+        self.nlayers = nlayers
+        self.layers = build_layers(self.cell, cell, kwargs, nlayers, reuse)
+        self.rnncell = stack_layers(self.layers)
+        self.frozen_rnncell = stack_layers(self.layers, is_training=False)
+
+    def __call__(self, x, y, state, scope=None, is_training=True,
+                 num_samples=None):
+        """One step of the policy, see StochasticRNNCell.__call__."""
+        hidden_size = self.cell.output_size.as_list()[0]
+        rnncell = self.rnncell if is_training else self.frozen_rnncell
+        with tf.variable_scope(scope or 'coordinatewise_rnn'):
+            x_dim = int(x.get_shape()[1])
+            y = tf.tile(tf.reshape(y, [-1, 1]), [1, x_dim])
+            inputs = tf.reshape(tf.stack([x, y], axis=2), [-1, 2], name='inputs')
+            # The time steps of batch-norm layers are scalars, only the
+            # hidden and cell blocks are reshaped
+            state = nest.map_structure(
+                lambda s: tf.reshape(s, [-1, hidden_size]) if s.shape.ndims else s,
+                state)
+            output, nstate = rnncell(inputs, state)
+            nstate = nest.map_structure(
+                lambda s: (tf.reshape(s, [-1, x_dim, hidden_size])
+                           if s.shape.ndims else s), nstate)
+
+            output = tf.reshape(output, [-1, x_dim, hidden_size])
+            pooled = tf.tile(tf.reduce_mean(output, axis=1, keep_dims=True),
+                             [1, x_dim, 1])
+            features = tf.reshape(tf.concat([output, pooled], axis=2),
+                                  [-1, 2 * hidden_size])
+            with tf.variable_scope('proj'):
+                w = tf.get_variable('proj_weight', [2 * hidden_size, 2])
+                b = tf.get_variable('proj_bias', [2])
+                out = tf.reshape(tf.matmul(features, w) + b, [-1, x_dim, 2])
+                mean, scale = tf.unstack(out, axis=2)
+                dist = tfp.distributions.Normal(
+                    mean, tf.nn.softplus(scale), name='x_dist')
+                x = sample_candidates(dist, num_samples)
+
+            return x, nstate
+
+    def get_initial_state(self, batch_size, dtype=tf.float32):
+        hidden_size = self.cell.output_size.as_list()[0]
+        zeros = tf.zeros([batch_size, self.ndim, hidden_size], dtype=dtype)
+        state = (zeros, zeros) + self.cell.get_initial_state(1, dtype)[2:]
+        if self.nlayers == 1:
+            return state
+        else:
+            return tuple([state] * self.nlayers)
+
 
 class LSTM(RNNCell):
     # Keys that may be provided for parameter initializers.
@@ -151,6 +256,7 @@ class LSTM(RNNCell):
                use_batch_norm_x=False,
                use_batch_norm_c=False,
                max_unique_stats=1,
+               fused=False,
                name="lstm"):
         super(LSTM, self).__init__()
         self.name_ = name
@@ -163,6 +269,7 @@ class LSTM(RNNCell):
         self._use_batch_norm_h = use_batch_norm_h
         self._use_batch_norm_x = use_batch_norm_x
         self._use_batch_norm_c = use_batch_norm_c
+        self._fused = fused
         self.possible_keys = self.get_possible_initializer_keys(use_peepholes=use_peepholes, use_batch_norm_h=use_batch_norm_h,
             use_batch_norm_x=use_batch_norm_x, use_batch_norm_c=use_batch_norm_c)
         self._initializers = util.check_initializers(initializers,
@@ -172,16 +279,23 @@ class LSTM(RNNCell):
         if max_unique_stats != 1 and not (
             use_batch_norm_h or use_batch_norm_x or use_batch_norm_c):
             raise ValueError("max_unique_stats specified but batch norm disabled")
+        if fused and (use_peepholes or use_batch_norm_h or use_batch_norm_x
+                      or use_batch_norm_c):
+            raise ValueError("The fused LSTM supports neither peepholes nor "
+                             "batch norm")
 
         if use_batch_norm_h:
-            self._batch_norm_h = LSTM.IndexedStatsBatchNorm(max_unique_stats,
-                                                          "batch_norm_h")
+            self._batch_norm_h = batch_norm.BatchNorm(
+                max_unique_stats, offset=False, scale=False,
+                name="batch_norm_h")
         if use_batch_norm_x:
-            self._batch_norm_x = LSTM.IndexedStatsBatchNorm(max_unique_stats,
-                                                          "batch_norm_x")
+            self._batch_norm_x = batch_norm.BatchNorm(
+                max_unique_stats, offset=False, scale=False,
+                name="batch_norm_x")
         if use_batch_norm_c:
-            self._batch_norm_c = LSTM.IndexedStatsBatchNorm(max_unique_stats,
-                                                          "batch_norm_c")
+            self._batch_norm_c = batch_norm.BatchNorm(
+                max_unique_stats, offset=False, scale=False,
+                name="batch_norm_c")
 
     def with_batch_norm_control(self, is_training=True, test_local_stats=True):
         return LSTM.CellWithExtraInput(self,
@@ -212,6 +326,20 @@ class LSTM(RNNCell):
             prev_hidden, prev_cell, time_step = prev_state
 
         self._create_gate_variables(inputs.get_shape(), inputs.dtype)
+        if self._fused:
+            # One LSTMBlockCell op instead of concat, matmul, split and the
+            # gate activations. It concatenates [inputs, hidden] and splits
+            # the gates as i, j, f, o like below, so it reads the same
+            # w_gates and b_gates (see test_fused_lstm). cell_clip=-1 turns
+            # its clipping off, the peephole weights are unused but required.
+            no_peephole = tf.zeros([self._hidden_size], dtype=inputs.dtype)
+            _, new_cell, _, _, _, _, new_hidden = gen_lstm_ops.lstm_block_cell(
+                x=inputs, cs_prev=prev_cell, h_prev=prev_hidden,
+                w=self._w_xh, wci=no_peephole, wcf=no_peephole,
+                wco=no_peephole, b=self._b, forget_bias=self._forget_bias,
+                cell_clip=-1, use_peephole=False)
+            return new_hidden, (new_hidden, new_cell)
+
         self._create_batch_norm_variables(inputs.dtype)
 
         if self._use_batch_norm_h or self._use_batch_norm_x:
@@ -321,11 +449,11 @@ class LSTM(RNNCell):
                 shape=[self._hidden_size + input_size, 4 * self._hidden_size],
                 dtype=dtype,
                 initializer=self._initializers.get(LSTM.W_GATES, initializer))
-            self._b = tf.get_variable(
-                LSTM.B_GATES,
-                shape=b_shape,
-                dtype=dtype,
-                initializer=self._initializers.get(LSTM.B_GATES, initializer))
+        self._b = tf.get_variable(
+            LSTM.B_GATES,
+            shape=b_shape,
+            dtype=dtype,
+            initializer=self._initializers.get(LSTM.B_GATES, initializer))
 
     def _create_peephole_variables(self, dtype):
         """Initialize the variables used for the peephole connections."""
@@ -347,23 +475,25 @@ class LSTM(RNNCell):
 
     def get_initial_state(self, batch_size, dtype=tf.float32, trainable=False,
                     trainable_initializers=None):
+        """Zero (or trainable) hidden and cell state.
 
-        if self._max_unique_stats == 1:
-            return super(LSTM, self).initial_state(
-                batch_size, dtype, trainable, trainable_initializers)
+        With per-step batch norm statistics the state also carries the
+        int32 time step, which starts at 0.
+        """
+
+        if not trainable:
+            zeros = tf.zeros([batch_size, self._hidden_size], dtype=dtype)
+            state = (zeros, zeros)
         else:
-            if not trainable:
-                state = super(rnn_core.RNNCore, self).zero_state(batch_size, dtype)
-            else:
-        # We have to manually create the state ourselves so we don't create a
-        # variable that never gets used for the third entry.
-                state = util.trainable_initial_state(
-                    batch_size,
-                    (tf.TensorShape([self._hidden_size]),
-                     tf.TensorShape([self._hidden_size])),
-                    dtype,
-                    trainable_initializers)
-            return (state[0], state[1], tf.constant(0, dtype=tf.int32))
+            state = util.trainable_initial_state(
+                batch_size,
+                (tf.TensorShape([self._hidden_size]),
+                 tf.TensorShape([self._hidden_size])),
+                dtype,
+                trainable_initializers)
+        if self._max_unique_stats == 1:
+            return tuple(state)
+        return (state[0], state[1], tf.constant(0, dtype=tf.int32))
 
     @property
     def state_size(self):
@@ -374,7 +504,7 @@ class LSTM(RNNCell):
         else:
             return (tf.TensorShape([self._hidden_size]),
                     tf.TensorShape([self._hidden_size]),
-                    tf.TensorShape(1))
+                    tf.TensorShape([]))
 
     @property
     def output_size(self):
@@ -401,27 +531,9 @@ class LSTM(RNNCell):
         """Boolean indicating whether batch norm for cell -> output is enabled."""
         return self._use_batch_norm_c
 
-    class IndexedStatsBatchNorm(object):
-        def __init__(self, max_unique_stats, name=None):
-            # super(LSTM.IndexedStatsBatchNorm, self).__init__()
-            self._max_unique_stats = max_unique_stats
-
-        def _build(self, inputs, index, is_training, test_local_stats):
-            def create_batch_norm():
-                return batch_norm.BatchNorm(offset=False, scale=False)(
-                    inputs, is_training, test_local_stats)
-
-            if self._max_unique_stats > 1:
-                pred_fn_pairs = [(tf.equal(i, index), create_batch_norm)
-                         for i in range(self._max_unique_stats - 1)]
-                out = tf.case(pred_fn_pairs, create_batch_norm)
-                out.set_shape(inputs.get_shape())  # needed for tf.case shape inference
-                return out
-            else:
-                return create_batch_norm()
-
     class CellWithExtraInput(RNNCell):
         def __init__(self, cell, *args, **kwargs):
+            super(LSTM.CellWithExtraInput, self).__init__()
             self._cell = cell
             self._args = args
             self._kwargs = kwargs
@@ -438,3 +550,41 @@ class LSTM(RNNCell):
         def output_size(self):
             """`tf.TensorShape` indicating the size of the core output."""
             return self._cell.output_size
+
+def test_fused_lstm(batch_size=4, input_size=3, hidden_size=5, seed=0):
+    """Check the fused LSTM against the unfused one on the same weights.
+
+    Random gate weights and biases cover the [inputs, hidden] concat order
+    and the i, j, f, o gate order, a forget_bias other than 1 its handling,
+    and a previous cell far outside [-3, 3] that no clipping is applied.
+    """
+
+    rng = np.random.RandomState(seed)
+    graph = tf.Graph()
+    with graph.as_default():
+        inputs = tf.constant(rng.normal(size=(batch_size, input_size)),
+                             dtype=tf.float32)
+        hidden = tf.constant(rng.normal(size=(batch_size, hidden_size)),
+                             dtype=tf.float32)
+        cell = tf.constant(10 * rng.normal(size=(batch_size, hidden_size)),
+                           dtype=tf.float32)
+        layers = [LSTM(hidden_size, forget_bias=0.5, fused=fused,
+                       name='lstm_fused' if fused else 'lstm_unfused')
+                  for fused in (False, True)]
+        states = [layer(inputs, (hidden, cell))[1] for layer in layers]
+
+        w_gates = rng.normal(size=(input_size + hidden_size, 4 * hidden_size))
+        b_gates = rng.normal(size=4 * hidden_size)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for layer in layers:
+                layer._w_xh.load(w_gates, sess)
+                layer._b.load(b_gates, sess)
+            (hidden, cell), (fused_hidden, fused_cell) = sess.run(states)
+
+    np.testing.assert_allclose(fused_hidden, hidden, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(fused_cell, cell, rtol=1e-5, atol=1e-6)
+    print('Fused and unfused LSTM agree')
+
+if __name__ == '__main__':
+    test_fused_lstm()
@@ -0,0 +1,197 @@
+import time
+import zmq # For message queues
+
+from protocol import JSONCodec, HEARTBEAT
+
+class TransportError(Exception):
+    pass
+
+class ZMQTransport:
+    """Poller-based REQ client for the Rxn Rover plugin.
+
+    Requests are sent without blocking and replies are polled for, so a
+    lost reply no longer hangs the optimizer: after recv_timeout the socket
+    is closed, reconnected and the request is sent again (the "lazy pirate"
+    pattern), up to max_retries times before a TransportError is raised.
+
+    Reactions can take hours, so recv_timeout is usually left at None
+    (wait forever). Liveness is then judged by an optional heartbeat
+    channel instead: when heartbeat_address is set, a SUB socket listens
+    for heartbeats published by the peer, and a request whose peer has been
+    silent for heartbeat_timeout is retried the same way.
+
+    Messages are encoded by a codec from protocol.py. The in-band heartbeat
+    of the plugin ("Marco") is answered ("Polo") while waiting for a reply,
+    and with codecs that carry sequence ids, replies to anything but the
+    current request are dropped.
+    """
+    def __init__(self, endpoint=None, socket=None, recv_timeout=None,
+                 max_retries=3, heartbeat_address=None, heartbeat_timeout=10000,
+                 codec=None, context=None, logger=None):
+        """
+        Args:
+            endpoint: Address of the plugin, e.g. tcp://127.0.0.1:5555
+            socket: Already connected REQ socket. Without an endpoint such a
+                    socket cannot be reconnected, so lost replies raise
+                    TransportError right away.
+            recv_timeout: Milliseconds to wait for a reply, None waits forever
+            max_retries: Number of times a request is resent
+            heartbeat_address: Address of the peer's heartbeat PUB socket
+            heartbeat_timeout: Milliseconds of heartbeat silence after which
+                               the peer is considered lost
+            codec: Codec of the wire format, JSONCodec by default
+            context: zmq.Context to create sockets with
+            logger: Logger for retry messages
+        """
+
+        self.endpoint = endpoint
+        self.recv_timeout = recv_timeout
+        self.max_retries = max_retries
+        self.heartbeat_timeout = heartbeat_timeout
+        self.logger = logger
+        self.codec = codec or JSONCodec()
+        self.context = context or zmq.Context.instance()
+        self.poller = zmq.Poller()
+        self.pending = None
+
+        self.socket = socket
+        if self.socket is None:
+            self.connect()
+        else:
+            self.poller.register(self.socket, zmq.POLLIN)
+
+        self.heartbeat = None
+        self.last_heartbeat = None
+        if heartbeat_address is not None:
+            self.heartbeat = self.context.socket(zmq.SUB)
+            self.heartbeat.setsockopt(zmq.SUBSCRIBE, b"")
+            self.heartbeat.connect(heartbeat_address)
+            self.poller.register(self.heartbeat, zmq.POLLIN)
+
+    def connect(self):
+        if self.endpoint is None:
+            raise TransportError("No endpoint to connect to")
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.connect(self.endpoint)
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def reconnect(self):
+        """Drop the socket, including any unsent message, and reconnect."""
+        self.poller.unregister(self.socket)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.close()
+        self.connect()
+
+    def submit(self, frames, seq=0):
+        """Send a request without waiting for the reply.
+
+        Args:
+            frames: bytes, or list of bytes for a multipart message
+            seq: Sequence id the reply has to carry
+        """
+
+        if not isinstance(frames, list):
+            frames = [frames]
+        self.pending = frames
+        self.seq = seq
+        self.retries = 0
+        self.sent_at = time.time()
+        # A peer we have never heard from counts as alive from now on
+        self.last_heartbeat = self.sent_at
+        self.socket.send_multipart(frames)
+
+    def poll(self, timeout=0):
+        """Check for the reply to the submitted request.
+
+        Args:
+            timeout: Milliseconds to wait, None waits until a reply arrives
+
+        Returns:
+            Decoded protocol.Message, or None if no reply is available yet
+        """
+
+        if self.pending is None:
+            raise TransportError("No request submitted")
+
+        start = time.time()
+        while True:
+            wait = self._poll_wait(timeout, start)
+            events = dict(self.poller.poll(wait))
+
+            if self.heartbeat is not None and self.heartbeat in events:
+                while self.heartbeat.poll(0):
+                    self.heartbeat.recv_multipart()
+                self.last_heartbeat = time.time()
+
+            if self.socket in events:
+                reply = self.codec.decode(self.socket.recv_multipart())
+                # Heartbeat response
+                if reply.kind == HEARTBEAT:
+                    self.socket.send_multipart(
+                        self.codec.encode_heartbeat_ack(reply.seq))
+                    continue
+                # Stale reply to an earlier request
+                if self.codec.has_seq and reply.seq != self.seq:
+                    if self.logger is not None:
+                        self.logger.warning("Dropping reply {} while waiting for {}".format(
+                            reply.seq, self.seq))
+                    continue
+                self.pending = None
+                return reply
+
+            if self._lost():
+                self._retry()
+                continue
+
+            if timeout is not None and (time.time() - start) * 1000 >= timeout:
+                return None
+
+    def request(self, frames, seq=0):
+        """Send a request and block until its reply arrives."""
+        self.submit(frames, seq)
+        return self.poll(timeout=None)
+
+    def close(self):
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.close()
+        if self.heartbeat is not None:
+            self.heartbeat.close()
+
+    def _poll_wait(self, timeout, start):
+        """Milliseconds the poller may sleep before something is due."""
+        waits = []
+        if timeout is not None:
+            waits.append(timeout - (time.time() - start) * 1000)
+        if self.recv_timeout is not None:
+            waits.append(self.recv_timeout - (time.time() - self.sent_at) * 1000)
+        if self.heartbeat is not None:
+            waits.append(self.heartbeat_timeout
+                         - (time.time() - self.last_heartbeat) * 1000)
+        if len(waits) == 0:
+            return None
+        return max(0, min(waits))
+
+    def _lost(self):
+        now = time.time()
+        if (self.recv_timeout is not None
+                and (now - self.sent_at) * 1000 >= self.recv_timeout):
+            return True
+        if (self.heartbeat is not None
+                and (now - self.last_heartbeat) * 1000 >= self.heartbeat_timeout):
+            return True
+        return False
+
+    def _retry(self):
+        if self.retries >= self.max_retries or self.endpoint is None:
+            self.pending = None
+            raise TransportError("No reply from {} after {} retries".format(
+                self.endpoint, self.retries))
+
+        self.retries += 1
+        if self.logger is not None:
+            self.logger.warning("No reply from {}, resending request ({}/{})".format(
+                self.endpoint, self.retries, self.max_retries))
+        self.reconnect()
+        self.sent_at = time.time()
+        self.last_heartbeat = self.sent_at
+        self.socket.send_multipart(self.pending)
@@ -5,7 +5,8 @@ import tensorflow as tf
 
 import rnn
 from model import Optimizer
-from shutil import copyfile
+from tensorflow.python.framework import tensor_shape
+from tensorflow.python.util import nest
 
 def run_epoch(sess, cost_op, ops, reset, num_unrolls):
     """Runs one optimization epoch."""
@@ -14,13 +15,50 @@ def run_epoch(sess, cost_op, ops, reset, num_unrolls):
         results = sess.run([cost_op] + ops)
     return results[0], results[1:]
 
-def create_model(sess, config, logger):
-    # Check if the save path exists and create it if it does not
-    if not config.save_path() == "":
-        if not os.path.exists(config.save_path()):
-            os.makedirs(config.save_path())
-    copyfile(config.file_name, os.path.join(config.save_path(), os.path.basename(config.file_name)))
-            
+def session_config(config):
+    """Session options from the thread settings of config."""
+    return tf.ConfigProto(
+        intra_op_parallelism_threads=config.intra_op_threads(),
+        inter_op_parallelism_threads=config.inter_op_threads())
+
+def make_epoch_runner(sess, model, num_unrolls):
+    """Returns a callable running one training epoch.
+
+    The callable returns the cost of the epoch and a dict with the
+    learning rate and the gradient norm (before clipping) of its last
+    update.
+
+    The reset of the problems for the next epoch is fused into the last
+    update of an epoch (model.reset_next), so an epoch takes num_unrolls
+    session calls instead of num_unrolls + 1. The calls go through
+    make_callable, which skips the feed and fetch handling of sess.run.
+    The problems have to be reset once with model.reset before the first
+    epoch.
+    """
+
+    step, loss, _, _, _ = model.step()
+    update = sess.make_callable([loss, step])
+    update_and_reset = sess.make_callable(
+        [loss, model.learning_rate, model.grad_norm, model.reset_next])
+
+    def run():
+        for _ in range(num_unrolls - 1):
+            update()
+        cost, lr, grad_norm, _ = update_and_reset()
+        return cost, {'learning_rate': lr, 'grad_norm': grad_norm}
+    return run
+
+def create_reaction(config, random, stage=None):
+    """Create the batch of simulated reactions the model is trained on.
+
+    Args:
+        random: Standard deviation of the instrument error, None for none.
+                The 'mixed' reactions take the error from the curriculum
+                stage and only check this for None.
+        stage: Curriculum stage of the 'mixed' reactions, the first stage
+               of the config by default
+    """
+
     if config.opt_direction() == 'max':
         problem_type = 'concave'
     else:
@@ -31,47 +69,130 @@ def create_model(sess, config, logger):
             batch_size=config.batch_size(),
             num_dims=config.num_params(),
             ptype=problem_type,
-            random=config.instrument_error())
+            random=random)
     elif config.reaction_type() == 'quad' and config.constraints() == True:
         rxn_yield = reactions.ConstraintQuadratic(
             batch_size=config.batch_size(),
             num_dims=config.num_params(),
             ptype=problem_type,
-            random=config.instrument_error())
+            random=random)
     elif config.reaction_type() == 'gmm':
         rxn_yield = reactions.GMM(
             batch_size=config.batch_size(),
             num_dims=config.num_params(),
-            random=config.instrument_error(),
+            random=random,
             cov=config.norm_cov())
+    elif config.reaction_type() == 'mixed':
+        rxn_yield = reactions.MixedReactions(
+            batch_size=config.batch_size(),
+            num_dims=config.num_params(),
+            ptype=problem_type,
+            cov=config.norm_cov(),
+            stage=stage or config.curriculum()[0],
+            random=random is not None)
+    else:
+        raise ValueError("Unknown reaction_type {}, expected 'quad', 'gmm' "
+                         "or 'mixed'".format(config.reaction_type()))
+    return rxn_yield
+
+def apply_curriculum(sess, model, config, epoch, resume=False):
+    """Switch the mixed reactions of model to the stage starting at epoch.
+
+    The problems of an epoch are drawn by the reset at the end of the
+    previous one, so a new stage shows up one epoch after it starts.
+
+    Args:
+        resume: Switch to the stage in effect at epoch even if it started
+                earlier, for the first epoch of a resumed run
+
+    Returns:
+        The new stage, None if no stage starts at epoch
+    """
+
+    if config.reaction_type() != 'mixed':
+        return None
+    current = None
+    for stage in config.curriculum():
+        if stage['epoch'] == epoch or (resume and stage['epoch'] <= epoch):
+            current = stage
+    if current is not None:
+        model.func.set_stage(sess, current)
+    return current
+
+def create_cell(config):
+    """Create the policy cell selected by policy of the config.
+
+    'srnn' and 'rnn' project onto all parameters at once, so their
+    checkpoints only fit the num_params they were trained with. 'crnn'
+    shares its weights across parameters and runs with any num_params.
+
+    With batch_norm, every step of an unroll gets its own normalization
+    statistics; steps past the unroll length share those of the last step.
+    """
+
+    kwargs = {'hidden_size':config.hidden_size()}
+    if config.batch_norm():
+        kwargs.update({'use_batch_norm_h':True,
+                       'use_batch_norm_x':True,
+                       'use_batch_norm_c':True,
+                       'max_unique_stats':config.unroll_length() + 1})
+    elif config.fused_lstm():
+        # The fused op has no batch norm, those models stay unfused
+        kwargs['fused'] = True
+
     if config.policy() == 'srnn':
-        cell = rnn.StochasticRNNCell(cell=rnn.LSTM,
-                                     kwargs=
-                                     {'hidden_size':config.hidden_size(),
-                                      'use_batch_norm_h':config.batch_norm(),
-                                      'use_batch_norm_x':config.batch_norm(),
-                                      'use_batch_norm_c':config.batch_norm(),},
+        cell = rnn.StochasticRNNCell(cell=rnn.LSTM, kwargs=kwargs,
                                      nlayers=config.num_layers(),
                                      reuse=config.reuse())
-    if config.policy() == 'rnn':
-        cell = rnn.MultiInputRNNCell(cell=rnn.LSTM,
-                                     kwargs=
-                                     {'hidden_size':config.hidden_size(),
-                                      'use_batch_norm_h':config.batch_norm(),
-                                      'use_batch_norm_x':config.batch_norm(),
-                                      'use_batch_norm_c':config.batch_norm(),},
+    elif config.policy() == 'rnn':
+        cell = rnn.MultiInputRNNCell(cell=rnn.LSTM, kwargs=kwargs,
                                      nlayers=config.num_layers(),
                                      reuse=config.reuse())
+    elif config.policy() == 'crnn':
+        cell = rnn.CoordinatewiseRNNCell(cell=rnn.LSTM, kwargs=kwargs,
+                                         ndim=config.num_params(),
+                                         nlayers=config.num_layers(),
+                                         reuse=config.reuse())
+    else:
+        raise ValueError("Unknown policy {}, expected 'srnn', 'rnn' or "
+                         "'crnn'".format(config.policy()))
+    return cell
+
+def saved_config_path(config):
+    """Path of the config saved next to the checkpoints of a model."""
+    return os.path.join(config.save_path(), os.path.basename(config.file_name))
+
+def create_model(sess, config, logger, chief=True):
+    """Build the training model and restore or initialize its variables.
+
+    Only the chief prepares the save path and restores checkpoints, other
+    workers of parallel_train.py initialize fresh variables that are then
+    overwritten with the chief's.
+    """
+
+    # Check if the save path exists and create it if it does not
+    if chief:
+        if not config.save_path() == "":
+            if not os.path.exists(config.save_path()):
+                os.makedirs(config.save_path())
+        # The resolved config, with its bases and overrides applied
+        config.dump(saved_config_path(config))
+            
+    rxn_yield = create_reaction(config, config.instrument_error())
+
+    cell = create_cell(config)
     model = Optimizer(cell=cell, logger=logger, func=rxn_yield,
                       ndim=config.num_params(), batch_size=config.batch_size(),
                       unroll_len=config.unroll_length(), lr=config.learning_rate(),
                       loss_type=config.loss_type(), optimizer=config.optimizer(),
                       trainable_init=config.trainable_init(),
                       direction=config.opt_direction(), constraints=config.constraints(),
-                      discount_factor=config.discount_factor())
+                      discount_factor=config.discount_factor(),
+                      lr_schedule=config.lr_schedule(), lr_decay=config.lr_decay(),
+                      lr_decay_steps=config.lr_decay_steps())
     
     ckpt = tf.train.get_checkpoint_state(config.save_path())
-    if ckpt and ckpt.model_checkpoint_path:
+    if chief and ckpt and ckpt.model_checkpoint_path:
         logger.info('Reading model parameters from {}.'.format(
             ckpt.model_checkpoint_path))
         model.saver.restore(sess, ckpt.model_checkpoint_path)
@@ -83,55 +204,18 @@ def create_model(sess, config, logger):
 def load_model(sess, config, logger):
     assert(os.path.exists(config.save_path()))
 
-    if config.opt_direction() == 'max':
-        problem_type = 'concave'
-    else:
-        problem_type = 'convex'
-
-    if config.reaction_type() == 'quad' and config.constraints() == False:
-        rxn_yield = reactions.Quadratic(
-            batch_size=config.batch_size(),
-            num_dims=config.num_params(),
-            ptype=problem_type(),
-            random=config.instrument_error())
-    elif config.reaction_type() == 'quad' and config.constraints() == True:
-        rxn_yield = reactions.ConstraintQuadratic(
-            batch_size=config.batch_size(),
-            num_dims=config.num_params(),
-            ptype=problem_type(),
-            random=config.instrument_error())
-    elif config.reaction_type() == 'gmm':
-        rxn_yield = reactions.GMM(
-            batch_size=config.batch_size(),
-            num_dims=config.num_params(),
-            random=config.instrument_error(),
-            cov=config.norm_cov())
+    rxn_yield = create_reaction(config, config.instrument_error())
 
-    if config.policy() == 'srnn':
-        cell = rnn.StochasticRNNCell(cell=rnn.LSTM,
-                                     kwargs=
-                                     {'hidden_size':config.hidden_size(),
-                                      'use_batch_norm_h':config.batch_norm(),
-                                      'use_batch_norm_x':config.batch_norm(),
-                                      'use_batch_norm_c':config.batch_norm(),},
-                                     nlayers=config.num_layers(),
-                                     reuse=config.reuse())
-    if config.policy() == 'rnn':
-        cell = rnn.MultiInputRNNCell(cell=rnn.LSTM,
-                                     kwargs=
-                                     {'hidden_size':config.hidden_size(),
-                                      'use_batch_norm_h':config.batch_norm(),
-                                      'use_batch_norm_x':config.batch_norm(),
-                                      'use_batch_norm_c':config.batch_norm(),},
-                                     nlayers=config.num_layers(),
-                                     reuse=config.reuse())
+    cell = create_cell(config)
     model = Optimizer(cell=cell, logger=logger, func=rxn_yield,
                       ndim=config.num_params(), batch_size=config.batch_size(),
                       unroll_len=config.unroll_length(), lr=config.learning_rate(),
                       loss_type=config.loss_type(), optimizer=config.optimizer(),
                       trainable_init=config.trainable_init(),
                       direction=config.opt_direction(), constraints=config.constraints(),
-                      discount_factor=config.discount_factor())
+                      discount_factor=config.discount_factor(),
+                      lr_schedule=config.lr_schedule(), lr_decay=config.lr_decay(),
+                      lr_decay_steps=config.lr_decay_steps())
 
 
     ckpt = tf.train.get_checkpoint_state(config.save_path())
@@ -0,0 +1,105 @@
+"""Packed, memory-mapped store of the inference weights of a policy.
+
+A store is a single file:
+
+    MAGIC (8 bytes) | index length (uint64, little endian) | JSON index |
+    padding | array | padding | array | ...
+
+The index maps every variable name to its dtype, shape and byte offset.
+Arrays start on ALIGNMENT byte boundaries and are stored C-contiguous, so
+the reader maps the whole file once and hands out read-only views into
+the mapping: nothing is parsed or copied, cold start does not depend on
+checkpoint size, and processes on one host share the pages of one file.
+Only the variables of the inference graph are written, not the optimizer
+slots and training problems of a checkpoint.
+"""
+
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b'DROWTS01'
+ALIGNMENT = 64
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def write_weight_store(weights, path):
+    """Write a dict of arrays to a store at path.
+
+    The file is written next to path and renamed over it, so readers never
+    map a half-written store.
+    """
+
+    arrays = {name: np.asarray(value, order='C')
+              for name, value in sorted(weights.items())}
+
+    # Offsets are relative to the start of the data section, which begins
+    # at the first aligned offset after the index
+    index = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        index[name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                       'offset': offset}
+        offset += array.nbytes
+    header = json.dumps({'alignment': ALIGNMENT, 'arrays': index}).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + index[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + _aligned(offset))
+    os.replace(tmp_path, path)
+
+def is_weight_store(path):
+    """Check if path is a file starting with the store magic."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def load_weight_store(path):
+    """Map a store into memory without copying.
+
+    Returns:
+        dict mapping variable names to read-only arrays backed by the file
+    """
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a weight store'.format(path))
+        header_size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size).decode())
+    data_start = _aligned(len(MAGIC) + 8 + header_size)
+
+    image = np.memmap(path, dtype=np.uint8, mode='r')
+    weights = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        start = data_start + entry['offset']
+        weights[name] = image[start:start + count * dtype.itemsize].view(
+            dtype).reshape(tuple(entry['shape']))
+    return weights
+
+def restore_from_store(sess, path, var_list):
+    """Set TensorFlow variables from a store, matched by variable name.
+
+    Used instead of Saver.restore; the values are copied into the session
+    once, without reading a checkpoint.
+    """
+
+    weights = load_weight_store(path)
+    missing = [var.op.name for var in var_list if var.op.name not in weights]
+    if missing:
+        raise KeyError('Variables missing from the weight store {}: {}'.format(
+            path, ', '.join(missing)))
+    for var in var_list:
+        var.load(weights[var.op.name], sess)
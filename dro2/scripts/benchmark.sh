@@ -0,0 +1,14 @@
+#!/bin/bash
+
+# Activate the virtual environment
+source ../venv/bin/activate
+
+# Compare the trained policy (exported with --format npz) against GPOpt and
+# random search, writing the report to ../output/benchmark.json.
+# Extra arguments are passed on, e.g. --baseline ../output/baseline.json
+python "../dro2/benchmark.py" --optimizers random gp dro \
+    --config "../config/default-config.json" \
+    --output "../output/benchmark.json" "$@"
+
+# Deactivate the virtual environment when finished
+deactivate
@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# Activate the virtual environment
+source ../venv/bin/activate
+
+# Freeze the trained model into ../output/ckpt/default/frozen_graph.pb
+python "../dro2/export_model.py" "../config/default-config.json"
+
+# Deactivate the virtual environment when finished
+deactivate
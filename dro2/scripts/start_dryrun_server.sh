@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Activate the virtual environment
+source ../venv/bin/activate
+
+# Answer the optimizer with simulated yields instead of the LabVIEW plugin,
+# writing latency and throughput statistics to ../output/dryrun.json.
+# Extra arguments are passed on, e.g. --problem gmm --latency 5 20
+python "../dro2/dryrun_server.py" "../config/default-config.json" \
+    --report "../output/dryrun.json" "$@"
+
+# Deactivate the virtual environment when finished
+deactivate
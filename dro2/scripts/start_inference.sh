@@ -3,8 +3,15 @@
 # Activate the virtual environment
 source ../venv/bin/activate
 
+# Use the frozen graph written by export_model.sh when one is available
+FROZEN_GRAPH="../output/ckpt/default/frozen_graph.pb"
+
 # Run the Python optimizer using the default "python" command *must be in PATH*
-python "../dro2/realreaction.py" "../config/default-config.json"
+if [ -f "$FROZEN_GRAPH" ]; then
+    python "../dro2/realreaction.py" "../config/default-config.json" --frozen_graph "$FROZEN_GRAPH"
+else
+    python "../dro2/realreaction.py" "../config/default-config.json"
+fi
 
 # Deactivate the virtual environment when finished
 deactivate
@@ -0,0 +1,16 @@
+#!/bin/bash
+
+# Activate the virtual environment
+source ../venv/bin/activate
+
+# Run the TensorFlow-free optimizer on the weights written by
+# "python ../dro2/export_model.py <config> --format npz"
+python "../dro2/np_policy.py" "../config/default-config.json"
+
+# Deactivate the virtual environment when finished
+deactivate
+
+# Pause after the script is finished for debugging
+if [ "$1" = "DEBUG" ]; then
+    read -n1 -r -p "Press 'y' key to continue..." key
+fi
@@ -42,6 +42,11 @@ python ../dro2/lets_start.py ../config/default-config.json > ../output/OUTPUT_de
 
 # python ../dro2/lets_start.py ../config/example_config.json > ../output/OUTPUT_example
 
+# To use several CPU cores, train with parallel_train.py instead. Every worker
+# process adds its own batch of batch_size reactions to each update.
+
+# python ../dro2/parallel_train.py ../config/default-config.json --workers 4 > ../output/OUTPUT_default
+
 
 # Deactivate the venv
 deactivate